@@ -0,0 +1,168 @@
+"""
+incremental adaptation of a trained target model to newly labeled pixels, instead of a cold run from
+weights_init. The new pixels are merged with the support samples of the best weights of a seed into the
+labeled target pool and the 1-NN support set, then the mapping layers and the encoder are fine-tuned
+from those weights for a short budget of episodes:
+
+    python adapt.py --config config/Indian_pines.py --checkpoint checkpoints/16way_5shot_IP/seed0_best.pth --new_labels new_labels.csv --budget 300
+
+With --budget 0 and an embedding store (export_embeddings.py) nothing is trained: the new samples are
+added to the support set of the store and only the pixels they can change are re-scored.
+--compare also runs a full retrain on the same labels and reports the time-to-accuracy of both.
+
+new_labels.csv has one "row,column,class" line per pixel, in image coordinates with 0-based classes.
+"""
+import argparse
+import copy
+import imp
+import json
+import math
+import os
+import time
+import numpy as np
+
+import train
+from utils import utils, checkpoint, storage, inference, embedding_store
+from utils.dataloader import TARGET_LOADERS
+
+
+def read_new_labels(path):
+    table = np.loadtxt(path, delimiter=',', dtype=np.int64, ndmin=2)
+    return table[:, :2], table[:, 2]
+
+def merged_split(config, scene, state, new_pixels, new_labels):
+    """
+    split in the format of train.prepare_split whose labeled set is the support set of `state` plus the
+    new pixels; the test set is every labeled pixel of the scene that is not a support pixel
+    """
+    train_opt = config['train_config']
+    _, _, train_in_randperm = TARGET_LOADERS[config['target_type']]
+    data = np.concatenate([storage.upcast(state['support_data']), scene.cut(new_pixels[:, 0], new_pixels[:, 1])])
+    labels = np.concatenate([np.asarray(state['support_labels'], dtype=np.int64), new_labels])
+    pixels = new_pixels if state.get('support_pixels') is None else np.concatenate([state['support_pixels'], new_pixels])
+    # the pools of get_target_pools take the samples of a class as one contiguous block
+    order = np.argsort(labels, kind='stable')
+    data, labels = data[order], labels[order]
+
+    labeled = np.ravel_multi_index((scene.Row - scene.HalfWidth, scene.Column - scene.HalfWidth), scene.shape)
+    is_support = np.isin(labeled, np.ravel_multi_index(pixels.T, scene.shape))
+    train_index = np.flatnonzero(is_support) if train_in_randperm else np.zeros(0, dtype=np.int64)
+    test_index = np.flatnonzero(~is_support)
+    np.random.shuffle(test_index)
+
+    # as in get_train_test_loader, the smallest class is repeated up to about 200 samples
+    nlabeled = np.bincount(labels)[np.unique(labels)].min()
+    da_repeat = math.ceil((200 - nlabeled) / nlabeled) + 1
+    return {'train_data': storage.to_storage(data, train_opt['storage_dtype']), 'train_labels': labels,
+            'test_data': storage.to_storage(scene.get_patches(test_index), train_opt['storage_dtype']), 'test_labels': scene.labels[test_index],
+            'da_data': storage.to_storage(data, train_opt['storage_dtype']), 'da_labels': labels, 'da_repeat': da_repeat,
+            'G': scene.G, 'RandPerm': np.concatenate([train_index, test_index]), 'Row': scene.Row, 'Column': scene.Column,
+            'nTrain': len(train_index), 'rng': checkpoint.get_rng_state()}
+
+def time_to_accuracy(history, accuracy):
+    """
+    first evaluation of a run that reached `accuracy`
+    """
+    for entry in history:
+        if entry['accuracy'] >= accuracy:
+            return entry
+    return None
+
+def run(config, name, output, episode, warm_start, args, source, split, seed):
+    config = copy.deepcopy(config)
+    train_opt = config['train_config']
+    train_opt['episode'] = episode
+    train_opt['warm_start'] = warm_start
+    train_opt['eval_interval'] = args.eval_interval
+    train_opt['early_stop_patience'] = 0
+    # the best weights are only written with checkpointing on, the run state is never written
+    train_opt['checkpoint_interval'] = episode
+    if args.lr > 0:
+        train_opt['lr'] = args.lr
+    config['log_dir'] = os.path.join(output, name)
+    config['checkpoint_dir'] = os.path.join(output, name)
+    config['map_name'] = os.path.abspath(os.path.join(output, name, 'map_{}shot.png'))
+    train_args = argparse.Namespace(resume=False, profile_memory=False, world_size=1)
+    start = time.time()
+    result = train.train_target(config, source['metatrain_data'], source['semantic_mapping_src'], source['semantic_mapping_tar'],
+                                train_args, seeds=[seed], splits=[split])
+    result['wall_time'] = time.time() - start
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental target adaptation")
+    parser.add_argument('--config', type=str, default=os.path.join('./config', 'Indian_pines.py'))
+    parser.add_argument('--checkpoint', type=str, required=True, help='seed<i>_best.pth written by train.py')
+    parser.add_argument('--new_labels', type=str, required=True, help='csv of row,column,class')
+    parser.add_argument('--budget', type=int, default=300, help='fine-tuning episodes, 0 only merges the support set')
+    parser.add_argument('--eval_interval', type=int, default=100)
+    parser.add_argument('--lr', type=float, default=0, help='fine-tuning learning rate, 0 keeps the config value')
+    parser.add_argument('--store', type=str, default=None, help='embedding store of the checkpoint, re-scored incrementally when --budget is 0')
+    parser.add_argument('--mode', type=str, default='knn', choices=['knn', 'prototype'], help='classifier of the store')
+    parser.add_argument('--compare', action='store_true', help='also retrain from scratch on the same labels')
+    parser.add_argument('--full_episode', type=int, default=0, help='episodes of the full retrain, 0 keeps the config value')
+    parser.add_argument('--output', type=str, default=os.path.join('./checkpoints', 'adapt_' + time.strftime('%Y-%m-%d_%H-%M-%S')))
+    args = parser.parse_args()
+
+    config = imp.load_source("", args.config).config
+    state = checkpoint.load(args.checkpoint)
+    if state is None or 'support_data' not in state:
+        raise ValueError('{} is not a best weights file with support samples'.format(args.checkpoint))
+    new_pixels, new_labels = read_new_labels(args.new_labels)
+    print('{} support samples + {} new labeled pixels, classes {}'.format(
+        len(state['support_labels']), len(new_labels), np.bincount(new_labels).tolist()))
+
+    if args.budget == 0:
+        if args.store is None:
+            raise ValueError('--budget 0 needs an embedding --store to re-score')
+        predictor = inference.Predictor(args.checkpoint)
+        scene = inference.load_scene(config, predictor.bands)
+        start = time.time()
+        features = predictor.features(scene.cut(new_pixels[:, 0], new_pixels[:, 1]))
+        predict, rescored = embedding_store.add_support(args.store, features, new_labels, new_pixels, args.mode)
+        print('{} of {} pixels re-scored in {:.2f}s'.format(rescored.sum(), len(rescored), time.time() - start))
+        store = embedding_store.load(args.store)
+        if np.any(store['labels'] >= 0):
+            result = embedding_store.evaluate(store, predict)
+            print('OA {:.2f}  AA {:.2f}  kappa {:.2f}  on {} test pixels'.format(result['OA'], result['AA'], result['kappa'], result['num_test']))
+        return
+
+    scene = inference.load_scene(config)
+    seed = state['seed']
+    utils.same_seeds(seed)
+    split = merged_split(config, scene, state, new_pixels, new_labels)
+    del scene
+
+    start = time.time()
+    semantic_mapping_src, semantic_mapping_tar = train.encode_labels([train.labels_src, config['labels_tar']])
+    source = {'metatrain_data': train.load_source(config['data_path'], config['source_data'], config['train_config']['storage_dtype']),
+              'semantic_mapping_src': semantic_mapping_src, 'semantic_mapping_tar': semantic_mapping_tar}
+    print('source and label embeddings loaded in {:.1f}s'.format(time.time() - start))
+
+    results = {'adapted': run(config, 'adapted', args.output, args.budget, args.checkpoint, args, source, split, seed)}
+    if args.compare:
+        full_episode = args.full_episode if args.full_episode > 0 else config['train_config']['episode']
+        results['full'] = run(config, 'full', args.output, full_episode, '', args, source, split, seed)
+
+    target = results['adapted']['OA']
+    report = {'checkpoint': args.checkpoint, 'new_labels': int(len(new_labels)), 'budget': args.budget, 'runs': {}}
+    for name, result in results.items():
+        reached = time_to_accuracy(result['history'], target)
+        report['runs'][name] = {'OA': result['OA'], 'AA': result['AA'], 'kappa': result['kappa'],
+                                'train_time': result['train_time'], 'wall_time': result['wall_time'],
+                                'time_to_adapted_OA': reached['time'] if reached else None,
+                                'episode_to_adapted_OA': reached['episode'] if reached else None,
+                                'history': result['history']}
+        print('{:<8s} OA {:6.2f}  AA {:6.2f}  kappa {:6.2f}  train {:8.1f}s  reached OA {:.2f} at {}'.format(
+            name, result['OA'], result['AA'], result['kappa'], result['train_time'], target,
+            'episode {} after {:.1f}s'.format(reached['episode'], reached['time']) if reached else 'never'))
+    print('adapted weights: {}'.format(os.path.join(args.output, 'adapted')))
+    if args.store:
+        print('the fine-tuned encoder changes every embedding, export a new store with export_embeddings.py')
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+    with open(os.path.join(args.output, 'adapt_report.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
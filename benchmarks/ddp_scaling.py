@@ -0,0 +1,172 @@
+"""
+scaling of the data parallel training step (train.py --world_size N) from 1 to N cpu processes.
+Every rank runs the episode step on synthetic tensors with the real shapes: source and target
+episodes through their mapping and the encoder, the masked ssl batch, backward, gradient
+all_reduce and the optimizer step. The cores are split evenly between the ranks, so the
+efficiency is measured at a fixed machine size:
+
+    python -m benchmarks.ddp_scaling --world_sizes 1 2 4 8 --steps 50 --output ddp.json
+
+--smoke runs the real train.train_target instead, a few episodes of one seed on a small synthetic
+scene, with config['gpu'] = 'cpu' and --world_size 2:
+
+    python -m benchmarks.ddp_scaling --smoke
+"""
+import argparse
+import copy
+import imp
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import torch
+import torch.nn.functional as F
+import torch.multiprocessing as mp
+
+import train
+from model.mapping import Mapping
+from model.encoder import Encoder
+from utils import utils, loss_function, distributed
+from benchmarks.storage import synthetic_scene
+from benchmarks.hot_paths import NUM_WAYS, SHOT_NUM_PER_CLASS, QUERY_NUM_PER_CLASS, N_DIMENSION, PATCH_SIZE, EMB_SIZE, SSL_BATCH_SIZE, _git_commit
+
+
+def run_rank(rank, world_size, steps, warmup, threads, port, queue):
+    distributed.init(rank, world_size, port, threads)
+    utils.same_seeds(1224 + 10000 * rank)
+
+    mapping_src = Mapping(128, N_DIMENSION)
+    mapping_tar = Mapping(200, N_DIMENSION)
+    encoder = Encoder(n_dimension=N_DIMENSION, patch_size=PATCH_SIZE, emb_size=EMB_SIZE, dropout=0.3)
+    modules = [mapping_src, mapping_tar, encoder]
+    for module in modules:
+        module.apply(utils.weights_init)
+    distributed.broadcast_parameters(modules)
+    optimizer = torch.optim.SGD([p for module in modules for p in module.parameters()], lr=1e-3, momentum=0.9)
+    supcon = loss_function.SupConLoss(temperature=0.1)
+
+    num_support = NUM_WAYS * SHOT_NUM_PER_CLASS
+    num_query = NUM_WAYS * QUERY_NUM_PER_CLASS
+    query_labels = torch.arange(NUM_WAYS).repeat_interleave(QUERY_NUM_PER_CLASS)
+    ssl_labels = torch.randint(0, 16, (SSL_BATCH_SIZE,))
+
+    def step():
+        loss = 0
+        for mapping, n_band in [(mapping_src, 128), (mapping_tar, 200)]:
+            support = encoder(mapping(torch.randn(num_support, n_band, PATCH_SIZE, PATCH_SIZE)))
+            query = encoder(mapping(torch.randn(num_query, n_band, PATCH_SIZE, PATCH_SIZE)))
+            loss = loss + F.cross_entropy(utils.euclidean_metric(query, support), query_labels)
+        features = encoder(mapping_tar(torch.randn(2 * SSL_BATCH_SIZE, 200, PATCH_SIZE, PATCH_SIZE)))
+        features = F.normalize(features, dim=1).view(2, SSL_BATCH_SIZE, -1).transpose(0, 1)
+        loss = loss + supcon(features, ssl_labels, device='cpu')
+        optimizer.zero_grad()
+        loss.backward()
+        start = time.perf_counter()
+        distributed.all_reduce_gradients(modules)
+        reduce_time = time.perf_counter() - start
+        optimizer.step()
+        return reduce_time
+
+    for _ in range(warmup):
+        step()
+    torch.distributed.barrier()
+    start = time.perf_counter()
+    reduce_time = sum(step() for _ in range(steps))
+    torch.distributed.barrier()
+    elapsed = time.perf_counter() - start
+
+    if rank == 0:
+        queue.put({'world_size': world_size,
+                   'threads_per_rank': torch.get_num_threads(),
+                   'steps': steps,
+                   'seconds': elapsed,
+                   'step_ms': 1000. * elapsed / steps,
+                   'all_reduce_ms': 1000. * reduce_time / steps,
+                   'episodes_per_s': world_size * steps / elapsed})
+    distributed.cleanup()
+
+def smoke_config(workdir, episodes):
+    """
+    Indian Pines config on a synthetic (40, 40, 200) scene written as .npy files, on the cpu
+    """
+    config = copy.deepcopy(imp.load_source("", os.path.join('config', 'Indian_pines.py')).config)
+    data, ground_truth = synthetic_scene(shape=(40, 40, 200))
+    os.makedirs(os.path.join(workdir, 'smoke'))
+    np.save(os.path.join(workdir, 'smoke', 'image.npy'), data.astype(np.float32))
+    np.save(os.path.join(workdir, 'smoke', 'gt.npy'), ground_truth)
+    config.update({'data_path': workdir, 'target_data': 'smoke/image.npy', 'target_data_gt': 'smoke/gt.npy', 'gpu': 'cpu',
+                   'log_dir': os.path.join(workdir, 'logs'), 'checkpoint_dir': os.path.join(workdir, 'checkpoints')})
+    config['train_config'].update({'episode': episodes, 'eval_interval': episodes, 'min_episode': 0, 'checkpoint_interval': 0,
+                                   'timing_interval': 0, 'band_select_episode': episodes + 1, 'ssl_batch_size': 16})
+    return config
+
+def smoke_rank(rank, world_size, port, workdir, config, args):
+    # the SummaryWriter and the classification map write below the working directory
+    os.chdir(workdir)
+    distributed.init(rank, world_size, port, 1)
+    num_source_classes = 18
+    source = {i: [np.random.randn(128, PATCH_SIZE, PATCH_SIZE).astype(np.float32) for _ in range(SHOT_NUM_PER_CLASS + QUERY_NUM_PER_CLASS)]
+              for i in range(num_source_classes)}
+    semantic_src = np.random.randn(num_source_classes, 768).astype(np.float32)
+    semantic_tar = np.random.randn(config['train_config']['tar_class_num'], 768).astype(np.float32)
+    train.train_target(config, source, semantic_src, semantic_tar, args, rank=rank, seeds=train.SEEDS[:1])
+    distributed.cleanup()
+
+def smoke(world_size, port, episodes):
+    """
+    a few data parallel episodes of train.train_target on the cpu, raises when a rank fails
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        os.makedirs(os.path.join(workdir, 'classificationMap'))
+        config = smoke_config(workdir, episodes)
+        args = train.get_parser().parse_args(['--world_size', str(world_size), '--threads', '1', '--dist_port', str(port)])
+        start = time.perf_counter()
+        mp.spawn(smoke_rank, args=(world_size, port, workdir, config, args), nprocs=world_size, join=True)
+        print('smoke run: {} episodes on {} cpu ranks in {:.1f}s'.format(episodes, world_size, time.perf_counter() - start))
+
+def main():
+    parser = argparse.ArgumentParser(description="Data parallel scaling benchmark")
+    parser.add_argument('--world_sizes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--steps', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=0, help='torch threads per rank, 0 splits the cores between the ranks')
+    parser.add_argument('--port', type=int, default=29511)
+    parser.add_argument('--output', type=str, default=None)
+    parser.add_argument('--smoke', action='store_true', help='run a few episodes of train.train_target with --world_size 2 on the cpu instead')
+    parser.add_argument('--smoke_episodes', type=int, default=4)
+    args = parser.parse_args()
+
+    if args.smoke:
+        smoke(2, args.port, args.smoke_episodes)
+        return
+
+    ctx = mp.get_context('spawn')
+    results = []
+    for i, world_size in enumerate(args.world_sizes):
+        queue = ctx.SimpleQueue()
+        mp.spawn(run_rank, args=(world_size, args.steps, args.warmup, args.threads, args.port + i, queue), nprocs=world_size, join=True)
+        results.append(queue.get())
+
+    # efficiency of N ranks against N times the throughput of the smallest run
+    base = results[0]
+    for result in results:
+        result['speedup'] = result['episodes_per_s'] / base['episodes_per_s']
+        result['efficiency'] = result['speedup'] * base['world_size'] / result['world_size']
+        print('world_size {:>3d}  threads/rank {:>3d}  step {:>9.2f} ms  all_reduce {:>7.2f} ms  {:>8.1f} episodes/s  speedup {:>5.2f}  efficiency {:>5.2f}'.format(
+            result['world_size'], result['threads_per_rank'], result['step_ms'], result['all_reduce_ms'],
+            result['episodes_per_s'], result['speedup'], result['efficiency']))
+
+    report = {'meta': {'commit': _git_commit(),
+                       'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'torch': torch.__version__,
+                       'cpu_count': os.cpu_count()},
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
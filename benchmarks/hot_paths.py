@@ -0,0 +1,261 @@
+"""
+micro-benchmarks of the training hot paths on synthetic tensors with the real shapes
+(5 ways, 1 shot, 19 queries, 100 band mapped input, 7x7 patches).
+Results are printed and written as json so that runs on different commits can be compared.
+
+    python -m benchmarks.hot_paths --device cpu --output bench.json
+    python -m benchmarks.hot_paths --only encoder mapping
+    python -m benchmarks.hot_paths --only step
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+import numpy as np
+
+import torch
+
+from model.mapping import Mapping
+from model.encoder import Encoder
+from model import batched
+from utils import utils, loss_function, profiling
+from utils.dataloader import Task, get_HBKC_data_loader, get_train_test_loader, TargetScene
+
+NUM_WAYS = 5
+SHOT_NUM_PER_CLASS = 1
+QUERY_NUM_PER_CLASS = 19
+N_DIMENSION = 100
+PATCH_SIZE = 7
+EMB_SIZE = 128
+SSL_BATCH_SIZE = 64
+
+
+def _sync(device):
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+
+def bench(name, fn, items, device, repeat, warmup=2):
+    """
+    time fn() `repeat` times after `warmup` untimed calls
+    :param items: number of samples processed by one call, used for the throughput
+    """
+    for _ in range(warmup):
+        fn()
+    _sync(device)
+
+    profiling.reset_peak_rss()
+    if device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+    tracemalloc.start()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        _sync(device)
+        times.append(time.perf_counter() - start)
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    times = np.array(times)
+    result = {'name': name,
+              'repeat': repeat,
+              'items': items,
+              'mean_ms': 1000. * times.mean(),
+              'std_ms': 1000. * times.std(),
+              'min_ms': 1000. * times.min(),
+              'throughput': items / times.mean(),
+              'peak_tracemalloc_mb': peak_traced / 1024. / 1024.,
+              'peak_rss_mb': profiling.peak_rss_mb()}
+    if device.type == 'cuda':
+        result['peak_device_mb'] = torch.cuda.max_memory_allocated(device) / 1024. / 1024.
+    return result
+
+def bench_encoder(device, repeat):
+    encoder = Encoder(n_dimension=N_DIMENSION, patch_size=PATCH_SIZE, emb_size=EMB_SIZE, dropout=0.3).to(device)
+    encoder.apply(utils.weights_init)
+    encoder.train()
+    num_query = NUM_WAYS * QUERY_NUM_PER_CLASS
+    x = torch.randn(num_query, N_DIMENSION, PATCH_SIZE, PATCH_SIZE, device=device)
+
+    def forward():
+        with torch.no_grad():
+            encoder(x)
+
+    def forward_backward():
+        encoder.zero_grad()
+        encoder(x).sum().backward()
+
+    return [bench('encoder_forward', forward, num_query, device, repeat),
+            bench('encoder_forward_backward', forward_backward, num_query, device, repeat)]
+
+def bench_mapping(device, repeat):
+    results = []
+    num_query = NUM_WAYS * QUERY_NUM_PER_CLASS
+    for in_dimension in [128, 144, 200]:
+        mapping = Mapping(in_dimension, N_DIMENSION).to(device)
+        mapping.apply(utils.weights_init)
+        x = torch.randn(num_query, in_dimension, PATCH_SIZE, PATCH_SIZE, device=device)
+
+        def forward_backward():
+            mapping.zero_grad()
+            mapping(x).sum().backward()
+
+        results.append(bench('mapping_{}_forward_backward'.format(in_dimension), forward_backward, num_query, device, repeat))
+    return results
+
+def bench_step(device, repeat, src_band=128, tar_band=200):
+    """
+    forward and backward of the mappings and the encoder in one training episode: five separate calls
+    as in train.py, or the batched step with and without per batch batch norm statistics
+    """
+    mapping_src = Mapping(src_band, N_DIMENSION).to(device)
+    mapping_tar = Mapping(tar_band, N_DIMENSION).to(device)
+    encoder = Encoder(n_dimension=N_DIMENSION, patch_size=PATCH_SIZE, emb_size=EMB_SIZE, dropout=0.3).to(device)
+    for module in [mapping_src, mapping_tar, encoder]:
+        module.apply(utils.weights_init)
+        module.train()
+    support_src = torch.randn(NUM_WAYS * SHOT_NUM_PER_CLASS, src_band, PATCH_SIZE, PATCH_SIZE, device=device)
+    query_src = torch.randn(NUM_WAYS * QUERY_NUM_PER_CLASS, src_band, PATCH_SIZE, PATCH_SIZE, device=device)
+    support_tar = torch.randn(NUM_WAYS * SHOT_NUM_PER_CLASS, tar_band, PATCH_SIZE, PATCH_SIZE, device=device)
+    query_tar = torch.randn(NUM_WAYS * QUERY_NUM_PER_CLASS, tar_band, PATCH_SIZE, PATCH_SIZE, device=device)
+    ssl = torch.randn(2 * SSL_BATCH_SIZE, tar_band, PATCH_SIZE, PATCH_SIZE, device=device)
+
+    def backward(features):
+        for module in [mapping_src, mapping_tar, encoder]:
+            module.zero_grad()
+        sum(f.sum() for f in features).backward()
+
+    def separate():
+        backward([encoder(mapping_src(support_src)), encoder(mapping_src(query_src)),
+                  encoder(mapping_tar(support_tar)), encoder(mapping_tar(query_tar)), encoder(mapping_tar(ssl))])
+
+    def batched_step(group_bn):
+        return lambda: backward(batched.batched_forward([(mapping_src, [support_src, query_src]), (mapping_tar, [support_tar, query_tar, ssl])],
+                                                        encoder, group_bn))
+
+    return [bench('step_separate_calls', separate, 1, device, repeat),
+            bench('step_batched_group_bn', batched_step(True), 1, device, repeat),
+            bench('step_batched_shared_bn', batched_step(False), 1, device, repeat)]
+
+def bench_metric(device, repeat):
+    num_query = NUM_WAYS * QUERY_NUM_PER_CLASS
+    query = torch.randn(num_query, EMB_SIZE, device=device)
+    proto = torch.randn(NUM_WAYS, EMB_SIZE, device=device)
+    return [bench('euclidean_metric', lambda: utils.euclidean_metric(query, proto), num_query, device, repeat)]
+
+def bench_losses(device, repeat):
+    info_nce = loss_function.ContrastiveLoss(batch_size=NUM_WAYS, device=device).to(device)
+    semantic = torch.randn(NUM_WAYS, EMB_SIZE, device=device, requires_grad=True)
+    support = torch.randn(NUM_WAYS, EMB_SIZE, device=device, requires_grad=True)
+
+    supcon = loss_function.SupConLoss(temperature=0.1)
+    features = torch.nn.functional.normalize(torch.randn(SSL_BATCH_SIZE, 2, EMB_SIZE, device=device), dim=2).requires_grad_()
+    labels = torch.randint(0, 16, (SSL_BATCH_SIZE,))
+
+    def contrastive():
+        info_nce(semantic, support).backward()
+
+    def supervised_contrastive():
+        supcon(features, labels, device=device).backward()
+
+    return [bench('contrastive_loss', contrastive, NUM_WAYS, device, repeat),
+            bench('supcon_loss', supervised_contrastive, SSL_BATCH_SIZE, device, repeat)]
+
+def bench_episode(device, repeat, num_classes=18, num_per_class=200, n_band=128):
+    rng = np.random.RandomState(0)
+    metatrain_data = {c: [rng.randn(n_band, PATCH_SIZE, PATCH_SIZE).astype(np.float32) for _ in range(num_per_class)]
+                      for c in range(num_classes)}
+
+    def episode():
+        task = Task(metatrain_data, NUM_WAYS, SHOT_NUM_PER_CLASS, QUERY_NUM_PER_CLASS)
+        support_loader = get_HBKC_data_loader(task, num_per_class=SHOT_NUM_PER_CLASS, split="train", shuffle=False)
+        query_loader = get_HBKC_data_loader(task, num_per_class=QUERY_NUM_PER_CLASS, split="test", shuffle=False)
+        next(iter(support_loader))
+        next(iter(query_loader))
+
+    return [bench('task_episode_construction', episode, NUM_WAYS * (SHOT_NUM_PER_CLASS + QUERY_NUM_PER_CLASS), device, repeat)]
+
+def bench_target_loader(device, repeat, shape=(145, 145, 200), num_classes=16, tar_lsample_num_per_class=5):
+    # Indian Pines sized cube, about half of the pixels labeled
+    rng = np.random.RandomState(0)
+    data = rng.randn(*shape)
+    ground_truth = rng.randint(1, num_classes + 1, shape[:2]) * (rng.rand(*shape[:2]) < 0.5)
+
+    def build():
+        with contextlib.redirect_stdout(io.StringIO()):
+            get_train_test_loader(Data_Band_Scaler=data, GroundTruth=ground_truth, class_num=num_classes,
+                                  tar_lsample_num_per_class=tar_lsample_num_per_class,
+                                  shot_num_per_class=tar_lsample_num_per_class, HalfWidth=PATCH_SIZE // 2)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        scene = TargetScene(data, ground_truth, PATCH_SIZE // 2)
+
+    def split():
+        # per seed work once the scene is prepared
+        with contextlib.redirect_stdout(io.StringIO()):
+            get_train_test_loader(Data_Band_Scaler=None, GroundTruth=None, class_num=num_classes,
+                                  tar_lsample_num_per_class=tar_lsample_num_per_class,
+                                  shot_num_per_class=tar_lsample_num_per_class, HalfWidth=PATCH_SIZE // 2, scene=scene)
+
+    return [bench('get_train_test_loader', build, int(np.count_nonzero(ground_truth)), device, repeat, warmup=0),
+            bench('target_split_from_scene', split, int(np.count_nonzero(ground_truth)), device, repeat, warmup=0)]
+
+BENCHMARKS = [('encoder', bench_encoder),
+              ('mapping', bench_mapping),
+              ('step', bench_step),
+              ('metric', bench_metric),
+              ('losses', bench_losses),
+              ('episode', bench_episode),
+              ('target_loader', bench_target_loader)]
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Hot path micro-benchmarks")
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--loader_repeat', type=int, default=3, help='repeats of the slow get_train_test_loader benchmark')
+    parser.add_argument('--threads', type=int, default=0, help='torch intra-op threads, 0 keeps the default')
+    parser.add_argument('--only', type=str, nargs='*', default=None, help='subset of {}'.format([name for name, _ in BENCHMARKS]))
+    parser.add_argument('--output', type=str, default=None)
+    args = parser.parse_args()
+
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+    device = torch.device(args.device)
+    utils.same_seeds(0)
+
+    results = []
+    for name, fn in BENCHMARKS:
+        if args.only and name not in args.only:
+            continue
+        new_results = fn(device, args.loader_repeat if name == 'target_loader' else args.repeat)
+        for result in new_results:
+            print('{:<32s} {:>10.3f} ms  {:>12.1f} items/s'.format(result['name'], result['mean_ms'], result['throughput']))
+        results += new_results
+
+    report = {'meta': {'commit': _git_commit(),
+                       'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                       'host': platform.node(),
+                       'python': platform.python_version(),
+                       'torch': torch.__version__,
+                       'device': str(device),
+                       'threads': torch.get_num_threads(),
+                       'cpu_count': os.cpu_count()},
+              'results': results}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
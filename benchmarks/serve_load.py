@@ -0,0 +1,99 @@
+"""
+load test of a running serve.py: `clients` threads each send requests of `pixels` random pixels
+(random patches when the service has no scene) back to back for `duration` seconds. Reports the
+client side latency percentiles and throughput next to the counters of the service:
+
+    python serve.py --checkpoint checkpoints/seed0_best.pth --config config/Indian_pines.py &
+    python -m benchmarks.serve_load --clients 1 4 16 --pixels 16 --duration 10 --output serve.json
+"""
+import argparse
+import json
+import threading
+import time
+import numpy as np
+
+from serve import Client
+
+
+def run_clients(connect, num_clients, pixels, duration, health, seed=0):
+    """
+    :return: latencies (s) of all requests and the wall time
+    """
+    latencies = [[] for _ in range(num_clients)]
+    errors = [0] * num_clients
+    start_barrier = threading.Barrier(num_clients + 1)
+
+    def client(i):
+        rng = np.random.RandomState(seed + i)
+        connection = connect()
+        start_barrier.wait()
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            if health['shape'] is not None:
+                body = {'pixels': np.stack([rng.randint(0, health['shape'][0], pixels),
+                                            rng.randint(0, health['shape'][1], pixels)], 1)}
+            else:
+                body = {'patches': rng.randn(pixels, health['bands'], health['patch_size'], health['patch_size']).astype(np.float32)}
+            start = time.perf_counter()
+            try:
+                connection.classify(**body)
+                latencies[i].append(time.perf_counter() - start)
+            except Exception:
+                errors[i] += 1
+        connection.close()
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(num_clients)]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return np.concatenate([np.array(l) for l in latencies]), sum(errors), time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the pixel classification service")
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--socket', type=str, default=None)
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 4, 16], help='concurrent clients of each run')
+    parser.add_argument('--pixels', type=int, default=16, help='pixels per request')
+    parser.add_argument('--duration', type=float, default=10., help='seconds per run')
+    parser.add_argument('--output', type=str, default=None)
+    args = parser.parse_args()
+
+    def connect():
+        return Client(args.host, args.port, args.socket)
+
+    probe = connect()
+    health = probe.health()
+    results = []
+    for num_clients in args.clients:
+        before = probe.stats()
+        latencies, errors, elapsed = run_clients(connect, num_clients, args.pixels, args.duration, health)
+        after = probe.stats()
+        latencies = 1000. * latencies if len(latencies) else np.zeros(1)
+        batches = max(after['batches'] - before['batches'], 1)
+        result = {'clients': num_clients,
+                  'pixels_per_request': args.pixels,
+                  'requests': len(latencies),
+                  'errors': errors,
+                  'requests_per_s': len(latencies) / elapsed,
+                  'pixels_per_s': len(latencies) * args.pixels / elapsed,
+                  'latency_p50_ms': float(np.percentile(latencies, 50)),
+                  'latency_p99_ms': float(np.percentile(latencies, 99)),
+                  'server_mean_batch_requests': (after['requests'] - before['requests']) / batches,
+                  'server_mean_batch_pixels': (after['pixels'] - before['pixels']) / batches}
+        results.append(result)
+        print('clients {:>4d}  {:>8.1f} req/s  {:>9.1f} pixels/s  p50 {:>8.2f} ms  p99 {:>8.2f} ms  batch {:>6.1f} req / {:>7.1f} px  errors {}'.format(
+            num_clients, result['requests_per_s'], result['pixels_per_s'], result['latency_p50_ms'], result['latency_p99_ms'],
+            result['server_mean_batch_requests'], result['server_mean_batch_pixels'], errors))
+
+    report = {'health': health, 'server': probe.stats(), 'results': results}
+    probe.close()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
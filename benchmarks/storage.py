@@ -0,0 +1,107 @@
+"""
+memory, disk and accuracy cost of the compact patch storage (utils.storage) for every storage dtype:
+bytes of the target scene (padded cube and labeled patches) and of the source pool, size of the
+chunked store on disk with and without compression, upcast error, and the OA of a 1-NN classifier on
+the raw patches of a 5-shot split compared with float32 storage.
+
+    python -m benchmarks.storage --target datasets/IP/indian_pines_corrected.mat datasets/IP/indian_pines_gt.mat --source datasets/Chikusei_imdb_128_7_7.pickle
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import pickle
+import tempfile
+import numpy as np
+from sklearn.neighbors import KNeighborsClassifier
+
+from utils import utils, storage
+from utils.dataloader import TargetScene, get_train_test_loader
+
+
+def synthetic_scene(shape=(145, 145, 200), num_classes=16, seed=0):
+    # spectra are smooth along the bands like reflectances, then standardized per band
+    rng = np.random.RandomState(seed)
+    data = np.cumsum(rng.randn(*shape), axis=2)
+    data = (data - data.mean(axis=(0, 1))) / data.std(axis=(0, 1))
+    ground_truth = rng.randint(1, num_classes + 1, shape[:2]) * (rng.rand(*shape[:2]) < 0.5)
+    return data, ground_truth
+
+def nn_accuracy(scene, seed, shots=5):
+    """
+    OA of a 1-NN on the flattened patches of one seed split, and its predictions
+    """
+    utils.same_seeds(seed)
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, _, _, _, RandPerm, _, _, nTrain = get_train_test_loader(None, None, len(scene.class_indices), shots, shots,
+                                                                     scene.HalfWidth, scene=scene, splits=())
+    train_index, test_index = RandPerm[:nTrain], RandPerm[nTrain:]
+    knn = KNeighborsClassifier(n_neighbors=1)
+    knn.fit(scene.get_patches(train_index).reshape(nTrain, -1), scene.labels[train_index])
+    predict = np.concatenate([knn.predict(scene.get_patches(test_index[i:i + 4096]).reshape(len(test_index[i:i + 4096]), -1))
+                              for i in range(0, len(test_index), 4096)])
+    return 100. * np.mean(predict == scene.labels[test_index]), predict
+
+def disk_size(data, storage_dtype, compress):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'store.npz')
+        storage.save(path, data, storage_dtype=storage_dtype, compress=compress)
+        return os.path.getsize(path) / 1024. / 1024.
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact storage benchmark")
+    parser.add_argument('--target', type=str, nargs=2, default=None, help='image and ground truth .mat files, synthetic scene when not given')
+    parser.add_argument('--source', type=str, default=None, help='source pickle, its patches are used for the disk sizes')
+    parser.add_argument('--patch_size', type=int, default=7)
+    parser.add_argument('--seeds', type=int, nargs='+', default=[1224, 1233, 1236])
+    parser.add_argument('--output', type=str, default=None)
+    args = parser.parse_args()
+
+    if args.target:
+        data, ground_truth = utils.load_data(*args.target)
+    else:
+        data, ground_truth = synthetic_scene()
+    if args.source:
+        with open(args.source, 'rb') as handle:
+            source = pickle.load(handle)['data']
+    else:
+        source = None
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        float_patches = TargetScene(data, ground_truth, args.patch_size // 2).patches
+
+    results = []
+    reference = {}
+    for storage_dtype in storage.STORAGE_DTYPES:
+        with contextlib.redirect_stdout(io.StringIO()):
+            scene = TargetScene(data, ground_truth, args.patch_size // 2, storage_dtype=storage_dtype)
+        patches = scene.patches if source is None else storage.to_storage(source, storage_dtype)
+        error = np.abs(scene.get_patches(np.arange(len(scene.labels))) - float_patches)
+        result = {'storage_dtype': storage_dtype,
+                  'scene_mb': (scene.data.nbytes + scene.patches.nbytes) / 1024. / 1024.,
+                  'patches_mb': patches.nbytes / 1024. / 1024.,
+                  'disk_mb': disk_size(patches, storage_dtype, False),
+                  'disk_compressed_mb': disk_size(patches, storage_dtype, True),
+                  'max_abs_error': float(error.max()),
+                  'mean_abs_error': float(error.mean())}
+        accuracies, agreements = [], []
+        for seed in args.seeds:
+            accuracy, predict = nn_accuracy(scene, seed)
+            if storage_dtype == 'float32':
+                reference[seed] = predict
+            accuracies.append(accuracy)
+            agreements.append(100. * np.mean(predict == reference[seed]))
+        result['nn_OA'] = float(np.mean(accuracies))
+        result['agreement_with_float32'] = float(np.mean(agreements))
+        results.append(result)
+        print('{:<9s} scene {:8.1f}MB  patches {:8.1f}MB  disk {:8.1f}MB  compressed {:8.1f}MB  max err {:.2e}  1-NN OA {:6.2f}  agreement {:6.2f}%'.format(
+            storage_dtype, result['scene_mb'], result['patches_mb'], result['disk_mb'], result['disk_compressed_mb'],
+            result['max_abs_error'], result['nn_OA'], result['agreement_with_float32']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -6,8 +6,15 @@ config['source_data'] = 'Chikusei_imdb_128_7_7.pickle'
 config['target_data'] = 'IP/indian_pines_corrected.mat'
 config['target_data_gt'] = 'IP/indian_pines_gt.mat'
 config['gpu'] = 0
+config['target_type'] = 'single_gt'  # 'single_gt': one ground truth split per seed, 'split_mask': separate train/test masks
 
 config['log_dir'] = './logs'
+config['checkpoint_dir'] = './checkpoints'
+config['scene_cache_dir'] = None  # write the standardized padded target cube there as .npy and memory-map it (utils.scene_reader), None keeps it in memory
+
+config['labels_tar'] = ["Alfalfa", "Corn notill", "Corn mintill", "Corn", "Grass pasture", "Grass trees", "Grass pasture mowed", "Hay windrowed", "Oats", "Soybean notill", "Soybean mintill", "Soybean clean", "Wheat", "Woods", "Buildings Grass Trees Drives", "Stone Steel Towers"]
+config['map_colors'] = [[0, 0, 1], [0, 1, 0], [0, 1, 1], [1, 0, 0], [1, 0, 1], [1, 1, 0], [0.5, 0.5, 1], [0.65, 0.35, 1], [0.75, 0.5, 0.75], [0.75, 1, 0.5], [0.5, 1, 0.65], [0.65, 0.65, 0], [0.75, 1, 0.65], [0, 0, 0.5], [0, 1, 0.75], [0.5, 0.75, 1]]
+config['map_name'] = 'IP__{}shot.png'
 
 train_opt = OrderedDict()
 train_opt['patch_size'] = 7
@@ -17,11 +24,34 @@ train_opt['num_shots'] = 1
 train_opt['episode'] = 5000
 train_opt['lr'] = 1e-3
 train_opt['weight_decay'] = 1e-4
+train_opt['checkpoint_interval'] = 500  # episodes between checkpoints, 0 disables checkpointing
+train_opt['lr_schedule'] = 'constant'  # 'constant' or 'cosine'
+train_opt['warmup_episode'] = 0
+train_opt['early_stop_patience'] = 0  # episodes without a better test accuracy before stopping, 0 disables early stopping
+train_opt['min_episode'] = 2000
+train_opt['eval_interval'] = 500  # episodes between test evaluations, the first and the last episode are always evaluated
+train_opt['warm_start'] = ''  # best weights of a seed (seed<i>_best.pth) to start from instead of weights_init, see adapt.py
+train_opt['source_checkpoint'] = ''  # source mapping and encoder pretrained once by pretrain_source.py, shared by the targets and seeds
+train_opt['train_mapping_src'] = True  # keep training the source mapping from the source checkpoint, False freezes it
+train_opt['band_lasso'] = 0  # group lasso weight on the input bands of the target mapping, 0 disables band selection
+train_opt['band_topk'] = 0  # target bands kept after band_select_episode, 0 keeps every band
+train_opt['band_select_episode'] = 4000
+train_opt['batched_step'] = False  # one call of each mapping and of the encoder per episode instead of five
+train_opt['group_bn'] = True  # batched step: batch norm statistics per input batch, as with separate calls
+train_opt['async_eval'] = False  # evaluate copies of the weights in a worker process while training goes on
+train_opt['eval_threads'] = 1  # torch threads of the evaluation worker
+train_opt['timing_interval'] = 100  # episodes between phase timing summaries, 0 disables cuda synchronization and TensorBoard timing
+train_opt['storage_dtype'] = 'float32'  # 'float32', 'float16' or 'bfloat16' storage of the source and target patches
 
 train_opt['d_emb'] = 128
 train_opt['src_input_dim'] = 128
 train_opt['tar_input_dim'] = 200
 train_opt['n_dim'] = 100
+train_opt['dropout'] = 0.3
+train_opt['inter_size'] = 24  # channels of the encoder convolutions
+train_opt['spectral_residual'] = True  # residual block (conv2, conv3) of the spectral branch
+train_opt['branches'] = 'spectral_spatial'  # 'spectral_spatial', 'spectral' or 'spatial'
+train_opt['encoder_channels'] = None  # output channels of pruned convolutions by name (prune.py), None keeps inter_size everywhere
 
 train_opt['shot_num_per_class'] = 1
 train_opt['query_num_per_class'] = 19
@@ -29,5 +59,17 @@ train_opt['query_num_per_class'] = 19
 train_opt['tar_class_num'] = 16
 train_opt['tar_lsample_num_per_class'] = 5
 
+train_opt['logit_weight'] = 0.7  # weight of the prototype logits, the label semantic logits get the rest
+train_opt['src_semantic_scale'] = 1  # the semantic logits are divided by these scales
+train_opt['tar_semantic_scale'] = 10
+train_opt['mask_ratio'] = 0.8  # random mask ratio of the ssl views
+train_opt['ssl_batch_size'] = 64  # target ssl batch, 'auto' takes the machine profile (utils.autotune)
+train_opt['align_loss_weight'] = 2.0
+train_opt['scl_loss_weight'] = 2.0
+train_opt['scl_temperature'] = 0.1
+train_opt['ssl_queue_size'] = 0  # past ssl features SupConLoss also contrasts against (utils.feature_queue), 0 disables the queue
+train_opt['ssl_queue_momentum'] = 0  # > 0: the queued features come from a momentum copy of the target mapping and encoder (MoCo), 0 queues the batch features
+train_opt['ssl_queue_dtype'] = 'float32'  # 'float32' or 'float16' storage of the queued features
+
 config['train_config'] = train_opt
 
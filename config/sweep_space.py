@@ -0,0 +1,14 @@
+from collections import OrderedDict
+
+# search space of sweep.py, the keys are train_config entries.
+# grid search: lists of values. random search: lists are sampled uniformly,
+# (low, high) tuples uniformly in the interval and ('log', low, high) log-uniformly.
+space = OrderedDict()
+space['logit_weight'] = [0.5, 0.6, 0.7, 0.8]
+space['tar_semantic_scale'] = [1, 10]
+space['align_loss_weight'] = [1.0, 2.0]
+space['scl_loss_weight'] = [1.0, 2.0]
+space['scl_temperature'] = [0.07, 0.1]
+space['dropout'] = [0.3, 0.5, 0.7]
+space['mask_ratio'] = [0.2, 0.5, 0.8]
+space['lr'] = [5e-4, 1e-3, 2e-3]
@@ -0,0 +1,161 @@
+"""
+distillation of a trained target model into a lighter student for bulk mapping. The student encoder
+(narrower inter_size, no spectral residual block, or a single branch) regresses the fused
+spatial-spectral feature of the teacher on unlabeled patches of the whole target scene; its target
+mapping starts from the teacher's. The student is then evaluated like the teacher, 1-NN on the
+support samples of the teacher weights, and both are timed:
+
+    python distill.py --config config/Indian_pines.py --checkpoint checkpoints/16way_5shot_IP/seed0_best.pth --inter_size 8 --no_spectral_residual --output checkpoints/16way_5shot_IP/seed0_student.pth
+
+The student is saved in the format of the best weights, so serve.py, export_embeddings.py and adapt.py take it as well.
+"""
+import argparse
+import imp
+import json
+import time
+import numpy as np
+
+import torch
+import torch.nn.functional as F
+
+from utils import utils, checkpoint, inference, evaluation, autotune
+
+
+def count_parameters(modules):
+    # the label embedding head is only used for training
+    return sum(p.numel() for module in modules for name, p in module.named_parameters() if not name.startswith('word_emb_transformers'))
+
+def scene_features(mapping_tar, encoder, scene, index, batch_size, device, chunk_size=None):
+    """
+    features of the labeled pixels `index` of the scene, the patches are gathered chunk by chunk
+    """
+    chunk_size = chunk_size or autotune.get('chunk_size', 4096)
+    return np.concatenate([np.zeros((0, encoder.emb_size), dtype=np.float32)] +
+                          [inference.extract_features(mapping_tar, encoder, scene.get_patches(index[start:start + chunk_size]), batch_size, device)
+                           for start in range(0, len(index), chunk_size)])
+
+def pixels_per_second(mapping_tar, encoder, patches, batch_size, device, repeats=3):
+    inference.extract_features(mapping_tar, encoder, patches[:batch_size], batch_size, device)
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        inference.extract_features(mapping_tar, encoder, patches, batch_size, device)
+        best = min(best, time.perf_counter() - start)
+    return len(patches) / best
+
+def scores(labels, predict):
+    confusion = evaluation.ConfusionMatrix(int(max(labels.max(), predict.max())) + 1)
+    confusion.update(labels, predict)
+    return confusion.scores()
+
+def main():
+    parser = argparse.ArgumentParser(description="Distill a trained encoder into a lighter student")
+    parser.add_argument('--config', type=str, required=True)
+    parser.add_argument('--checkpoint', type=str, required=True, help='teacher, seed<i>_best.pth written by train.py')
+    parser.add_argument('--output', type=str, required=True, help='student weights')
+    parser.add_argument('--inter_size', type=int, default=8, help='channels of the student convolutions')
+    parser.add_argument('--no_spectral_residual', action='store_true', help='drop the residual block of the spectral branch')
+    parser.add_argument('--branches', type=str, default='spectral_spatial', choices=['spectral_spatial', 'spectral', 'spatial'])
+    parser.add_argument('--epochs', type=int, default=10)
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--lr', type=float, default=1e-3)
+    parser.add_argument('--num_pixels', type=int, default=0, help='random pixels of the scene to train on, 0 takes all of them')
+    parser.add_argument('--speed_pixels', type=int, default=4096, help='pixels timed for the throughput')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--report', type=str, default=None, help='json report')
+    args = parser.parse_args()
+
+    utils.same_seeds(args.seed)
+    config = imp.load_source("", args.config).config
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    teacher = inference.Predictor(args.checkpoint, device=device, batch_size=args.batch_size)
+    scene = inference.load_scene(config, teacher.bands)
+
+    # unlabeled training pixels and the teacher features they are regressed on, computed once
+    height, width = scene.shape
+    pixels = np.random.permutation(height * width)
+    if args.num_pixels > 0:
+        pixels = pixels[:args.num_pixels]
+    rows, columns = np.unravel_index(pixels, (height, width))
+    chunk_size = autotune.get('chunk_size', 4096)
+    start = time.time()
+    targets = np.concatenate([teacher.features(scene.cut(rows[i:i + chunk_size], columns[i:i + chunk_size])) for i in range(0, len(pixels), chunk_size)])
+    print('teacher features of {} pixels in {:.1f}s'.format(len(pixels), time.time() - start))
+
+    student_opt = dict(teacher.train_opt)
+    student_opt.update({'inter_size': args.inter_size, 'spectral_residual': not args.no_spectral_residual, 'branches': args.branches,
+                        'encoder_channels': None})
+    mapping_tar, encoder = inference.build_models(student_opt, teacher.bands)
+    mapping_tar.load_state_dict(teacher.mapping_tar.state_dict())
+    encoder.apply(utils.weights_init)
+    mapping_tar.to(device)
+    encoder.to(device)
+    parameters = list(mapping_tar.parameters()) + [p for name, p in encoder.named_parameters() if not name.startswith('word_emb_transformers')]
+    optimizer = torch.optim.Adam(parameters, lr=args.lr)
+    scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optimizer, args.epochs * int(np.ceil(len(pixels) / args.batch_size)))
+
+    start = time.time()
+    for epoch in range(args.epochs):
+        mapping_tar.train()
+        encoder.train()
+        order = np.random.permutation(len(pixels))
+        total_loss, total_cosine = 0., 0.
+        for i in range(0, len(order), args.batch_size):
+            batch = order[i:i + args.batch_size]
+            if len(batch) < 2:  # batch norm needs more than one sample
+                continue
+            patches = torch.from_numpy(scene.cut(rows[batch], columns[batch])).to(device)
+            target = torch.from_numpy(targets[batch]).to(device)
+            features = encoder(mapping_tar(patches))
+            loss = F.mse_loss(features, target)
+            optimizer.zero_grad()
+            loss.backward()
+            optimizer.step()
+            scheduler.step()
+            total_loss += loss.item() * len(batch)
+            total_cosine += F.cosine_similarity(features.detach(), target).sum().item()
+        print('epoch {:>3d}  mse {:.5f}  cosine {:.4f}  {:.1f}s'.format(
+            epoch + 1, total_loss / len(order), total_cosine / len(order), time.time() - start))
+    mapping_tar.eval()
+    encoder.eval()
+
+    # both evaluated on the test pixels of the seed, against the support samples of the teacher weights
+    state = checkpoint.load(args.checkpoint)
+    index = inference.test_index(scene, teacher.support_pixels)
+    labels = scene.labels[index]
+    teacher_predict = teacher.classifier.predict(scene_features(teacher.mapping_tar, teacher.encoder, scene, index, args.batch_size, device))
+    support_features = inference.extract_features(mapping_tar, encoder, state['support_data'], args.batch_size, device)
+    classifier = inference.SupportClassifier(support_features, teacher.support_labels)
+    student_predict = classifier.predict(scene_features(mapping_tar, encoder, scene, index, args.batch_size, device))
+
+    speed_index = np.arange(min(args.speed_pixels, len(scene.labels)))
+    speed_patches = scene.get_patches(speed_index)
+    report = {'teacher': dict(scores(labels, teacher_predict),
+                              parameters=count_parameters([teacher.mapping_tar, teacher.encoder]),
+                              pixels_per_s=pixels_per_second(teacher.mapping_tar, teacher.encoder, speed_patches, args.batch_size, device)),
+              'student': dict(scores(labels, student_predict),
+                              parameters=count_parameters([mapping_tar, encoder]),
+                              pixels_per_s=pixels_per_second(mapping_tar, encoder, speed_patches, args.batch_size, device),
+                              agreement_with_teacher=100. * np.mean(student_predict == teacher_predict),
+                              inter_size=args.inter_size, spectral_residual=not args.no_spectral_residual, branches=args.branches)}
+    report['speedup'] = report['student']['pixels_per_s'] / report['teacher']['pixels_per_s']
+    for name in ['teacher', 'student']:
+        result = report[name]
+        print('{:<8s} OA {:6.2f}  AA {:6.2f}  kappa {:6.2f}  {:>8d} parameters  {:>9.1f} pixels/s'.format(
+            name, result['OA'], result['AA'], result['kappa'], result['parameters'], result['pixels_per_s']))
+    print('speedup {:.2f}x, student agrees with the teacher on {:.2f}% of {} test pixels'.format(
+        report['speedup'], report['student']['agreement_with_teacher'], len(index)))
+
+    checkpoint.save({'seed': state['seed'], 'episode': state['episode'], 'accuracy': report['student']['OA'],
+                     'mapping_tar': mapping_tar.state_dict(), 'encoder': encoder.state_dict(),
+                     'support_data': state['support_data'], 'support_labels': state['support_labels'],
+                     'support_pixels': state.get('support_pixels'),
+                     'train_config': student_opt, 'labels_tar': state.get('labels_tar'), 'target_bands': teacher.bands,
+                     'teacher': args.checkpoint},
+                    args.output)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+export the fused embeddings of the labeled pixels, or of every pixel, of the target scene to a
+memory-mapped store (utils.embedding_store), then classify / evaluate / draw maps from the store only:
+
+    python export_embeddings.py export --checkpoint checkpoints/seed0_best.pth --config config/Indian_pines.py --output embeddings/IP_seed0 --pixels all --dtype float16
+    python export_embeddings.py classify --store embeddings/IP_seed0 --mode knn --map classificationMap/IP_seed0_store.png
+"""
+import argparse
+import imp
+import time
+import numpy as np
+
+import torch
+
+from utils import inference, embedding_store
+
+
+def export(args):
+    config = imp.load_source("", args.config).config
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    predictor = inference.Predictor(args.checkpoint, device=device, batch_size=args.batch_size)
+    scene = inference.load_scene(config, predictor.bands)
+    start = time.time()
+    embedding_store.export(predictor, scene, args.output, args.pixels, args.dtype, args.chunk_size, config['map_colors'])
+    print('exported to {} in {:.1f}s'.format(args.output, time.time() - start))
+
+def classify(args):
+    store = embedding_store.load(args.store)
+    start = time.time()
+    predict = embedding_store.classify(store, args.mode)
+    print('{} {} pixels classified in {:.2f}s'.format(len(predict), args.mode, time.time() - start))
+    if np.any(store['labels'] >= 0):
+        result = embedding_store.evaluate(store, predict)
+        print('OA {:.2f}  AA {:.2f}  kappa {:.2f}  on {} test pixels'.format(result['OA'], result['AA'], result['kappa'], result['num_test']))
+        for i, accuracy in enumerate(result['class_accuracy']):
+            print('Class {}: {:.2f}'.format(i, 100 * accuracy))
+    if args.map:
+        if store['meta']['map_colors'] is None:
+            raise ValueError('the store has no map colors')
+        embedding_store.render_map(embedding_store.label_map(store, predict), store['meta']['map_colors'], args.map)
+        print('map written to {}'.format(args.map))
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-pixel embedding store")
+    subparsers = parser.add_subparsers(dest='command')
+    parser_export = subparsers.add_parser('export', help='write the embeddings of a trained model')
+    parser_export.add_argument('--checkpoint', type=str, required=True, help='seed<i>_best.pth written by train.py')
+    parser_export.add_argument('--config', type=str, required=True)
+    parser_export.add_argument('--output', type=str, required=True, help='store directory')
+    parser_export.add_argument('--pixels', type=str, default='labeled', choices=['labeled', 'all'])
+    parser_export.add_argument('--dtype', type=str, default='float16', choices=['float16', 'float32'])
+    parser_export.add_argument('--batch_size', type=int, default=None, help='by default the machine profile (utils.autotune) or 1024')
+    parser_export.add_argument('--chunk_size', type=int, default=None, help='pixels cut and written at a time, by default the machine profile or 4096')
+    parser_classify = subparsers.add_parser('classify', help='classify, evaluate and draw a map from a store')
+    parser_classify.add_argument('--store', type=str, required=True)
+    parser_classify.add_argument('--mode', type=str, default='knn', choices=['knn', 'prototype'])
+    parser_classify.add_argument('--map', type=str, default=None, help='classification map to write')
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        export(args)
+    elif args.command == 'classify':
+        classify(args)
+    else:
+        parser.print_help()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""
+batched training step: the batches of an episode that share a mapping are concatenated, every mapping
+is called once and the encoder once on all of them (train.py batched_step). Batch norm layers can
+normalize the consecutive batches of such a call with their own statistics, which keeps the outputs
+and the running statistics of separate calls.
+"""
+import torch
+import torch.nn as nn
+
+
+class _GroupBatchNorm(object):
+    # sizes of the consecutive groups of the batch, None normalizes the batch as a whole
+    groups = None
+
+    def forward(self, x):
+        if self.groups is None:
+            return super(_GroupBatchNorm, self).forward(x)
+        return torch.cat([super(_GroupBatchNorm, self).forward(chunk) for chunk in x.split(self.groups)])
+
+class BatchNorm2d(_GroupBatchNorm, nn.BatchNorm2d):
+    pass
+
+class BatchNorm3d(_GroupBatchNorm, nn.BatchNorm3d):
+    pass
+
+def set_groups(module, groups):
+    """
+    :param groups: sizes of the consecutive groups normalized separately by the batch norms of `module`, or None
+    """
+    for m in module.modules():
+        if isinstance(m, _GroupBatchNorm):
+            m.groups = groups
+
+def batched_forward(inputs, encoder, group_bn=True):
+    """
+    features of several batches with one call of every mapping and one call of the encoder
+    :param inputs: list of (mapping, [batches]) pairs, the batches of a mapping are concatenated
+    :param group_bn: normalize every batch with its own batch norm statistics, as separate calls do
+    :return: features of every batch, in the order of `inputs`
+    """
+    sizes = [[len(batch) for batch in batches] for _, batches in inputs]
+    modules = [mapping for mapping, _ in inputs] + [encoder]
+    try:
+        mapped = []
+        for (mapping, batches), mapping_sizes in zip(inputs, sizes):
+            set_groups(mapping, mapping_sizes if group_bn else None)
+            mapped.append(mapping(torch.cat(batches)))
+        sizes = sum(sizes, [])
+        set_groups(encoder, sizes if group_bn else None)
+        features = encoder(torch.cat(mapped))
+    finally:
+        for module in modules:
+            set_groups(module, None)
+    return list(features.split(sizes))
@@ -1,30 +1,39 @@
 import torch.nn as nn
 import torch.nn.functional as F
 
+from .batched import BatchNorm3d
+
 class SpectralEncoder(nn.Module):
-    def __init__(self, input_channels, patch_size, feature_dim):
+    def __init__(self, input_channels, patch_size, feature_dim, inter_size=24, residual=True, channels=None):
         super(SpectralEncoder, self).__init__()
         self.input_channels = input_channels
         self.patch_size = patch_size
         self.feature_dim = feature_dim
-        self.inter_size = 24
-
-        self.conv1 = nn.Conv3d(1, self.inter_size, kernel_size=(7, 1, 1), stride=(2, 1, 1), padding=(1, 0, 0),
+        self.inter_size = inter_size
+        self.residual = residual
+        # output channels of pruned convolutions (utils.pruning), conv3 has the channels of conv1 it is added to
+        channels = channels or {}
+        conv1_size = channels.get('conv1', self.inter_size)
+        conv2_size = channels.get('conv2', self.inter_size)
+
+        self.conv1 = nn.Conv3d(1, conv1_size, kernel_size=(7, 1, 1), stride=(2, 1, 1), padding=(1, 0, 0),
                                bias=True)
-        self.bn1 = nn.BatchNorm3d(self.inter_size)
+        self.bn1 = BatchNorm3d(conv1_size)
         self.activation1 = nn.ReLU()
 
-        self.conv2 = nn.Conv3d(self.inter_size, self.inter_size, kernel_size=(7, 1, 1), stride=(1, 1, 1), padding=(3, 0, 0), padding_mode='zeros', bias=True)
-        self.bn2 = nn.BatchNorm3d(self.inter_size)
-        self.activation2 = nn.ReLU()
+        # without the residual block conv1 feeds conv4 directly (lighter students, see distill.py)
+        if self.residual:
+            self.conv2 = nn.Conv3d(conv1_size, conv2_size, kernel_size=(7, 1, 1), stride=(1, 1, 1), padding=(3, 0, 0), padding_mode='zeros', bias=True)
+            self.bn2 = BatchNorm3d(conv2_size)
+            self.activation2 = nn.ReLU()
 
-        self.conv3 = nn.Conv3d(self.inter_size, self.inter_size, kernel_size=(7, 1, 1), stride=(1, 1, 1), padding=(3, 0, 0), padding_mode='zeros', bias=True)
-        self.bn3 = nn.BatchNorm3d(self.inter_size)
-        self.activation3 = nn.ReLU()
+            self.conv3 = nn.Conv3d(conv2_size, conv1_size, kernel_size=(7, 1, 1), stride=(1, 1, 1), padding=(3, 0, 0), padding_mode='zeros', bias=True)
+            self.bn3 = BatchNorm3d(conv1_size)
+            self.activation3 = nn.ReLU()
 
-        self.conv4 = nn.Conv3d(self.inter_size, self.feature_dim,
+        self.conv4 = nn.Conv3d(conv1_size, self.feature_dim,
                                kernel_size=(((self.input_channels - 7 + 2 * 1) // 2 + 1), 1, 1), bias=True)
-        self.bn4 = nn.BatchNorm3d(self.feature_dim)
+        self.bn4 = BatchNorm3d(self.feature_dim)
         self.activation4 = nn.ReLU()
 
         self.avgpool = nn.AvgPool3d((1, self.patch_size, self.patch_size))
@@ -34,13 +43,14 @@ class SpectralEncoder(nn.Module):
         x1 = self.conv1(x)
         x1 = self.activation1(self.bn1(x1))
 
-        # Residual layer 1
-        residual = x1
-        x1 = self.conv2(x1)
-        x1 = self.activation2(self.bn2(x1))
-        x1 = self.conv3(x1)
-        x1 = residual + x1
-        x1 = self.activation3(self.bn3(x1))
+        if self.residual:
+            # Residual layer 1
+            residual = x1
+            x1 = self.conv2(x1)
+            x1 = self.activation2(self.bn2(x1))
+            x1 = self.conv3(x1)
+            x1 = residual + x1
+            x1 = self.activation3(self.bn3(x1))
 
         # Convolution layer to combine rest
         x1 = self.conv4(x1)
@@ -54,32 +64,37 @@ class SpectralEncoder(nn.Module):
 
 
 class SpatialEncoder(nn.Module):
-    def __init__(self, input_channels, patch_size, feature_dim):
+    def __init__(self, input_channels, patch_size, feature_dim, inter_size=24, channels=None):
         super(SpatialEncoder, self).__init__()
         self.input_channels = input_channels
         self.patch_size = patch_size
         self.feature_dim = feature_dim
-        self.inter_size = 24
+        self.inter_size = inter_size
+        # output channels of pruned convolutions (utils.pruning), conv8 has the channels of conv7 it is added to
+        channels = channels or {}
+        conv5_size = channels.get('conv5', self.inter_size)
+        conv6_size = channels.get('conv6', self.inter_size)
+        conv7_size = channels.get('conv7', self.inter_size)
 
         # Convolution layer for spatial information
-        self.conv5 = nn.Conv3d(1, self.inter_size, kernel_size=(self.input_channels, 1, 1))
-        self.bn5 = nn.BatchNorm3d(self.inter_size)
+        self.conv5 = nn.Conv3d(1, conv5_size, kernel_size=(self.input_channels, 1, 1))
+        self.bn5 = BatchNorm3d(conv5_size)
         self.activation5 = nn.ReLU()
 
         # Residual block 2
-        self.conv8 = nn.Conv3d(self.inter_size, self.inter_size, kernel_size=(1, 1, 1))
+        self.conv8 = nn.Conv3d(conv5_size, conv7_size, kernel_size=(1, 1, 1))
 
-        self.conv6 = nn.Conv3d(self.inter_size, self.inter_size, kernel_size=(1, 3, 3), stride=(1, 1, 1), padding=(0, 1, 1), padding_mode='zeros', bias=True)
-        self.bn6 = nn.BatchNorm3d(self.inter_size)
+        self.conv6 = nn.Conv3d(conv5_size, conv6_size, kernel_size=(1, 3, 3), stride=(1, 1, 1), padding=(0, 1, 1), padding_mode='zeros', bias=True)
+        self.bn6 = BatchNorm3d(conv6_size)
         self.activation6 = nn.ReLU()
-        self.conv7 = nn.Conv3d(self.inter_size, self.inter_size, kernel_size=(1, 3, 3), stride=(1, 1, 1), padding=(0, 1, 1), padding_mode='zeros', bias=True)
-        self.bn7 = nn.BatchNorm3d(self.inter_size)
+        self.conv7 = nn.Conv3d(conv6_size, conv7_size, kernel_size=(1, 3, 3), stride=(1, 1, 1), padding=(0, 1, 1), padding_mode='zeros', bias=True)
+        self.bn7 = BatchNorm3d(conv7_size)
         self.activation7 = nn.ReLU()
 
         self.avgpool = nn.AvgPool3d((1, self.patch_size, self.patch_size))
 
         self.fc = nn.Sequential(nn.Dropout(p=0.5),
-                                nn.Linear(self.inter_size, out_features=self.feature_dim))
+                                nn.Linear(conv7_size, out_features=self.feature_dim))
 
 
     def forward(self, x):
@@ -133,22 +148,44 @@ class WordEmbTransformers(nn.Module):
 
 
 class Encoder(nn.Module):
-    def __init__(self, n_dimension, patch_size, emb_size, dropout=0.5):
+    """
+    :param inter_size: channels of the 3d convolutions of both branches
+    :param spectral_residual: keep the residual block (conv2, conv3) of the spectral branch
+    :param branches: 'spectral_spatial' (fusion of both), 'spectral' or 'spatial' only
+    :param channels: output channels of pruned convolutions by name ('conv1', 'conv2', 'conv5', 'conv6', 'conv7'),
+                     the others have inter_size
+    """
+    def __init__(self, n_dimension, patch_size, emb_size, dropout=0.5, inter_size=24, spectral_residual=True, branches='spectral_spatial',
+                 channels=None):
         super(Encoder, self).__init__()
         self.n_dimension = n_dimension
         self.patch_size = patch_size
         self.emb_size = emb_size
         self.dropout = dropout
-
-        self.spectral_encoder = SpectralEncoder(input_channels=self.n_dimension, patch_size=self.patch_size, feature_dim=self.emb_size)
-        self.spatial_encoder = SpatialEncoder(input_channels=self.n_dimension, patch_size=self.patch_size, feature_dim=self.emb_size)
+        self.inter_size = inter_size
+        self.spectral_residual = spectral_residual
+        self.branches = branches
+        if branches not in ('spectral_spatial', 'spectral', 'spatial'):
+            raise ValueError('Unknown encoder branches: {}'.format(branches))
+
+        if branches != 'spatial':
+            self.spectral_encoder = SpectralEncoder(input_channels=self.n_dimension, patch_size=self.patch_size, feature_dim=self.emb_size,
+                                                    inter_size=inter_size, residual=spectral_residual, channels=channels)
+        if branches != 'spectral':
+            self.spatial_encoder = SpatialEncoder(input_channels=self.n_dimension, patch_size=self.patch_size, feature_dim=self.emb_size,
+                                                  inter_size=inter_size, channels=channels)
         self.word_emb_transformers = WordEmbTransformers(feature_dim=self.emb_size, dropout=self.dropout)
 
 
     def forward(self, x, semantic_feature="", s_or_q="query"):
-        spatial_feature = self.spatial_encoder(x)
-        spectral_feature = self.spectral_encoder(x)
-        spatial_spectral_fusion_feature = 0.5 * spatial_feature + 0.5 * spectral_feature
+        if self.branches == 'spectral':
+            spatial_spectral_fusion_feature = self.spectral_encoder(x)
+        elif self.branches == 'spatial':
+            spatial_spectral_fusion_feature = self.spatial_encoder(x)
+        else:
+            spatial_feature = self.spatial_encoder(x)
+            spectral_feature = self.spectral_encoder(x)
+            spatial_spectral_fusion_feature = 0.5 * spatial_feature + 0.5 * spectral_feature
    
         # support set extract fusion_feature
         if s_or_q == "support":  # semantic_feature = (9, 768)
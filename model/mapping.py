@@ -1,12 +1,46 @@
 import torch.nn as nn
 
+from .batched import BatchNorm2d
+
 class Mapping(nn.Module):
     def __init__(self, in_dimension, out_dimension):
         super(Mapping, self).__init__()
         self.preconv = nn.Conv2d(in_dimension, out_dimension, 1, 1, bias=False)
-        self.preconv_bn = nn.BatchNorm2d(out_dimension)
+        self.preconv_bn = BatchNorm2d(out_dimension)
+        # input bands kept by select_bands, None when every band is used
+        self.bands = None
+
+    def band_norms(self):
+        """
+        l2 norm of the weights of every input band
+        """
+        return self.preconv.weight.pow(2).sum(dim=(0, 2, 3)).sqrt()
+
+    def group_lasso(self):
+        """
+        sparsity penalty driving the weights of whole input bands to zero
+        """
+        return self.band_norms().sum()
+
+    def select_bands(self, bands, optimizer=None):
+        """
+        keep only the input bands `bands`, the weights of the others are dropped. The model then takes
+        patches of either all bands or only the selected ones
+        :param optimizer: optimizer of the weights, it takes the sliced weight with a reset state (momentum)
+        """
+        bands = sorted(int(band) for band in bands)
+        weight = self.preconv.weight
+        self.preconv.weight = nn.Parameter(weight.data[:, bands].clone())
+        if optimizer is not None:
+            optimizer.state.pop(weight, None)
+            for group in optimizer.param_groups:
+                group['params'] = [self.preconv.weight if p is weight else p for p in group['params']]
+        self.preconv.in_channels = len(bands)
+        self.bands = bands
 
     def forward(self, x):
+        if self.bands is not None and x.size(1) != len(self.bands):
+            x = x[:, self.bands]
         x = self.preconv(x)
         x = self.preconv_bn(x)
         return x
@@ -0,0 +1,169 @@
+"""
+source pretraining: the source mapping and the encoder (with its label embedding head) are trained once
+on Chikusei episodes, with the source few-shot loss on the prototypes and label semantics and the
+source alignment loss, and saved for every target and seed to start from (train_opt source_checkpoint):
+
+    python pretrain_source.py --config config/Indian_pines.py --episode 3000 --output checkpoints/source/source.pth
+    python train.py --config config/Indian_pines.py config/HT.py --source_checkpoint checkpoints/source/source.pth
+
+The target runs keep their full loss and need a much shorter episode budget. --compare trains every
+config both ways on the same seeds, from scratch with its own episode budget and from the pretrained
+weights with --target_episode, and reports the accuracy and the total time of both schedules, the
+pretraining included.
+"""
+import argparse
+import copy
+import imp
+import json
+import os
+import time
+
+import torch
+import torch.nn as nn
+
+import train
+from model.mapping import Mapping
+from model.encoder import Encoder
+from utils import utils, loss_function, checkpoint, schedule
+from utils.dataloader import Task, get_HBKC_data_loader
+
+
+def pretrain(train_opt, metatrain_data, semantic_mapping_src, episodes, device='cpu', log_interval=100):
+    """
+    source half of the training episode of train.py, with tar_class_num ways
+    :return: state of the source checkpoint
+    """
+    ways = train_opt['tar_class_num']
+    shots = train_opt['shot_num_per_class']
+    queries = train_opt['query_num_per_class']
+    mapping_src = Mapping(train_opt['src_input_dim'], train_opt['n_dim']).to(device)
+    encoder = Encoder(n_dimension=train_opt['n_dim'], patch_size=train_opt['patch_size'], emb_size=train_opt['d_emb'], dropout=train_opt['dropout'],
+                      inter_size=train_opt['inter_size'], spectral_residual=train_opt['spectral_residual'], branches=train_opt['branches'],
+                      channels=train_opt['encoder_channels']).to(device)
+    mapping_src.apply(utils.weights_init)
+    encoder.apply(utils.weights_init)
+    mapping_src_optim = torch.optim.SGD(mapping_src.parameters(), lr=train_opt['lr'], momentum=0.9, weight_decay=train_opt['weight_decay'])
+    encoder_optim = torch.optim.SGD(encoder.parameters(), lr=train_opt['lr'], momentum=0.9, weight_decay=train_opt['weight_decay'])
+    lr_schedulers = schedule.get_lr_schedulers([mapping_src_optim, encoder_optim], train_opt['lr_schedule'], train_opt['warmup_episode'], episodes)
+    crossEntropy = nn.CrossEntropyLoss().to(device)
+    infoNCE_Loss = loss_function.ContrastiveLoss(batch_size=ways, device=device).to(device)
+    mapping_src.train()
+    encoder.train()
+
+    total_hit, total_num = 0.0, 0.0
+    start = time.time()
+    for episode in range(episodes):
+        task = Task(metatrain_data, ways, shots, queries)
+        support, support_labels = get_HBKC_data_loader(task, num_per_class=shots, split="train", shuffle=False).__iter__().next()
+        query, query_labels = get_HBKC_data_loader(task, num_per_class=queries, split="test", shuffle=False).__iter__().next()
+        semantic_support = torch.zeros(ways, 768)
+        for i, class_id in enumerate(task.support_real_labels):
+            semantic_support[i] = torch.from_numpy(semantic_mapping_src[class_id])
+
+        support_features, semantic_feature = encoder(mapping_src(support.to(device)), semantic_feature=semantic_support.to(device), s_or_q="support")
+        query_features = encoder(mapping_src(query.to(device)))
+        support_proto = support_features.reshape(ways, shots, -1).mean(dim=1) if shots > 1 else support_features
+
+        logits = train_opt['logit_weight'] * utils.euclidean_metric(query_features, support_proto) + \
+                 (1 - train_opt['logit_weight']) * utils.euclidean_metric(query_features, semantic_feature) / train_opt['src_semantic_scale']
+        f_loss = crossEntropy(logits, query_labels.long().to(device))
+        text_align_loss = infoNCE_Loss(semantic_feature, support_features)
+        loss = f_loss + train_opt['align_loss_weight'] * text_align_loss
+
+        mapping_src.zero_grad()
+        encoder.zero_grad()
+        loss.backward()
+        mapping_src_optim.step()
+        encoder_optim.step()
+        for lr_scheduler in lr_schedulers:
+            lr_scheduler.step()
+
+        total_hit += torch.sum(torch.argmax(logits, dim=1).cpu() == query_labels).item()
+        total_num += query.shape[0]
+        if (episode + 1) % log_interval == 0:
+            print('episode: {:>5d}, f_loss: {:6.4f}, text_align_loss: {:6.4f}, loss: {:6.4f}, acc_src: {:6.4f}, {:.1f}s'.format(
+                episode + 1, f_loss.item(), text_align_loss.item(), loss.item(), total_hit / total_num, time.time() - start))
+
+    return {'episode': episodes, 'mapping_src': mapping_src.state_dict(), 'encoder': encoder.state_dict(),
+            'train_config': dict(train_opt), 'acc_src': total_hit / max(total_num, 1), 'train_time': time.time() - start}
+
+def run(config, name, output, episode, source_checkpoint, args, metatrain_data, semantic_mapping_src, semantic_mapping_tar, seeds):
+    """
+    train.py on the seeds of a target, from scratch or from the source checkpoint
+    """
+    config = copy.deepcopy(config)
+    train_opt = config['train_config']
+    train_opt['episode'] = episode
+    train_opt['source_checkpoint'] = source_checkpoint
+    train_opt['train_mapping_src'] = not args.freeze_mapping_src
+    target = config['target_data'].split('/')[0]
+    config['log_dir'] = os.path.join(output, name, target)
+    config['checkpoint_dir'] = os.path.join(output, name, target)
+    config['map_name'] = os.path.abspath(os.path.join(output, name, target, 'map_{}shot.png'))
+    train_args = argparse.Namespace(resume=False, profile_memory=False, world_size=1)
+    start = time.time()
+    result = train.train_target(config, metatrain_data, semantic_mapping_src, semantic_mapping_tar, train_args, seeds=seeds)
+    result['wall_time'] = time.time() - start
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Source pretraining shared by the targets and seeds")
+    parser.add_argument('--config', type=str, nargs='+', default=[os.path.join('./config', 'Indian_pines.py')],
+                        help='the first config gives the model and the source, --compare trains every config')
+    parser.add_argument('--episode', type=int, default=3000, help='source pretraining episodes')
+    parser.add_argument('--lr', type=float, default=0, help='pretraining learning rate, 0 keeps the config value')
+    parser.add_argument('--output', type=str, default=os.path.join('./checkpoints', 'source', 'source.pth'))
+    parser.add_argument('--compare', action='store_true', help='train the targets from scratch and from the pretrained weights')
+    parser.add_argument('--target_episode', type=int, default=1000, help='episodes of the target runs from the pretrained weights')
+    parser.add_argument('--num_seeds', type=int, default=len(train.SEEDS), help='seeds of the comparison, the first ones of train.SEEDS')
+    parser.add_argument('--freeze_mapping_src', action='store_true', help='do not train the source mapping in the target runs')
+    args = parser.parse_args()
+
+    configs = [imp.load_source("", path).config for path in args.config]
+    config = configs[0]
+    train_opt = dict(config['train_config'])
+    if args.lr > 0:
+        train_opt['lr'] = args.lr
+    device = config['gpu']
+    utils.same_seeds(0)
+
+    semantic_mappings = train.encode_labels([train.labels_src] + [target['labels_tar'] for target in configs])
+    source_key = (config['data_path'], config['source_data'], train_opt['storage_dtype'])
+    metatrain_data = train.load_source(*source_key)
+
+    state = pretrain(train_opt, metatrain_data, semantic_mappings[0], args.episode, device)
+    state['source_data'] = config['source_data']
+    checkpoint.save(state, args.output)
+    print('pretrained {} episodes on {} in {:.1f}s, acc_src {:.4f}, saved to {}'.format(
+        args.episode, config['source_data'], state['train_time'], state['acc_src'], args.output))
+    if not args.compare:
+        return
+
+    output = os.path.dirname(os.path.abspath(args.output))
+    seeds = train.SEEDS[:args.num_seeds]
+    rows = []
+    for target, semantic_mapping_tar in zip(configs, semantic_mappings[1:]):
+        if (target['data_path'], target['source_data'], target['train_config']['storage_dtype']) != source_key:
+            raise ValueError('{} is trained against another source than {}'.format(target['target_data'], config['source_data']))
+        for name, episode, source_checkpoint in [('scratch', target['train_config']['episode'], ''),
+                                                 ('pretrained', args.target_episode, os.path.abspath(args.output))]:
+            result = run(target, name, output, episode, source_checkpoint, args, metatrain_data, semantic_mappings[0], semantic_mapping_tar, seeds)
+            rows.append({'target': target['target_data'].split('/')[0], 'schedule': name, 'episode': episode,
+                         'OA': result['OA'], 'OA_std': result['OA_std'], 'AA': result['AA'], 'kappa': result['kappa'],
+                         'train_time': result['train_time'], 'wall_time': result['wall_time']})
+
+    print('{} seeds per target, {} source pretraining episodes in {:.1f}s'.format(len(seeds), args.episode, state['train_time']))
+    print('{:<8s} {:<10s} {:>7s} {:>14s} {:>7s} {:>7s} {:>11s}'.format('target', 'schedule', 'episode', 'OA', 'AA', 'kappa', 'train (s)'))
+    for row in rows:
+        print('{:<8s} {:<10s} {:>7d} {:>7.2f} +- {:>4.2f} {:>7.2f} {:>7.2f} {:>11.1f}'.format(
+            row['target'], row['schedule'], row['episode'], row['OA'], row['OA_std'], row['AA'], row['kappa'], row['train_time']))
+    totals = {name: sum(row['train_time'] for row in rows if row['schedule'] == name) for name in ['scratch', 'pretrained']}
+    totals['pretrained'] += state['train_time']
+    print('total train time: scratch {:.1f}s, pretrained {:.1f}s including the pretraining ({:.2f}x)'.format(
+        totals['scratch'], totals['pretrained'], totals['scratch'] / totals['pretrained']))
+    with open(os.path.join(output, 'pretrain_report.json'), 'w') as f:
+        json.dump({'source_checkpoint': args.output, 'pretrain_episode': args.episode, 'pretrain_time': state['train_time'],
+                   'seeds': list(seeds), 'rows': rows, 'total_train_time': totals}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+structured channel pruning of a trained encoder (utils.pruning). The channels of conv1-conv8 are ranked
+by batch norm scale or Taylor saliency on the support samples, the least salient fraction of every
+convolution is removed for each pruning ratio, and the smaller dense model is fine-tuned from the
+pruned weights for a short budget of episodes (train.py with warm_start). Every model is evaluated like
+distill.py, 1-NN on the support samples over the test pixels of the seed, and timed:
+
+    python prune.py --config config/Indian_pines.py --checkpoint checkpoints/16way_5shot_IP/seed0_best.pth --ratios 0.25 0.5 0.75 --budget 500
+
+The pruned and fine-tuned weights are saved in the format of the best weights under --output, so
+serve.py, export_embeddings.py and adapt.py take them as well.
+"""
+import argparse
+import imp
+import json
+import os
+import time
+import numpy as np
+
+import torch
+
+import train
+import adapt
+from distill import count_parameters, scene_features, pixels_per_second, scores
+from utils import utils, checkpoint, inference, pruning
+
+
+def evaluate(predictor, scene, index, speed_patches, batch_size, device):
+    labels = scene.labels[index]
+    predict = predictor.classifier.predict(scene_features(predictor.mapping_tar, predictor.encoder, scene, index, batch_size, device))
+    return dict(scores(labels, predict),
+                parameters=count_parameters([predictor.mapping_tar, predictor.encoder]),
+                pixels_per_s=pixels_per_second(predictor.mapping_tar, predictor.encoder, speed_patches, batch_size, device),
+                channels=pruning.channels(predictor.encoder))
+
+def main():
+    parser = argparse.ArgumentParser(description="Structured channel pruning of a trained encoder")
+    parser.add_argument('--config', type=str, required=True)
+    parser.add_argument('--checkpoint', type=str, required=True, help='seed<i>_best.pth written by train.py')
+    parser.add_argument('--criterion', type=str, default='bn', choices=['bn', 'taylor'], help='batch norm scale or Taylor saliency')
+    parser.add_argument('--ratios', type=float, nargs='+', default=[0.25, 0.5, 0.75], help='fractions of the channels of every convolution to prune')
+    parser.add_argument('--budget', type=int, default=500, help='fine-tuning episodes, 0 only prunes')
+    parser.add_argument('--eval_interval', type=int, default=100)
+    parser.add_argument('--lr', type=float, default=0, help='fine-tuning learning rate, 0 keeps the config value')
+    parser.add_argument('--batch_size', type=int, default=256)
+    parser.add_argument('--speed_pixels', type=int, default=4096, help='pixels timed for the throughput')
+    parser.add_argument('--output', type=str, default=os.path.join('./checkpoints', 'prune_' + time.strftime('%Y-%m-%d_%H-%M-%S')))
+    args = parser.parse_args()
+
+    config = imp.load_source("", args.config).config
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    state = checkpoint.load(args.checkpoint)
+    if state is None or 'mapping_src' not in state:
+        raise ValueError('{} is not a best weights file of train.py'.format(args.checkpoint))
+    seed = state['seed']
+    utils.same_seeds(seed)
+    original = inference.Predictor(args.checkpoint, device=device, batch_size=args.batch_size)
+    scene = inference.load_scene(config, original.bands)
+    index = inference.test_index(scene, original.support_pixels)
+    speed_patches = scene.get_patches(np.arange(min(args.speed_pixels, len(scene.labels))))
+
+    if args.criterion == 'taylor':
+        saliency = pruning.taylor_saliency(original.mapping_tar, original.encoder, state['support_data'], original.support_labels,
+                                           args.batch_size, device)
+    else:
+        saliency = pruning.bn_saliency(original.encoder)
+
+    if args.budget > 0:
+        # the split of the seed as train.py built it, and the source episodes of the fine-tuning
+        split = train.prepare_split(config, seed)
+        start = time.time()
+        semantic_mapping_src, semantic_mapping_tar = train.encode_labels([train.labels_src, config['labels_tar']])
+        source = {'metatrain_data': train.load_source(config['data_path'], config['source_data'], config['train_config']['storage_dtype']),
+                  'semantic_mapping_src': semantic_mapping_src, 'semantic_mapping_tar': semantic_mapping_tar}
+        print('source and label embeddings loaded in {:.1f}s'.format(time.time() - start))
+    train_opt = config['train_config']
+    experiment = '{}way_{}shot_{}'.format(train_opt['tar_class_num'], train_opt['tar_lsample_num_per_class'], config['target_data'].split('/')[0])
+
+    rows = [dict(ratio=0.0, stage='original', **evaluate(original, scene, index, speed_patches, args.batch_size, device))]
+    for ratio in args.ratios:
+        name = 'ratio{:g}'.format(ratio)
+        encoder = pruning.prune_encoder(original.encoder, pruning.select_channels(saliency, ratio))
+        pruned_opt = dict(original.train_opt)
+        pruned_opt['encoder_channels'] = pruning.channels(encoder)
+        pruned_path = os.path.join(args.output, name, 'pruned.pth')
+        if not os.path.exists(os.path.dirname(pruned_path)):
+            os.makedirs(os.path.dirname(pruned_path))
+        checkpoint.save(dict(state, encoder=encoder.state_dict(), train_config=pruned_opt, pruned_from=args.checkpoint,
+                             pruning={'criterion': args.criterion, 'ratio': ratio}), pruned_path)
+        rows.append(dict(ratio=ratio, stage='pruned',
+                         **evaluate(inference.Predictor(pruned_path, device=device, batch_size=args.batch_size), scene, index, speed_patches, args.batch_size, device)))
+
+        if args.budget > 0:
+            ft_config = dict(config)
+            ft_config['train_config'] = dict(train_opt, encoder_channels=pruned_opt['encoder_channels'])
+            result = adapt.run(ft_config, name, args.output, args.budget, pruned_path, args, source, split, seed)
+            finetuned_path = os.path.join(args.output, name, experiment, 'seed0_best.pth')
+            rows.append(dict(ratio=ratio, stage='finetuned', train_time=result['train_time'],
+                             **evaluate(inference.Predictor(finetuned_path, device=device, batch_size=args.batch_size), scene, index, speed_patches, args.batch_size, device)))
+
+    print('{} saliency, {} test pixels, fine-tuned for {} episodes'.format(args.criterion, len(index), args.budget))
+    print('{:>6s} {:<10s} {:>7s} {:>7s} {:>7s} {:>10s} {:>11s} {:>8s}'.format('ratio', 'stage', 'OA', 'AA', 'kappa', 'parameters', 'pixels/s', 'speedup'))
+    for row in rows:
+        row['speedup'] = row['pixels_per_s'] / rows[0]['pixels_per_s']
+        print('{:>6.2f} {:<10s} {:>7.2f} {:>7.2f} {:>7.2f} {:>10d} {:>11.1f} {:>7.2f}x'.format(
+            row['ratio'], row['stage'], row['OA'], row['AA'], row['kappa'], row['parameters'], row['pixels_per_s'], row['speedup']))
+    if not os.path.exists(args.output):
+        os.makedirs(args.output)
+    with open(os.path.join(args.output, 'prune_report.json'), 'w') as f:
+        json.dump({'checkpoint': args.checkpoint, 'criterion': args.criterion, 'budget': args.budget, 'rows': rows}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,363 @@
+"""
+local inference service on the best weights of a seed saved by train.py. Pixels are classified by the
+target mapping + encoder and the cached support features (1-NN or class prototypes). Concurrent
+requests are coalesced into micro-batches of at most max_batch pixels, waiting at most
+max_latency_ms after the first one, and the batches run in a pool of worker threads:
+
+    python serve.py --checkpoint checkpoints/seed0_best.pth --config config/Indian_pines.py --port 8000
+    python serve.py --checkpoint checkpoints/seed0_best.pth --config config/Indian_pines.py --socket /tmp/hsi.sock
+
+API (JSON):
+    POST /classify  {"pixels": [[row, col], ...]}, {"tile": [row, col, height, width]}
+                    or {"patches": (N, nBand, H, W) nested list}  ->  {"labels": [...], "names": [...]}
+    GET  /stats     latency percentiles, throughput and batch sizes
+    GET  /health    image shape, bands, patch size and class names
+
+benchmarks/serve_load.py is the load test client.
+"""
+import argparse
+import collections
+import http.client
+import http.server
+import imp
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+import torch
+
+from utils import inference, autotune
+
+
+class _Request(object):
+    def __init__(self, patches):
+        self.patches = patches
+        self.arrival = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class Stats(object):
+    """
+    counters of the service, the latency percentiles are taken over the last `window` requests
+    """
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=window)
+        self.start = time.perf_counter()
+        self.requests = 0
+        self.pixels = 0
+        self.batches = 0
+        self.batch_requests = 0
+        self.compute_time = 0.
+        self.errors = 0
+
+    def record_batch(self, batch, compute_time, error):
+        now = time.perf_counter()
+        with self.lock:
+            self.batches += 1
+            self.batch_requests += len(batch)
+            self.compute_time += compute_time
+            for request in batch:
+                self.latencies.append(now - request.arrival)
+                self.requests += 1
+                self.pixels += len(request.patches)
+            self.errors += len(batch) if error else 0
+
+    def snapshot(self):
+        with self.lock:
+            latencies = 1000. * np.array(self.latencies) if self.latencies else np.zeros(1)
+            elapsed = time.perf_counter() - self.start
+            batches = max(self.batches, 1)
+            return {'requests': self.requests,
+                    'pixels': self.pixels,
+                    'errors': self.errors,
+                    'batches': self.batches,
+                    'uptime_s': elapsed,
+                    'requests_per_s': self.requests / elapsed,
+                    'pixels_per_s': self.pixels / elapsed,
+                    'latency_p50_ms': float(np.percentile(latencies, 50)),
+                    'latency_p90_ms': float(np.percentile(latencies, 90)),
+                    'latency_p99_ms': float(np.percentile(latencies, 99)),
+                    'latency_max_ms': float(latencies.max()),
+                    'mean_batch_requests': self.batch_requests / batches,
+                    'mean_batch_pixels': self.pixels / batches,
+                    'mean_batch_compute_ms': 1000. * self.compute_time / batches}
+
+class MicroBatcher(object):
+    """
+    coalesces the patches of concurrent requests into batches for the predictor
+    :param max_batch: pixels of a batch, a larger request is run as a batch of its own
+    :param max_latency_ms: longest wait for more requests after the first one of a batch
+    :param workers: batches run at the same time, the batcher keeps filling the next one meanwhile
+    """
+    def __init__(self, predictor, max_batch=1024, max_latency_ms=5., workers=2, stats=None):
+        self.predictor = predictor
+        self.max_batch = max_batch
+        self.max_latency = max_latency_ms / 1000.
+        self.stats = stats or Stats()
+        self.queue = queue.Queue()
+        self.free_workers = threading.Semaphore(workers)
+        self.pool = ThreadPoolExecutor(workers)
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def classify(self, patches, timeout=None):
+        request = _Request(patches)
+        self.queue.put(request)
+        if not request.done.wait(timeout):
+            raise TimeoutError('no answer after {}s'.format(timeout))
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.pool.shutdown()
+
+    def _take(self, timeout):
+        """
+        :return: the next request or None (timeout, or None when closing, which is put back)
+        """
+        try:
+            request = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+        except queue.Empty:
+            return None
+        if request is None:
+            self.queue.put(None)
+        return request
+
+    def _loop(self):
+        while True:
+            request = self.queue.get()
+            if request is None:
+                return
+            batch, size = [request], len(request.patches)
+            deadline = request.arrival + self.max_latency
+            while size < self.max_batch:
+                request = self._take(deadline - time.perf_counter())
+                if request is None:
+                    break
+                batch.append(request)
+                size += len(request.patches)
+            # requests that arrived while every worker was busy join this batch
+            self.free_workers.acquire()
+            while size < self.max_batch:
+                request = self._take(0)
+                if request is None:
+                    break
+                batch.append(request)
+                size += len(request.patches)
+            self.pool.submit(self._run, batch)
+
+    def _run(self, batch):
+        start = time.perf_counter()
+        error = None
+        try:
+            predict = self.predictor.predict(np.concatenate([request.patches for request in batch]))
+            offsets = np.cumsum([0] + [len(request.patches) for request in batch])
+            for i, request in enumerate(batch):
+                request.result = predict[offsets[i]:offsets[i + 1]]
+        except Exception as e:
+            error = e
+            for request in batch:
+                request.error = e
+        finally:
+            self.free_workers.release()
+            self.stats.record_batch(batch, time.perf_counter() - start, error)
+            for request in batch:
+                request.done.set()
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def address_string(self):
+        # unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super(Handler, self).log_message(format, *args)
+
+    def _send(self, code, body):
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send(200, self.server.batcher.stats.snapshot())
+        elif self.path == '/health':
+            self._send(200, self.server.info)
+        else:
+            self._send(404, {'error': 'unknown path {}'.format(self.path)})
+
+    def do_POST(self):
+        if self.path != '/classify':
+            self._send(404, {'error': 'unknown path {}'.format(self.path)})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+            patches = self.server.get_patches(body)
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            self._send(400, {'error': str(e)})
+            return
+        try:
+            labels = self.server.batcher.classify(patches, self.server.timeout_s)
+        except Exception as e:
+            self._send(500, {'error': repr(e)})
+            return
+        result = {'labels': labels.tolist()}
+        if self.server.class_names:
+            result['names'] = [self.server.class_names[label] for label in labels]
+        self._send(200, result)
+
+class _Service(object):
+    def setup_service(self, predictor, batcher, scene, timeout_s, verbose):
+        self.predictor = predictor
+        self.batcher = batcher
+        self.scene = scene
+        self.timeout_s = timeout_s
+        self.verbose = verbose
+        self.class_names = predictor.class_names
+        train_opt = predictor.train_opt
+        # a band-selected model takes patches of all bands or of its selected bands only
+        self.band_counts = [train_opt['tar_input_dim']] + ([len(predictor.bands)] if predictor.bands is not None else [])
+        self.info = {'status': 'ok', 'bands': self.band_counts[-1], 'target_bands': predictor.bands, 'patch_size': train_opt['patch_size'],
+                     'shape': list(scene.shape) if scene is not None else None, 'classes': self.class_names}
+
+    def get_patches(self, body):
+        """
+        float32 patches of a request body
+        """
+        if 'patches' in body:
+            patches = np.asarray(body['patches'], dtype=np.float32)
+            train_opt = self.predictor.train_opt
+            if patches.ndim != 4 or patches.shape[1] not in self.band_counts or patches.shape[2:] != (train_opt['patch_size'], train_opt['patch_size']):
+                raise ValueError('patches must have the shape (N, {}, {}, {})'.format(
+                    ' or '.join(str(count) for count in self.band_counts), train_opt['patch_size'], train_opt['patch_size']))
+            return patches
+        if self.scene is None:
+            raise ValueError('the service was started without --config, only patches can be classified')
+        height, width = self.scene.shape
+        if 'tile' in body:
+            row, column, tile_height, tile_width = [int(v) for v in body['tile']]
+            rows, columns = np.mgrid[row:row + tile_height, column:column + tile_width]
+            rows, columns = rows.ravel(), columns.ravel()
+        else:
+            pixels = np.asarray(body['pixels'], dtype=np.int64).reshape(-1, 2)
+            rows, columns = pixels[:, 0], pixels[:, 1]
+        if len(rows) == 0:
+            raise ValueError('no pixels')
+        if rows.min() < 0 or columns.min() < 0 or rows.max() >= height or columns.max() >= width:
+            raise IndexError('pixels outside of the {}x{} image'.format(height, width))
+        return self.scene.cut(rows, columns)
+
+class HTTPServer(_Service, http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+class UnixHTTPServer(_Service, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=60):
+        super(UnixHTTPConnection, self).__init__('localhost', timeout=timeout)
+        self.socket_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+class Client(object):
+    """
+    keep-alive client of the service, over tcp (host, port) or a unix socket path; not thread safe,
+    use one per thread
+    """
+    def __init__(self, host='127.0.0.1', port=8000, socket_path=None, timeout=60):
+        if socket_path:
+            self.connection = UnixHTTPConnection(socket_path, timeout)
+        else:
+            self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def _request(self, method, path, body=None):
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        self.connection.request(method, path, json.dumps(body) if body is not None else None, headers)
+        response = self.connection.getresponse()
+        result = json.loads(response.read())
+        if response.status != 200:
+            raise RuntimeError('{} {}: {}'.format(response.status, path, result.get('error')))
+        return result
+
+    def classify(self, pixels=None, tile=None, patches=None):
+        if patches is not None:
+            return self._request('POST', '/classify', {'patches': np.asarray(patches).tolist()})
+        if tile is not None:
+            return self._request('POST', '/classify', {'tile': list(tile)})
+        return self._request('POST', '/classify', {'pixels': np.asarray(pixels).tolist()})
+
+    def stats(self):
+        return self._request('GET', '/stats')
+
+    def health(self):
+        return self._request('GET', '/health')
+
+    def close(self):
+        self.connection.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Pixel classification service")
+    parser.add_argument('--checkpoint', type=str, required=True, help='seed<i>_best.pth written by train.py')
+    parser.add_argument('--config', type=str, default=None, help='config of the target scene, needed to classify pixel coordinates')
+    parser.add_argument('--mode', type=str, default='knn', choices=['knn', 'prototype'])
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--socket', type=str, default=None, help='serve on this unix socket instead of tcp')
+    parser.add_argument('--max_batch', type=int, default=1024, help='pixels per micro-batch')
+    parser.add_argument('--max_latency_ms', type=float, default=5., help='wait for more requests after the first one of a batch')
+    parser.add_argument('--workers', type=int, default=2, help='micro-batches classified at the same time')
+    parser.add_argument('--threads', type=int, default=0, help='torch threads, 0 takes the machine profile (utils.autotune) or the torch default')
+    parser.add_argument('--timeout', type=float, default=60., help='seconds before a request is answered with an error')
+    parser.add_argument('--verbose', action='store_true', help='log every request')
+    args = parser.parse_args()
+
+    autotune.set_threads(args.threads)
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    predictor = inference.Predictor(args.checkpoint, args.mode, device, batch_size=args.max_batch)
+    scene = inference.load_scene(imp.load_source("", args.config).config, predictor.bands) if args.config else None
+    batcher = MicroBatcher(predictor, args.max_batch, args.max_latency_ms, args.workers)
+
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = UnixHTTPServer(args.socket, Handler)
+        address = args.socket
+    else:
+        server = HTTPServer((args.host, args.port), Handler)
+        address = 'http://{}:{}'.format(args.host, args.port)
+    server.setup_service(predictor, batcher, scene, args.timeout, args.verbose)
+    print('serving {} ({}) on {}, max_batch {} max_latency {}ms workers {}'.format(
+        args.checkpoint, args.mode, address, args.max_batch, args.max_latency_ms, args.workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.close()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+        print(json.dumps(batcher.stats.snapshot(), indent=2))
+
+if __name__ == '__main__':
+    main()
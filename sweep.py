@@ -0,0 +1,196 @@
+"""
+hyperparameter sweep over the train_config entries of one target dataset.
+The source pool, the BERT label embeddings and the target split of every seed are prepared once,
+put in shared memory and reused by all trials, which run in a pool of worker processes:
+
+    python sweep.py --config config/Indian_pines.py --space config/sweep_space.py --mode random --trials 32 --workers 8 --num_seeds 3 --episode 2000
+
+The trials are ranked by OA, then AA, then kappa in <sweep_dir>/results.tsv.
+"""
+import argparse
+import copy
+import imp
+import itertools
+import os
+import time
+import numpy as np
+
+import torch
+import torch.multiprocessing as mp
+
+import train
+from utils.dataloader import TARGET_LOADERS
+
+
+def get_trials(space, mode, num_trials=0, seed=0):
+    """
+    :param space: train_config key -> list of values, (low, high) or ('log', low, high)
+    :param mode: 'grid' (every combination of the lists) or 'random' (num_trials samples)
+    :return: list of dicts of overridden train_config entries
+    """
+    if mode == 'grid':
+        for key, values in space.items():
+            if not isinstance(values, list):
+                raise ValueError('grid search needs a list of values for {}'.format(key))
+        return [dict(zip(space.keys(), values)) for values in itertools.product(*space.values())]
+    if mode != 'random':
+        raise ValueError('Unknown sweep mode: {}'.format(mode))
+
+    rng = np.random.RandomState(seed)
+    trials = []
+    for _ in range(num_trials):
+        params = {}
+        for key, values in space.items():
+            if isinstance(values, list):
+                params[key] = values[rng.randint(len(values))]
+            elif len(values) == 3 and values[0] == 'log':
+                params[key] = float(np.exp(rng.uniform(np.log(values[1]), np.log(values[2]))))
+            else:
+                params[key] = float(rng.uniform(values[0], values[1]))
+        trials.append(params)
+    return trials
+
+class SharedArray(object):
+    """
+    numpy array moved to shared memory, pickled as a handle when sent to a worker process
+    """
+    def __init__(self, array):
+        self.dtype = array.dtype
+        # bfloat16 patches are uint16, which not every torch version can wrap
+        array = np.ascontiguousarray(array)
+        if self.dtype == np.uint16:
+            array = array.view(np.int16)
+        self.tensor = torch.from_numpy(array).share_memory_()
+
+    def numpy(self):
+        return self.tensor.numpy().view(self.dtype)
+
+def share(obj, min_bytes=1 << 16):
+    """
+    replace the large numpy arrays of a nested dict/list/tuple by SharedArray, small ones are just pickled
+    """
+    if isinstance(obj, dict):
+        return type(obj)((key, share(value, min_bytes)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(share(value, min_bytes) for value in obj)
+    if isinstance(obj, np.ndarray) and obj.nbytes >= min_bytes and obj.dtype != object:
+        return SharedArray(obj)
+    return obj
+
+def unshare(obj):
+    if isinstance(obj, dict):
+        return type(obj)((key, unshare(value)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(unshare(value) for value in obj)
+    if isinstance(obj, SharedArray):
+        return obj.numpy()
+    return obj
+
+def prepare(config, seeds):
+    """
+    everything the trials have in common: source pool, label embeddings and the target split of each seed
+    """
+    semantic_mapping_src, semantic_mapping_tar = train.encode_labels([train.labels_src, config['labels_tar']])
+    metatrain_data = train.load_source(config['data_path'], config['source_data'], config['train_config']['storage_dtype'])
+    # one (200, nBand, 7, 7) array per class instead of 200 small ones, Task indexes both the same way
+    metatrain_data = {class_: np.stack(patches) for class_, patches in metatrain_data.items()}
+
+    target_scene = TARGET_LOADERS[config['target_type']][0](config)
+    splits = [train.prepare_split(config, seed, target_scene) for seed in seeds]
+    return {'metatrain_data': metatrain_data,
+            'semantic_mapping_src': semantic_mapping_src,
+            'semantic_mapping_tar': semantic_mapping_tar,
+            'splits': splits}
+
+_prepared = None
+
+def _init_worker(shared, threads):
+    global _prepared
+    _prepared = unshare(shared)
+    torch.set_num_threads(threads)
+
+def run_trial(trial):
+    """
+    train all seeds with the train_config overrides of one trial
+    """
+    config = copy.deepcopy(trial['config'])
+    config['train_config'].update(trial['params'])
+    config['train_config']['checkpoint_interval'] = 0
+    config['log_dir'] = trial['dir']
+    config['map_name'] = os.path.abspath(os.path.join(trial['dir'], 'map_{}shot.png'))
+
+    args = argparse.Namespace(resume=False, profile_memory=False, world_size=1)
+    start = time.time()
+    try:
+        result = train.train_target(config, _prepared['metatrain_data'], _prepared['semantic_mapping_src'],
+                                    _prepared['semantic_mapping_tar'], args, seeds=trial['seeds'], splits=_prepared['splits'])
+        error = ''
+    except Exception as e:  # a diverging trial must not stop the sweep
+        result = {'OA': np.nan, 'OA_std': np.nan, 'AA': np.nan, 'AA_std': np.nan,
+                  'kappa': np.nan, 'kappa_std': np.nan, 'train_time': np.nan, 'test_time': np.nan}
+        error = repr(e)
+    result = {key: float(value) for key, value in result.items() if key not in ('experiment', 'history')}
+    result.update({'trial': trial['id'], 'params': trial['params'], 'wall_time': time.time() - start, 'error': error})
+    return result
+
+def rank(results):
+    def key(result):
+        return tuple(-np.inf if np.isnan(result[name]) else result[name] for name in ['OA', 'AA', 'kappa'])
+    return sorted(results, key=key, reverse=True)
+
+def save_results(results, keys, path):
+    columns = ['rank', 'trial'] + keys + ['OA', 'OA_std', 'AA', 'AA_std', 'kappa', 'kappa_std', 'train_time', 'wall_time', 'error']
+    with open(path, 'w') as f:
+        f.write('\t'.join(columns) + '\n')
+        for i, result in enumerate(results):
+            row = [str(i + 1), str(result['trial'])] + [str(result['params'][key]) for key in keys]
+            row += ['{:.4f}'.format(result[name]) for name in ['OA', 'OA_std', 'AA', 'AA_std', 'kappa', 'kappa_std', 'train_time', 'wall_time']]
+            f.write('\t'.join(row + [result['error']]) + '\n')
+
+def main():
+    parser = argparse.ArgumentParser(description="Hyperparameter sweep")
+    parser.add_argument('--config', type=str, default=os.path.join('./config', 'Indian_pines.py'))
+    parser.add_argument('--space', type=str, default=os.path.join('./config', 'sweep_space.py'))
+    parser.add_argument('--mode', type=str, default='grid', choices=['grid', 'random'])
+    parser.add_argument('--trials', type=int, default=20, help='number of trials of a random search')
+    parser.add_argument('--search_seed', type=int, default=0)
+    parser.add_argument('--num_seeds', type=int, default=len(train.SEEDS), help='first seeds of train.SEEDS run by every trial')
+    parser.add_argument('--episode', type=int, default=0, help='episodes per seed, 0 keeps the config value')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=0, help='torch threads per worker, 0 splits the cores between the workers')
+    parser.add_argument('--sweep_dir', type=str, default=os.path.join('./logs', 'sweep_' + time.strftime('%Y-%m-%d_%H-%M-%S')))
+    args = parser.parse_args()
+
+    config = imp.load_source("", args.config).config
+    space = imp.load_source("", args.space).space
+    if args.episode > 0:
+        config['train_config']['episode'] = args.episode
+    seeds = train.SEEDS[:args.num_seeds]
+    trials = get_trials(space, args.mode, args.trials, args.search_seed)
+    print('{} trials x {} seeds, {} workers'.format(len(trials), len(seeds), args.workers))
+
+    start = time.time()
+    shared = share(prepare(config, seeds))
+    print('data prepared in {:.1f}s'.format(time.time() - start))
+
+    trials = [{'id': i, 'params': params, 'seeds': seeds, 'config': config,
+               'dir': os.path.join(args.sweep_dir, 'trial{:03d}'.format(i))} for i, params in enumerate(trials)]
+    threads = args.threads if args.threads > 0 else max(1, (os.cpu_count() or 1) // args.workers)
+    results = []
+    with mp.get_context('spawn').Pool(args.workers, initializer=_init_worker, initargs=(shared, threads)) as pool:
+        for result in pool.imap_unordered(run_trial, trials):
+            print('trial {:>3d}  OA {:6.2f}  AA {:6.2f}  kappa {:7.4f}  {:7.1f}s  {}'.format(
+                result['trial'], result['OA'], result['AA'], result['kappa'], result['wall_time'], result['params']))
+            results.append(result)
+
+    results = rank(results)
+    if not os.path.exists(args.sweep_dir):
+        os.makedirs(args.sweep_dir)
+    save_results(results, list(space.keys()), os.path.join(args.sweep_dir, 'results.tsv'))
+    print('sweep finished in {:.1f}s, best trials:'.format(time.time() - start))
+    for i, result in enumerate(results[:5]):
+        print('{}. trial {}  OA {:.2f} +- {:.2f}  AA {:.2f}  kappa {:.4f}  {}'.format(
+            i + 1, result['trial'], result['OA'], result['OA_std'], result['AA'], result['kappa'], result['params']))
+
+if __name__ == '__main__':
+    main()
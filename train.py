@@ -0,0 +1,788 @@
+"""
+trains one or several target datasets against one loaded source in a single process.
+The source pool and the BERT label embeddings are built once and shared by every target:
+
+    python train.py --config config/Indian_pines.py config/HT.py
+
+With --world_size N the training loop runs data parallel in N processes (gloo, one machine):
+every rank samples its own episodes and ssl batch, the gradients are averaged over the ranks
+and rank 0 evaluates and logs. Set config['gpu'] = 'cpu' to train on the cpu cores only.
+With --source_checkpoint the source mapping and the encoder start from the weights of
+pretrain_source.py, so the targets need a much shorter episode budget.
+"""
+import numpy as np
+import os
+import argparse
+import pickle
+import time
+import imp
+import logging
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+import torch.multiprocessing as mp
+from torch.utils.tensorboard import SummaryWriter
+
+from model.mapping import Mapping
+from model.encoder import Encoder
+from model import batched
+from utils.dataloader import get_HBKC_data_loader, Task, tagetSSLDataset, MetaTrainLabeledDataset, get_target_pools, TARGET_LOADERS
+from utils.feature_queue import FeatureQueue, MomentumModel
+from utils import utils, loss_function, data_augment, checkpoint, schedule, profiling, distributed, storage, evaluation, autotune
+
+# Chikusei
+labels_src = ["water", "bare soil school", "bare soil park", "bare soil farmland", "natural plants", "weeds in farmland", "forest", "grass", "rice field grown", "rice field first stage", "row crops", "plastic house", "manmade non dark", "manmade dark", "manmade blue", "manmade red", "manmade grass", "asphalt"]
+
+BERT_PATH = 'pretrain-model/bert-base-uncased'
+
+# options of the source mapping and the encoder, a source checkpoint only fits targets with the same ones
+SOURCE_MODEL_OPTIONS = ['src_input_dim', 'n_dim', 'patch_size', 'd_emb', 'inter_size', 'spectral_residual', 'branches', 'encoder_channels']
+
+SEEDS = [1224, 1233, 1236, 1237, 1227, 1223, 1554, 1338, 1556, 1438]
+
+
+def get_parser(default_config=None):
+    parser = argparse.ArgumentParser(description="Few Shot Visual Recognition")
+    parser.add_argument('--config', type=str, nargs='+', default=[default_config or os.path.join('./config', 'Indian_pines.py')],
+                        help='one or several target configs trained against the same source')
+    parser.add_argument('--resume', action='store_true', help='continue from the last checkpoint of this experiment')
+    parser.add_argument('--profile_memory', action='store_true', help='record RSS/tracemalloc/device memory peaks per stage')
+    parser.add_argument('--world_size', type=int, default=1, help='number of data parallel training processes')
+    parser.add_argument('--dist_port', type=int, default=29500, help='tcp port of the gloo rendezvous')
+    parser.add_argument('--source_checkpoint', type=str, default=None,
+                        help='pretrain_source.py weights for every target, overrides train_opt source_checkpoint')
+    parser.add_argument('--threads', type=int, default=0, help='torch threads per process, 0 splits the cores between the processes '
+                                                               '(a single process takes the machine profile, utils.autotune)')
+    return parser
+
+def load_source_checkpoint(path, train_opt, device='cpu'):
+    """
+    weights of pretrain_source.py, checked against the model options of the target config
+    """
+    state = checkpoint.load(path, device)
+    if state is None:
+        raise FileNotFoundError(path)
+    for name in SOURCE_MODEL_OPTIONS:
+        if state['train_config'].get(name) != train_opt.get(name):
+            raise ValueError('{} was pretrained with {}={}, the target config has {}'.format(
+                path, name, state['train_config'].get(name), train_opt.get(name)))
+    return state
+
+def encode_labels(label_lists, bert_path=BERT_PATH):
+    """
+    BERT [CLS] embedding of every class name, the model is loaded once for all lists
+    :return: one (num_classes, 768) array per list
+    """
+    from transformers import BertModel, BertTokenizer
+    model = BertModel.from_pretrained(bert_path)
+    model.eval()
+    tokenizer = BertTokenizer.from_pretrained(bert_path)
+
+    semantic_mappings = []
+    for labels in label_lists:
+        # padding and truncation give all sequences the same length
+        encoded_inputs = tokenizer(labels, padding=True, truncation=True, return_tensors='pt')
+        with torch.no_grad():
+            outputs = model(**encoded_inputs)
+        semantic_mappings.append(outputs.last_hidden_state[:, 0, :].cpu().numpy())  # (num_classess, 768)
+    return semantic_mappings
+
+def load_source(data_path, source_data, storage_dtype='float32'):
+    """
+    source pool for the few-shot episodes: class index -> list of (nBand, 7, 7) patches,
+    classes with less than 200 samples are dropped and the others keep their last 200 samples
+    :param source_data: pickle, or .npz store written by utils.storage
+    :param storage_dtype: dtype the patches are kept in, they are upcast when an episode is gathered
+    """
+    profiling.memory.start('load_source')
+    if source_data.endswith('.npz'):
+        source_imdb = storage.load(os.path.join(data_path, source_data))
+    else:
+        with open(os.path.join(data_path, source_data), 'rb') as handle:
+            source_imdb = pickle.load(handle)
+
+    if storage.storage_dtype_of(source_imdb['data']) == storage_dtype:
+        data_train = source_imdb['data']
+    else:
+        data_train = storage.to_storage(storage.upcast(source_imdb['data']), storage_dtype)
+    del source_imdb['data']
+    labels_train = source_imdb['Labels']
+
+    # label -> index of the label in the sorted list of labels
+    keys_all_train = sorted(list(set(labels_train)))
+    label_encoder_train = {}
+    for i in range(len(keys_all_train)):
+        label_encoder_train[keys_all_train[i]] = i
+
+    # organize the data by class
+    train_dict = {}
+    for class_, path in zip(labels_train, data_train):
+        if label_encoder_train[class_] not in train_dict:
+            train_dict[label_encoder_train[class_]] = []
+        train_dict[label_encoder_train[class_]].append(path)
+
+    del keys_all_train
+    del label_encoder_train
+
+    metatrain_data = utils.sanity_check(train_dict)
+
+    for class_ in metatrain_data:
+        for i in range(len(metatrain_data[class_])):
+            metatrain_data[class_][i] = np.transpose(metatrain_data[class_][i], (2, 0, 1))
+    profiling.memory.stop()
+    return metatrain_data
+
+def prepare_split(config, seed, target_scene=None):
+    """
+    build the target split of one seed as plain arrays, they can be put in shared memory and turned
+    back into the loaders of train_target by build_split
+    """
+    load_target, get_target_dataset, _ = TARGET_LOADERS[config['target_type']]
+    train_opt = config['train_config']
+    if target_scene is None:
+        target_scene = load_target(config)
+    utils.same_seeds(seed)
+    train_loader, test_loader, target_da_metatrain_data, G, RandPerm, Row, Column, nTrain, target_aug_data_ssl, target_aug_label_ssl = get_target_dataset(
+        class_num=train_opt['tar_class_num'],
+        tar_lsample_num_per_class=train_opt['tar_lsample_num_per_class'],
+        shot_num_per_class=train_opt['tar_lsample_num_per_class'],
+        patch_size=train_opt['patch_size'],
+        **target_scene)
+    train_data, train_labels = zip(*[train_loader.dataset[i] for i in range(len(train_loader.dataset))])
+    test_data, test_labels = zip(*[test_loader.dataset[i] for i in range(len(test_loader.dataset))])
+    # the scene patches are exact in the storage dtype, storing them back is lossless
+    return {'train_data': storage.to_storage(np.stack(train_data), train_opt['storage_dtype']), 'train_labels': np.array(train_labels, dtype=np.int64),
+            'test_data': storage.to_storage(np.stack(test_data), train_opt['storage_dtype']), 'test_labels': np.array(test_labels, dtype=np.int64),
+            'da_data': target_aug_data_ssl.patches, 'da_labels': target_aug_label_ssl[:len(target_aug_data_ssl.patches)],
+            'da_repeat': target_aug_data_ssl.repeat,
+            'G': G, 'RandPerm': RandPerm, 'Row': Row, 'Column': Column, 'nTrain': nTrain,
+            'rng': checkpoint.get_rng_state()}
+
+def build_split(split, support_batch_size):
+    """
+    loaders and augmented pools of train_target from the arrays of prepare_split
+    """
+    train_loader = torch.utils.data.DataLoader(MetaTrainLabeledDataset(split['train_data'], split['train_labels']), batch_size=support_batch_size, shuffle=False)
+    test_loader = torch.utils.data.DataLoader(MetaTrainLabeledDataset(split['test_data'], split['test_labels']), batch_size=autotune.get('eval_batch_size', 100), shuffle=False)
+    target_da_metatrain_data, target_aug_data_ssl, target_aug_label_ssl = get_target_pools(
+        {'data': split['da_data'], 'Labels': split['da_labels'], 'repeat': split['da_repeat']})
+    # the classification map is drawn into G, the shared array must stay untouched
+    return train_loader, test_loader, target_da_metatrain_data, split['G'].copy(), split['RandPerm'], split['Row'], split['Column'], split['nTrain'], target_aug_data_ssl, target_aug_label_ssl
+
+def train_target(config, metatrain_data, semantic_mapping_src, semantic_mapping_tar, args, rank=0, seeds=None, splits=None):
+    """
+    run the seed loop of one target dataset and write its report and classification map
+    :param rank: rank of this process in a data parallel run, only rank 0 evaluates and logs
+    :param seeds: seeds to run, SEEDS by default
+    :param splits: per seed output of prepare_split, the target scene is then neither loaded nor split again
+    :return: OA/AA/kappa mean and std over the seeds, None on the other ranks
+    """
+    # load hyperparameters
+    train_opt = config['train_config']
+    target_data = config['target_data']
+    log_dir = config['log_dir']
+    patch_size = train_opt['patch_size']
+    batch_task = train_opt['batch_task']
+    emb_size = train_opt['d_emb']
+    SRC_INPUT_DIMENSION = train_opt['src_input_dim']
+    TAR_INPUT_DIMENSION = train_opt['tar_input_dim']
+    N_DIMENSION = train_opt['n_dim']
+    SHOT_NUM_PER_CLASS = train_opt['shot_num_per_class']
+    QUERY_NUM_PER_CLASS = train_opt['query_num_per_class']
+    EPISODE = train_opt['episode']
+    LEARNING_RATE = train_opt['lr']
+    GPU = config['gpu']
+    TAR_CLASS_NUM = train_opt['tar_class_num'] # the number of class
+    TAR_LSAMPLE_NUM_PER_CLASS = train_opt['tar_lsample_num_per_class'] # the number of labeled samples per class
+    WEIGHT_DECAY = train_opt['weight_decay']
+    LR_SCHEDULE = train_opt['lr_schedule']
+    WARMUP_EPISODE = train_opt['warmup_episode']
+    EARLY_STOP_PATIENCE = train_opt['early_stop_patience']
+    MIN_EPISODE = train_opt['min_episode']
+    TIMING_INTERVAL = train_opt['timing_interval']
+    DROPOUT = train_opt['dropout']
+    LOGIT_WEIGHT = train_opt['logit_weight']
+    SRC_SEMANTIC_SCALE = train_opt['src_semantic_scale']
+    TAR_SEMANTIC_SCALE = train_opt['tar_semantic_scale']
+    MASK_RATIO = train_opt['mask_ratio']
+    SSL_BATCH_SIZE = autotune.get('ssl_batch_size', 64) if train_opt['ssl_batch_size'] == 'auto' else train_opt['ssl_batch_size']
+    ALIGN_LOSS_WEIGHT = train_opt['align_loss_weight']
+    SCL_LOSS_WEIGHT = train_opt['scl_loss_weight']
+    SCL_TEMPERATURE = train_opt['scl_temperature']
+    SSL_QUEUE_SIZE = train_opt['ssl_queue_size']
+    SSL_QUEUE_MOMENTUM = train_opt['ssl_queue_momentum']
+    SSL_QUEUE_DTYPE = train_opt['ssl_queue_dtype']
+    EVAL_INTERVAL = train_opt['eval_interval']
+    WARM_START = train_opt['warm_start']
+    SOURCE_CHECKPOINT = train_opt['source_checkpoint']
+    TRAIN_MAPPING_SRC = train_opt['train_mapping_src']
+    BAND_LASSO = train_opt['band_lasso']
+    BAND_TOPK = train_opt['band_topk']
+    BAND_SELECT_EPISODE = train_opt['band_select_episode']
+    BATCHED_STEP = train_opt['batched_step']
+    GROUP_BN = train_opt['group_bn']
+    ASYNC_EVAL = train_opt['async_eval']
+
+    # load target data
+    load_target, get_target_dataset, train_in_randperm = TARGET_LOADERS[config['target_type']]
+    if splits is None:
+        with profiling.memory.stage('load_data'):
+            target_scene = load_target(config)
+
+    # loss init
+    crossEntropy = nn.CrossEntropyLoss().to(GPU)
+    infoNCE_Loss = loss_function.ContrastiveLoss(batch_size=TAR_CLASS_NUM, device=GPU).to(GPU)
+    SupConLoss_t = loss_function.SupConLoss(temperature=SCL_TEMPERATURE).to(GPU)
+    # test evaluations in a worker process on its own threads, only the first rank evaluates
+    evaluator = evaluation.AsyncEvaluator(train_opt, train_opt['eval_threads']) if ASYNC_EVAL and rank == 0 else None
+
+    # experimental result index
+    seeds = SEEDS if seeds is None else seeds
+    nDataSet = len(seeds)
+    acc = np.zeros([nDataSet, 1])
+    A = np.zeros([nDataSet, TAR_CLASS_NUM])
+    k = np.zeros([nDataSet, 1])
+    train_time = np.zeros([nDataSet])
+    test_time = np.zeros([nDataSet])
+    best_predict_all = []
+    # (seed, episode, seconds since the start of the seed, test accuracy) of every evaluation, for time-to-accuracy
+    history = []
+    best_G, best_RandPerm, best_Row, best_Column, best_nTrain = None,None,None,None,None
+
+    # log setting
+    experimentSetting = '{}way_{}shot_{}'.format(TAR_CLASS_NUM, TAR_LSAMPLE_NUM_PER_CLASS, target_data.split('/')[0])
+    if rank == 0:
+        utils.set_logging_config(os.path.join(log_dir, experimentSetting), nDataSet)
+    logger = logging.getLogger('main')
+    logger.info('seeds_list:{}'.format(seeds))
+
+    # checkpoint setting
+    checkpoint_interval = train_opt['checkpoint_interval']
+    checkpoint_dir = os.path.join(config['checkpoint_dir'], experimentSetting)
+    # every rank keeps its own sampling streams, so every rank has its own checkpoint
+    checkpoint_path = os.path.join(checkpoint_dir, 'state.pth' if rank == 0 else 'state_rank{}.pth'.format(rank))
+    finished = []
+    total_episode_saved, total_time_saved = 0, 0.0
+    state = checkpoint.load(checkpoint_path, GPU) if args.resume else None
+    if state is not None:
+        acc, A, k = state['acc'], state['A'], state['k']
+        finished = state['finished']
+        best_predict_all = state['best_predict_all']
+        best_G, best_RandPerm, best_Row, best_Column, best_nTrain = state['best_map']
+        train_time, test_time = state['train_time'], state['test_time']
+        logger.info('resume from {}, finished seeds: {}'.format(checkpoint_path, [seeds[i] for i in finished]))
+    elif args.resume:
+        logger.info('no checkpoint found at {}, start from scratch'.format(checkpoint_path))
+
+    for iDataSet in range(nDataSet):
+        if iDataSet in finished:
+            logger.info('seeds:{} already finished, skip'.format(seeds[iDataSet]))
+            continue
+
+        logger.info('emb_size:{}'.format(emb_size))
+        logger.info('patch_size:{}'.format(patch_size))
+        logger.info('seeds:{}'.format(seeds[iDataSet]))
+
+        utils.same_seeds(seeds[iDataSet])
+
+        # load target domain data for training and testing
+        if splits is None:
+            profiling.memory.start('target_dataset')
+            train_loader, test_loader, target_da_metatrain_data, G, RandPerm, Row, Column, nTrain, target_aug_data_ssl, target_aug_label_ssl = get_target_dataset(
+                class_num=TAR_CLASS_NUM,
+                tar_lsample_num_per_class=TAR_LSAMPLE_NUM_PER_CLASS,
+                shot_num_per_class=TAR_LSAMPLE_NUM_PER_CLASS,
+                patch_size=patch_size,
+                **target_scene)
+            profiling.memory.stop()
+        else:
+            train_loader, test_loader, target_da_metatrain_data, G, RandPerm, Row, Column, nTrain, target_aug_data_ssl, target_aug_label_ssl = build_split(splits[iDataSet], len(splits[iDataSet]['train_labels']))
+            # continue from the random state the split was built with, as if it had just been built
+            checkpoint.set_rng_state(splits[iDataSet]['rng'])
+
+        target_ssl_dataset = tagetSSLDataset(target_aug_data_ssl, target_aug_label_ssl)
+        ssl_generator = torch.Generator()
+        # the split above is shared by all ranks, the episodes and ssl batches are drawn per rank
+        rank_seed = seeds[iDataSet] + 10000 * rank
+        ssl_generator.manual_seed(rank_seed)
+        target_ssl_dataloader = torch.utils.data.DataLoader(target_ssl_dataset, batch_size=SSL_BATCH_SIZE, shuffle=True, drop_last=True, generator=ssl_generator)
+
+        num_supports, num_samples, query_edge_mask, evaluation_mask = utils.preprocess(TAR_CLASS_NUM, SHOT_NUM_PER_CLASS, QUERY_NUM_PER_CLASS, batch_task, GPU)
+
+        # mapping layers of both domains and the shared encoder
+        mapping_src = Mapping(SRC_INPUT_DIMENSION, N_DIMENSION).to(GPU)
+        mapping_tar = Mapping(TAR_INPUT_DIMENSION, N_DIMENSION).to(GPU)
+        encoder = Encoder(n_dimension=N_DIMENSION, patch_size=patch_size, emb_size=emb_size, dropout=DROPOUT,
+                          inter_size=train_opt['inter_size'], spectral_residual=train_opt['spectral_residual'], branches=train_opt['branches'],
+                          channels=train_opt['encoder_channels']).to(GPU)
+
+        mapping_src_optim = torch.optim.SGD(mapping_src.parameters(), lr=LEARNING_RATE, momentum=0.9, weight_decay=WEIGHT_DECAY)
+        mapping_tar_optim = torch.optim.SGD(mapping_tar.parameters(), lr=LEARNING_RATE, momentum=0.9, weight_decay=WEIGHT_DECAY)
+        encoder_optim = torch.optim.SGD(encoder.parameters(), lr=LEARNING_RATE, momentum=0.9, weight_decay=WEIGHT_DECAY)
+        lr_schedulers = schedule.get_lr_schedulers([mapping_src_optim, mapping_tar_optim, encoder_optim], LR_SCHEDULE, WARMUP_EPISODE, EPISODE)
+
+        mapping_src.apply(utils.weights_init)
+        mapping_tar.apply(utils.weights_init)
+        encoder.apply(utils.weights_init)
+        if SOURCE_CHECKPOINT:
+            # the source side learned once by pretrain_source.py instead of from scratch for every seed
+            source_state = load_source_checkpoint(SOURCE_CHECKPOINT, train_opt, GPU)
+            mapping_src.load_state_dict(source_state['mapping_src'])
+            encoder.load_state_dict(source_state['encoder'])
+            mapping_src.requires_grad_(TRAIN_MAPPING_SRC)
+            logger.info('source pretrained weights from {} ({} episodes)'.format(SOURCE_CHECKPOINT, source_state['episode']))
+        if WARM_START:
+            # incremental adaptation (adapt.py): continue from the best weights of a previous run
+            warm_start = checkpoint.load(WARM_START, GPU)
+            if warm_start.get('target_bands') is not None:
+                mapping_tar.select_bands(warm_start['target_bands'], mapping_tar_optim)
+            mapping_src.load_state_dict(warm_start['mapping_src'])
+            mapping_tar.load_state_dict(warm_start['mapping_tar'])
+            encoder.load_state_dict(warm_start['encoder'])
+            logger.info('warm start from {} (episode {}, accuracy {:.2f})'.format(WARM_START, warm_start['episode'], warm_start['accuracy']))
+        distributed.broadcast_parameters([mapping_src, mapping_tar, encoder])
+        if rank > 0:
+            utils.same_seeds(rank_seed)
+
+        mapping_src.to(GPU)
+        mapping_tar.to(GPU)
+        encoder.to(GPU)
+
+        mapping_src.train()
+        mapping_tar.train()
+        encoder.train()
+
+        logger.info("Training...")
+        last_accuracy = 0.0
+        best_episode = 0
+        # weights of the evaluations submitted to the async evaluator, by episode
+        snapshots = {}
+        total_hit_src, total_num_src, total_hit_tar, total_num_tar, acc_src, acc_tar = 0.0, 0.0, 0.0, 0.0, 0.0, 0.0
+
+        train_start = time.time()
+        writer = SummaryWriter() if rank == 0 else None
+        timer = profiling.PhaseTimer(sync=TIMING_INTERVAL > 0)
+
+        target_ssl_iter = checkpoint.ResumableIterator(target_ssl_dataloader, ssl_generator)
+
+        # memory bank of past ssl features, filled by the online model or by a momentum copy of it
+        ssl_queue, momentum_models = None, []
+        if SSL_QUEUE_SIZE > 0:
+            ssl_queue = FeatureQueue(SSL_QUEUE_SIZE, emb_size, SSL_QUEUE_DTYPE, GPU)
+            if SSL_QUEUE_MOMENTUM > 0:
+                momentum_models = [MomentumModel(mapping_tar, SSL_QUEUE_MOMENTUM), MomentumModel(encoder, SSL_QUEUE_MOMENTUM)]
+            logger.info('ssl feature queue of {} features ({:.1f}MB){}'.format(
+                SSL_QUEUE_SIZE, ssl_queue.nbytes / 1024. / 1024., ', momentum {}'.format(SSL_QUEUE_MOMENTUM) if momentum_models else ''))
+
+        modules = {'mapping_src': mapping_src, 'mapping_tar': mapping_tar, 'encoder': encoder,
+                   'mapping_src_optim': mapping_src_optim, 'mapping_tar_optim': mapping_tar_optim, 'encoder_optim': encoder_optim}
+        modules.update({'lr_scheduler{}'.format(i): lr_scheduler for i, lr_scheduler in enumerate(lr_schedulers)})
+        if ssl_queue is not None:
+            modules['ssl_queue'] = ssl_queue
+            modules.update({'momentum_{}'.format(name): model for name, model in zip(['mapping_tar', 'encoder'], momentum_models)})
+        start_episode = 0
+        if state is not None and state['seed'] is not None and state['seed']['iDataSet'] == iDataSet:
+            if state['seed']['counters'].get('target_bands') is not None:
+                mapping_tar.select_bands(state['seed']['counters']['target_bands'], mapping_tar_optim)
+            start_episode, counters = checkpoint.restore_seed_state(state['seed'], modules, target_ssl_iter)
+            last_accuracy, best_episode = counters['last_accuracy'], counters['best_episode']
+            total_hit_src, total_num_src, total_hit_tar, total_num_tar = counters['total_hit_src'], counters['total_num_src'], counters['total_hit_tar'], counters['total_num_tar']
+            acc_src, acc_tar = counters['acc_src'], counters['acc_tar']
+            train_start = time.time() - counters['train_time']
+            timer.load_state_dict(counters['timer'])
+            history = counters.get('history', history)
+            snapshots = counters.get('pending_evaluations', snapshots)
+            logger.info('resume seeds:{} from episode {}'.format(seeds[iDataSet], start_episode))
+        if evaluator is not None:
+            evaluator.set_split(train_loader.dataset, test_loader.dataset)
+            # evaluations still running when the run state was saved
+            for pending_episode, snapshot in sorted(snapshots.items()):
+                evaluator.submit(pending_episode, snapshot['mapping_tar'], snapshot['encoder'], snapshot['bands'])
+
+        def record_evaluation(episode, result, snapshot):
+            """
+            best accuracy, episode, prediction and weights bookkeeping of an evaluation of the weights `snapshot` of `episode`
+            """
+            nonlocal last_accuracy, best_episode, best_predict_all, best_G, best_RandPerm, best_Row, best_Column, best_nTrain
+            test_accuracy = result['accuracy']
+            history.append({'seed': seeds[iDataSet], 'episode': episode + 1, 'time': snapshot['time'], 'accuracy': test_accuracy})
+            writer.add_scalar('Acc/acc_test', test_accuracy, episode + 1)
+
+            logger.info('\t\tAccuracy: {}/{} ({:.2f}%) at episode {}\n'.format(result['total_rewards'], len(test_loader.dataset), test_accuracy, episode + 1))
+
+            if test_accuracy > last_accuracy:
+                last_accuracy = test_accuracy
+                best_episode = episode
+                acc[iDataSet] = test_accuracy
+                A[iDataSet, :] = result['confusion'].class_accuracy()
+                best_predict_all = result['predict']
+                best_G, best_RandPerm, best_Row, best_Column, best_nTrain = G, RandPerm, Row, Column, nTrain
+                k[iDataSet] = result['confusion'].kappa()
+                if checkpoint_interval > 0:
+                    train_datas, train_labels = train_loader.__iter__().next()
+                    checkpoint.save({'seed': seeds[iDataSet], 'episode': episode + 1, 'accuracy': test_accuracy,
+                                     'mapping_src': snapshot['mapping_src'],
+                                     'mapping_tar': snapshot['mapping_tar'],
+                                     'encoder': snapshot['encoder'],
+                                     # enough to classify new pixels without the training script (utils.inference)
+                                     'support_data': train_datas.numpy(), 'support_labels': train_labels.numpy(),
+                                     'support_pixels': np.stack([Row[RandPerm[:nTrain]], Column[RandPerm[:nTrain]]], 1) - patch_size // 2
+                                                       if train_in_randperm else None,
+                                     'train_config': dict(train_opt), 'labels_tar': config['labels_tar'],
+                                     'target_bands': snapshot['bands']},
+                                    os.path.join(checkpoint_dir, 'seed{}_best.pth'.format(iDataSet)))
+
+            logger.info('best episode:[{}], best accuracy={}'.format(best_episode + 1, last_accuracy))
+
+        for episode in range(start_episode, EPISODE):
+            timer.start()
+            if episode == start_episode:
+                profiling.memory.start('train_step')
+            # source and target few-shot learning
+            task_src = Task(metatrain_data, TAR_CLASS_NUM, SHOT_NUM_PER_CLASS, QUERY_NUM_PER_CLASS)
+            support_dataloader_src = get_HBKC_data_loader(task_src, num_per_class=SHOT_NUM_PER_CLASS, split="train", shuffle=False)
+            query_dataloader_src = get_HBKC_data_loader(task_src, num_per_class=QUERY_NUM_PER_CLASS, split="test", shuffle=False)
+
+            task_tar = Task(target_da_metatrain_data, TAR_CLASS_NUM, SHOT_NUM_PER_CLASS, QUERY_NUM_PER_CLASS)
+            support_dataloader_tar = get_HBKC_data_loader(task_tar, num_per_class=SHOT_NUM_PER_CLASS, split="train", shuffle=False)
+            query_dataloader_tar = get_HBKC_data_loader(task_tar, num_per_class=QUERY_NUM_PER_CLASS, split="test", shuffle=False)
+            timer.lap('task_sampling')
+
+            support_src, support_label_src = support_dataloader_src.__iter__().next()
+            query_src, query_label_src = query_dataloader_src.__iter__().next()
+            timer.lap('loader')
+            support_real_labels_src = task_src.support_real_labels
+            support_real_labels_tar = task_tar.support_real_labels
+
+            semantic_support_src = torch.zeros(TAR_CLASS_NUM, 768)
+            for i, class_id in enumerate(support_real_labels_src):
+                semantic_support_src[i] = torch.from_numpy(semantic_mapping_src[class_id])
+
+            semantic_support_tar = torch.zeros(TAR_CLASS_NUM, 768)
+            for i, class_id in enumerate(support_real_labels_tar):
+                semantic_support_tar[i] = torch.from_numpy(semantic_mapping_tar[class_id])
+            timer.lap('semantic')
+
+            support_tar, support_label_tar = support_dataloader_tar.__iter__().next()
+            query_tar, query_label_tar = query_dataloader_tar.__iter__().next()
+            timer.lap('loader')
+
+            if BATCHED_STEP:
+                # the ssl views are drawn first so that all the batches of the episode go through one encoder call
+                target_ssl_data, target_ssl_label = target_ssl_iter.next()
+                timer.lap('loader')
+                augment1_target_ssl_data = torch.FloatTensor(data_augment.random_mask_batch_image(target_ssl_data.data.cpu(), MASK_RATIO))
+                augment2_target_ssl_data = torch.FloatTensor(data_augment.random_mask_batch_image(target_ssl_data.data.cpu(), MASK_RATIO))
+                augment_target_ssl_data = torch.cat((augment1_target_ssl_data, augment2_target_ssl_data), dim=0)
+                timer.lap('ssl')
+                support_features_src, query_features_src, support_features_tar, query_features_tar, features_augment = batched.batched_forward(
+                    [(mapping_src, [support_src.to(GPU), query_src.to(GPU)]),
+                     (mapping_tar, [support_tar.to(GPU), query_tar.to(GPU), augment_target_ssl_data.to(GPU)])],
+                    encoder, GROUP_BN)
+                semantic_feature_src, semantic_feature_tar = encoder.word_emb_transformers(
+                    torch.cat([semantic_support_src, semantic_support_tar]).to(GPU)).split([len(semantic_support_src), len(semantic_support_tar)])
+                timer.lap('forward')
+            else:
+                support_features_src, semantic_feature_src = encoder(mapping_src(support_src.to(GPU)), semantic_feature=semantic_support_src.to(GPU), s_or_q = "support")
+                query_features_src = encoder(mapping_src(query_src.to(GPU)))
+                timer.lap('forward_src')
+
+                support_features_tar, semantic_feature_tar = encoder(mapping_tar(support_tar.to(GPU)), semantic_feature=semantic_support_tar.to(GPU), s_or_q = "support")
+                query_features_tar = encoder(mapping_tar(query_tar.to(GPU)))
+                timer.lap('forward_tar')
+
+            if SHOT_NUM_PER_CLASS > 1:
+                support_proto_src = support_features_src.reshape(TAR_CLASS_NUM, SHOT_NUM_PER_CLASS, -1).mean(dim=1)
+                support_proto_tar = support_features_tar.reshape(TAR_CLASS_NUM, SHOT_NUM_PER_CLASS, -1).mean(dim=1)
+            else:
+                support_proto_src = support_features_src
+                support_proto_tar = support_features_tar
+
+            # euclidean similarity of the queries to the support prototypes and to the label semantics
+            logits_src1 = utils.euclidean_metric(query_features_src, support_proto_src)
+            logits_src2 = (utils.euclidean_metric(query_features_src, semantic_feature_src))/SRC_SEMANTIC_SCALE
+            logits_src = LOGIT_WEIGHT * logits_src1 + (1-LOGIT_WEIGHT) * logits_src2
+            f_loss_src = crossEntropy(logits_src, query_label_src.long().to(GPU))
+
+            logits_tar1 = utils.euclidean_metric(query_features_tar, support_proto_tar)
+            logits_tar2 = (utils.euclidean_metric(query_features_tar, semantic_feature_tar))/TAR_SEMANTIC_SCALE
+            logits_tar = LOGIT_WEIGHT * logits_tar1 + (1-LOGIT_WEIGHT) * logits_tar2
+            f_loss_tar = crossEntropy(logits_tar, query_label_tar.long().to(GPU))
+
+            f_loss = f_loss_src + f_loss_tar
+
+            # cross-modal alignment loss
+            text_align_loss = infoNCE_Loss(semantic_feature_src, support_features_src) + infoNCE_Loss(semantic_feature_tar, support_features_tar)
+            timer.lap('loss')
+
+            # target domain supervised contrastive learning
+            if not BATCHED_STEP:
+                target_ssl_data, target_ssl_label = target_ssl_iter.next()
+                timer.lap('loader')
+
+                augment1_target_ssl_data = torch.FloatTensor(data_augment.random_mask_batch_image(target_ssl_data.data.cpu(), MASK_RATIO))  # (64, 200, 7, 7)
+                augment2_target_ssl_data = torch.FloatTensor(data_augment.random_mask_batch_image(target_ssl_data.data.cpu(), MASK_RATIO))  # (64, 200, 7, 7)
+                augment_target_ssl_data = torch.cat((augment1_target_ssl_data, augment2_target_ssl_data), dim=0)  # (128, 200, 7, 7)
+                features_augment = encoder(mapping_tar(augment_target_ssl_data.to(GPU)))  # (128, 128)
+
+            augment1_target_ssl_feature = F.normalize(features_augment[:len(target_ssl_data), :], dim = 1)  # (64, 128)
+            augment2_target_ssl_feature = F.normalize(features_augment[len(target_ssl_data):, :], dim = 1)  # (64, 128)
+            augment_target_ssl_feature = torch.cat([augment1_target_ssl_feature.unsqueeze(1), augment2_target_ssl_feature.unsqueeze(1)], dim=1) # (64, 2, 128)
+            queue_features, queue_labels = ssl_queue.get() if ssl_queue is not None else (None, None)
+            scl_loss_tar = SupConLoss_t(augment_target_ssl_feature, target_ssl_label, device=GPU, queue_features=queue_features, queue_labels=queue_labels)
+            timer.lap('ssl')
+
+            loss = f_loss + ALIGN_LOSS_WEIGHT * text_align_loss + SCL_LOSS_WEIGHT * scl_loss_tar
+            if BAND_LASSO > 0 and mapping_tar.bands is None:
+                loss = loss + BAND_LASSO * mapping_tar.group_lasso()
+
+            mapping_src.zero_grad()
+            mapping_tar.zero_grad()
+            encoder.zero_grad()
+
+            loss.backward()
+            timer.lap('backward')
+
+            distributed.all_reduce_gradients([mapping_src, mapping_tar, encoder])
+            timer.lap('all_reduce')
+
+            mapping_src_optim.step()
+            mapping_tar_optim.step()
+            encoder_optim.step()
+            for lr_scheduler in lr_schedulers:
+                lr_scheduler.step()
+            if BAND_TOPK > 0 and mapping_tar.bands is None and episode + 1 >= BAND_SELECT_EPISODE:
+                # hard top-k of the bands kept by the group lasso, the other bands are never read again
+                band_norms = mapping_tar.band_norms().detach().cpu().numpy()
+                mapping_tar.select_bands(np.argsort(-band_norms)[:BAND_TOPK], mapping_tar_optim)
+                logger.info('episode {}: kept the {} target bands {}, {:.1f}% of the band weight norm'.format(
+                    episode + 1, BAND_TOPK, mapping_tar.bands, 100. * band_norms[mapping_tar.bands].sum() / band_norms.sum()))
+                # the best weights are taken among the models reading only the selected bands
+                last_accuracy = 0.0
+            timer.lap('optimizer')
+
+            if ssl_queue is not None:
+                # the views of this batch are contrasted by the next steps
+                if momentum_models:
+                    for model in momentum_models:
+                        model.update()
+                    with torch.no_grad():
+                        queued = F.normalize(momentum_models[1](momentum_models[0](augment_target_ssl_data.to(GPU))), dim=1)
+                else:
+                    queued = torch.cat([augment1_target_ssl_feature, augment2_target_ssl_feature])
+                ssl_queue.enqueue(queued, torch.cat([target_ssl_label, target_ssl_label]))
+                timer.lap('ssl')
+            if episode == start_episode:
+                profiling.memory.stop()
+
+            total_hit_src += torch.sum(torch.argmax(logits_src, dim=1).cpu() == query_label_src).item()
+            total_num_src += query_src.shape[0]
+            acc_src = total_hit_src / total_num_src
+
+            total_hit_tar += torch.sum(torch.argmax(logits_tar, dim=1).cpu() == query_label_tar).item()
+            total_num_tar += query_tar.shape[0]
+            acc_tar = total_hit_tar / total_num_tar
+
+            if rank == 0 and (episode + 1) % 100 == 0:
+                logger.info('episode: {:>3d}, f_loss: {:6.4f}, text_align_loss: {:6.4f}, scl_loss_tar: {:6.4f}, loss: {:6.4f}, acc_src: {:6.4f}, acc_tar: {:6.4f}'.format(
+                    episode + 1,
+                    f_loss.item(),
+                    text_align_loss.item(),
+                    scl_loss_tar.item(),
+                    loss.item(),
+                    acc_src,
+                    acc_tar))
+
+                writer.add_scalar('Loss/f_loss', f_loss.item(), episode + 1)
+                writer.add_scalar('Loss/text_align_loss', text_align_loss.item(), episode + 1)
+                writer.add_scalar('Loss/scl_loss_tar', scl_loss_tar.item(), episode + 1)
+                writer.add_scalar('Loss/loss', loss.item(), episode + 1)
+
+                writer.add_scalar('Acc/acc_src', acc_src, episode + 1)
+                writer.add_scalar('Acc/acc_tar', acc_tar, episode + 1)
+
+            timer.lap('bookkeeping')
+
+            if rank == 0 and ((episode + 1) % EVAL_INTERVAL == 0 or episode == 0 or episode + 1 == EPISODE):
+                if evaluator is not None:
+                    # the worker evaluates a copy of the weights while training goes on
+                    snapshots[episode] = {'time': time.time() - train_start, 'bands': mapping_tar.bands,
+                                          'mapping_src': evaluation.snapshot(mapping_src), 'mapping_tar': evaluation.snapshot(mapping_tar),
+                                          'encoder': evaluation.snapshot(encoder)}
+                    evaluator.submit(episode, snapshots[episode]['mapping_tar'], snapshots[episode]['encoder'], mapping_tar.bands)
+                else:
+                    with profiling.memory.stage('evaluation'):
+                        # test
+                        logger.info("Testing ...")
+                        result = evaluation.evaluate(mapping_tar, encoder, train_loader, test_loader, GPU, TAR_CLASS_NUM)
+                    record_evaluation(episode, result, {'time': time.time() - train_start, 'bands': mapping_tar.bands,
+                                                        'mapping_src': mapping_src.state_dict(), 'mapping_tar': mapping_tar.state_dict(),
+                                                        'encoder': encoder.state_dict()})
+            if evaluator is not None:
+                for result in evaluator.poll():
+                    record_evaluation(result['episode'], result, snapshots.pop(result['episode']))
+
+            timer.lap('evaluation')
+
+            if checkpoint_interval > 0 and (episode + 1) % checkpoint_interval == 0 and episode + 1 < EPISODE:
+                counters = {'last_accuracy': last_accuracy, 'best_episode': best_episode,
+                            'total_hit_src': total_hit_src, 'total_num_src': total_num_src,
+                            'total_hit_tar': total_hit_tar, 'total_num_tar': total_num_tar,
+                            'acc_src': acc_src, 'acc_tar': acc_tar, 'train_time': time.time() - train_start,
+                            'timer': timer.state_dict(), 'history': history, 'target_bands': mapping_tar.bands,
+                            'pending_evaluations': snapshots}
+                checkpoint.save(checkpoint.run_state(acc, A, k, finished, best_predict_all,
+                                                     (best_G, best_RandPerm, best_Row, best_Column, best_nTrain),
+                                                     train_time, test_time,
+                                                     seed=checkpoint.seed_state(iDataSet, episode + 1, modules, target_ssl_iter, counters)),
+                                checkpoint_path)
+
+            timer.lap('checkpoint')
+            timer.end_episode()
+            if rank == 0 and TIMING_INTERVAL > 0 and (episode + 1) % TIMING_INTERVAL == 0:
+                timer.flush(writer, episode + 1)
+
+            if (episode + 1) % EVAL_INTERVAL == 0 and distributed.broadcast_flag(schedule.early_stop(episode, best_episode, EARLY_STOP_PATIENCE, MIN_EPISODE)):
+                logger.info('no improvement for {} episodes, early stop'.format(episode - best_episode))
+                break
+
+        if evaluator is not None:
+            # the last evaluations of the seed, the wait is charged to the evaluation
+            timer.start()
+            for result in evaluator.wait():
+                record_evaluation(result['episode'], result, snapshots.pop(result['episode']))
+            timer.lap('evaluation')
+
+        episode_run = episode + 1
+        if episode_run < EPISODE:
+            episode_saved = EPISODE - episode_run
+            time_saved = episode_saved * (time.time() - train_start) / episode_run
+            total_episode_saved += episode_saved
+            total_time_saved += time_saved
+            logger.info('stopped at episode {}: {} episodes saved, about {:.1f}s wall-clock saved'.format(episode_run, episode_saved, time_saved))
+        logger.info('iter:{} best episode:[{}], best accuracy={}'.format(iDataSet, best_episode + 1, last_accuracy))
+        test_time[iDataSet] = timer.get('evaluation')
+        train_time[iDataSet] = time.time() - train_start - test_time[iDataSet]
+        logger.info ("train time per DataSet(s): " + "{:.5f}".format(train_time[iDataSet]))
+        logger.info ("test time per DataSet(s): " + "{:.5f}".format(test_time[iDataSet]))
+        timing = timer.summary()
+        logger.info('time per episode(ms): ' + ', '.join('{}: {:.2f}'.format(name, phase['ms_per_episode']) for name, phase in timing['phases'].items()))
+        if rank == 0:
+            timer.save(os.path.join(log_dir, experimentSetting, 'timing_seed{}.json'.format(seeds[iDataSet])))
+        logger.info("accuracy list: {}".format(acc))
+        logger.info('***********************************************************************************')
+
+        finished.append(iDataSet)
+        if checkpoint_interval > 0:
+            checkpoint.save(checkpoint.run_state(acc, A, k, finished, best_predict_all,
+                                                 (best_G, best_RandPerm, best_Row, best_Column, best_nTrain),
+                                                 train_time, test_time),
+                            checkpoint_path)
+
+    if evaluator is not None:
+        evaluator.close()
+    if rank > 0:
+        return None
+
+    OAMean = np.mean(acc)
+    OAStd = np.std(acc)
+
+    AA = np.mean(A, 1)
+    AAMean = np.mean(AA,0)
+    AAStd = np.std(AA)
+
+    kMean = np.mean(k)
+    kStd = np.std(k)
+
+    AMean = np.mean(A, 0)
+    AStd = np.std(A, 0)
+
+    logger.info ("train time per DataSet(s): " + "{:.5f}".format(np.mean(train_time)))
+    logger.info ("test time per DataSet(s): " + "{:.5f}".format(np.mean(test_time)))
+    logger.info ("average OA: " + "{:.2f}".format(OAMean) + " +- " + "{:.2f}".format( OAStd))
+    logger.info ("average AA: " + "{:.2f}".format(100 * AAMean) + " +- " + "{:.2f}".format(100 * AAStd))
+    logger.info ("average kappa: " + "{:.4f}".format(100 *kMean) + " +- " + "{:.4f}".format(100 *kStd))
+    logger.info ("accuracy list: {}".format(acc))
+    logger.info ("early stopping saved {} episodes, about {:.1f}s".format(total_episode_saved, total_time_saved))
+    logger.info ("accuracy for each class: ")
+    for i in range(TAR_CLASS_NUM):
+        logger.info ("Class " + str(i) + ": " + "{:.2f}".format(100 * AMean[i]) + " +- " + "{:.2f}".format(100 * AStd[i]))
+
+    if args.profile_memory:
+        profiling.memory.log(logger)
+        profiling.memory.save(os.path.join(log_dir, experimentSetting, 'memory_profile.tsv'))
+
+    #################classification map################################
+    offset = best_nTrain if train_in_randperm else 0
+    for i in range(len(best_predict_all)):
+        best_G[best_Row[best_RandPerm[offset + i]]][best_Column[best_RandPerm[offset + i]]] = best_predict_all[i] + 1
+
+    hsi_pic = np.zeros((best_G.shape[0], best_G.shape[1], 3))
+    for class_, color in enumerate(config['map_colors']):
+        hsi_pic[best_G == class_ + 1] = color
+
+    halfwidth = patch_size // 2
+    utils.classification_map(hsi_pic[halfwidth:-halfwidth, halfwidth:-halfwidth, :], best_G[halfwidth:-halfwidth, halfwidth:-halfwidth], 24,  os.path.join("classificationMap", config['map_name'].format(TAR_LSAMPLE_NUM_PER_CLASS)))
+
+    return {'experiment': experimentSetting,
+            'OA': OAMean, 'OA_std': OAStd,
+            'AA': 100 * AAMean, 'AA_std': 100 * AAStd,
+            'kappa': 100 * kMean, 'kappa_std': 100 * kStd,
+            'train_time': np.sum(train_time), 'test_time': np.sum(test_time),
+            'history': history}
+
+def train_targets(rank, configs, metatrain_datas, semantic_mappings, args):
+    """
+    train every target config in turn, the entry point of each rank of a data parallel run
+    """
+    if args.world_size > 1:
+        distributed.init(rank, args.world_size, args.dist_port, args.threads)
+        if args.profile_memory:
+            profiling.memory.enable()
+    else:
+        autotune.set_threads(args.threads)
+
+    results = []
+    for config, metatrain_data, semantic_mapping_tar in zip(configs, metatrain_datas, semantic_mappings[1:]):
+        results.append(train_target(config, metatrain_data, semantic_mappings[0], semantic_mapping_tar, args, rank=rank))
+
+    if rank == 0:
+        logger = logging.getLogger('main')
+        for result in results:
+            logger.info('{}: OA {:.2f} +- {:.2f}, AA {:.2f} +- {:.2f}, kappa {:.4f} +- {:.4f}, train time {:.1f}s'.format(
+                result['experiment'], result['OA'], result['OA_std'], result['AA'], result['AA_std'],
+                result['kappa'], result['kappa_std'], result['train_time']))
+    distributed.cleanup()
+    return results
+
+def main(default_config=None):
+    args = get_parser(default_config).parse_args()
+    if args.profile_memory:
+        profiling.memory.enable()
+
+    configs = [imp.load_source("", path).config for path in args.config]
+    if args.source_checkpoint is not None:
+        for config in configs:
+            config['train_config']['source_checkpoint'] = args.source_checkpoint
+
+    utils.same_seeds(0)
+
+    # label semantic vectors of the source and of every target, BERT is loaded once
+    semantic_mappings = encode_labels([labels_src] + [config['labels_tar'] for config in configs])
+
+    # targets sharing a source pickle share the loaded pool
+    sources = {}
+    for config in configs:
+        source_key = (config['data_path'], config['source_data'], config['train_config']['storage_dtype'])
+        if source_key not in sources:
+            sources[source_key] = load_source(*source_key)
+    metatrain_datas = [sources[(config['data_path'], config['source_data'], config['train_config']['storage_dtype'])] for config in configs]
+
+    if args.world_size > 1:
+        mp.spawn(train_targets, args=(configs, metatrain_datas, semantic_mappings, args), nprocs=args.world_size, join=True)
+        return None
+    return train_targets(0, configs, metatrain_datas, semantic_mappings, args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,250 @@
+"""
+machine profile of batch sizes and thread counts. The evaluation, inference and ssl paths are timed on
+this host over a grid of torch intra-op threads and batch sizes, with the model of a config on synthetic
+patches, and the fastest settings are cached per machine in a json profile:
+
+    python -m utils.autotune --config config/Indian_pines.py
+
+train.py, utils.evaluation, utils.inference, serve.py and export_embeddings.py then take the tuned
+values in place of their built-in defaults when no value is given on the command line. The profile is
+machine_profile.json next to this repository, or the file of the HSI_MACHINE_PROFILE environment
+variable (empty to disable it). The ssl batch changes the training itself, it is only taken from the
+profile with train_opt['ssl_batch_size'] = 'auto'.
+"""
+import argparse
+import imp
+import json
+import os
+import platform
+import time
+import numpy as np
+
+import torch
+
+PROFILE_ENV = 'HSI_MACHINE_PROFILE'
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'machine_profile.json')
+
+THREADS = [1, 2, 4, 8, 16, 32]
+EVAL_BATCH_SIZES = [50, 100, 200, 500, 1000]
+INFERENCE_BATCH_SIZES = [128, 256, 512, 1024, 2048]
+CHUNK_SIZES = [1024, 4096, 16384]
+SSL_BATCH_SIZES = [32, 64, 128, 256]
+
+_profile = None
+
+
+def profile_path():
+    return os.environ.get(PROFILE_ENV, DEFAULT_PATH)
+
+def machine_key(device=None):
+    """
+    the profile of a host is keyed by its name, its cores and the device it runs on
+    """
+    device = device or ('cuda' if torch.cuda.is_available() else 'cpu')
+    if device.startswith('cuda'):
+        device = torch.cuda.get_device_name(torch.device(device)).replace(' ', '_')
+    return '{}-{}cpu-{}'.format(platform.node(), os.cpu_count() or 1, device)
+
+def load_profile(path=None, device=None):
+    """
+    :return: tuned settings of this machine, {} when it has not been tuned or the profile is disabled
+    """
+    path = profile_path() if path is None else path
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f).get(machine_key(device), {})
+
+def get(name, default=None):
+    """
+    tuned value of a setting on this machine, `default` when there is none. The profile is read once per process
+    """
+    global _profile
+    if _profile is None:
+        _profile = load_profile()
+    return _profile.get(name, default)
+
+def set_threads(threads=0):
+    """
+    torch intra-op threads: `threads` when > 0, else the tuned value of the machine, else the torch default
+    """
+    threads = threads if threads > 0 else get('threads', 0)
+    if threads > 0:
+        torch.set_num_threads(threads)
+    return torch.get_num_threads()
+
+def save_profile(settings, path=None, device=None):
+    """
+    store the settings of this machine, the profiles of other machines in the file are kept
+    """
+    global _profile
+    path = profile_path() if path is None else path
+    profiles = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            profiles = json.load(f)
+    profiles[machine_key(device)] = settings
+    with open(path, 'w') as f:
+        json.dump(profiles, f, indent=2)
+    _profile = None
+
+def _sync(device):
+    if device.startswith('cuda'):
+        torch.cuda.synchronize(torch.device(device))
+
+def _rate(run, count, device, repeats):
+    """
+    samples per second of the best of `repeats` calls of run(), which processes `count` samples
+    """
+    best = float('inf')
+    for _ in range(repeats):
+        _sync(device)
+        start = time.perf_counter()
+        run()
+        _sync(device)
+        best = min(best, time.perf_counter() - start)
+    return count / best
+
+def bench_inference(mapping_tar, encoder, patches, batch_size, device, repeats):
+    from .inference import extract_features
+    return _rate(lambda: extract_features(mapping_tar, encoder, patches, batch_size, device), len(patches), device, repeats)
+
+def bench_eval(mapping_tar, encoder, support, patches, num_classes, batch_size, device, repeats):
+    """
+    evaluation of train.py: support features, test DataLoader and 1-NN
+    """
+    import contextlib
+    import io
+    from torch.utils.data import DataLoader, TensorDataset
+    from .evaluation import evaluate
+
+    train_loader = DataLoader(TensorDataset(*support), batch_size=len(support[1]), shuffle=False)
+    labels = torch.from_numpy(np.random.randint(num_classes, size=len(patches)))
+    test_loader = DataLoader(TensorDataset(torch.from_numpy(patches), labels), batch_size=batch_size, shuffle=False)
+
+    def run():
+        # evaluate() prints the feature range
+        with contextlib.redirect_stdout(io.StringIO()):
+            evaluate(mapping_tar, encoder, train_loader, test_loader, device, num_classes)
+    return _rate(run, len(patches), device, repeats)
+
+def bench_chunks(mapping_tar, encoder, scene, batch_size, chunk_size, device, repeats):
+    """
+    dense inference of the whole image as embedding_store.export runs it, patches cut chunk by chunk
+    """
+    from .inference import extract_features
+    height, width = scene.shape
+    rows, columns = [index.ravel() for index in np.mgrid[:height, :width]]
+
+    def run():
+        for start in range(0, len(rows), chunk_size):
+            extract_features(mapping_tar, encoder, scene.cut(rows[start:start + chunk_size], columns[start:start + chunk_size]), batch_size, device)
+    return _rate(run, len(rows), device, repeats)
+
+def bench_ssl(mapping_tar, encoder, patches, batch_size, mask_ratio, device, repeats):
+    """
+    ssl step of train.py: two masked views of a batch, forward, SupCon loss and backward
+    """
+    from . import data_augment, loss_function
+    supcon = loss_function.SupConLoss().to(device)
+    data = torch.from_numpy(patches)
+    labels = torch.from_numpy(np.random.randint(16, size=len(patches)))
+    count = len(patches) // batch_size * batch_size
+
+    def run():
+        for start in range(0, count, batch_size):
+            batch = data[start:start + batch_size]
+            views = torch.cat([torch.FloatTensor(data_augment.random_mask_batch_image(batch, mask_ratio)) for _ in range(2)])
+            features = torch.nn.functional.normalize(encoder(mapping_tar(views.to(device))), dim=1)
+            loss = supcon(torch.stack([features[:batch_size], features[batch_size:]], 1), labels[start:start + batch_size].to(device), device=device)
+            mapping_tar.zero_grad()
+            encoder.zero_grad()
+            loss.backward()
+    mapping_tar.train()
+    encoder.train()
+    rate = _rate(run, count, device, repeats)
+    mapping_tar.eval()
+    encoder.eval()
+    return rate
+
+def _best(rates):
+    return max(rates, key=rates.get)
+
+def _table(name, rates, unit):
+    print('{:>22s} {}'.format(name, '  '.join('{}: {:.1f}'.format(k, v) for k, v in rates.items())) + ' ' + unit)
+
+def tune(train_opt, device='cpu', samples=2048, repeats=2, threads=None):
+    """
+    time the paths over the grids, threads first (on inference with the default batch) and the batch sizes
+    with the fastest thread count
+    :param samples: synthetic patches of every measurement
+    :return: settings of the profile, with the measured rates under 'measurements'
+    """
+    from .inference import build_models
+    from .dataloader import TargetScene
+
+    mapping_tar, encoder = build_models(train_opt)
+    mapping_tar.to(device).eval()
+    encoder.to(device).eval()
+    rng = np.random.RandomState(0)
+    patch_size = train_opt['patch_size']
+    patches = rng.rand(samples, train_opt['tar_input_dim'], patch_size, patch_size).astype(np.float32)
+    shots = train_opt['tar_class_num'] * train_opt['tar_lsample_num_per_class']
+    support = (torch.from_numpy(patches[:shots]), torch.arange(shots) % train_opt['tar_class_num'])
+    side = int(np.sqrt(samples))
+    scene = TargetScene(rng.rand(side, side, train_opt['tar_input_dim']).astype(np.float32),
+                        rng.randint(1, train_opt['tar_class_num'] + 1, size=(side, side)), patch_size // 2, gather_patches=False)
+    # warm up the kernels and the allocator
+    bench_inference(mapping_tar, encoder, patches[:64], 64, device, 1)
+
+    measurements = {}
+    if threads is None:
+        cores = os.cpu_count() or 1
+        threads = sorted(set([t for t in THREADS if t < cores] + [cores]))
+    rates = {}
+    for t in threads:
+        torch.set_num_threads(t)
+        rates[t] = bench_inference(mapping_tar, encoder, patches, 1024, device, repeats)
+    best_threads = _best(rates)
+    measurements['threads'] = rates
+    _table('threads', rates, 'pixels/s')
+    torch.set_num_threads(best_threads)
+
+    measurements['eval_batch_size'] = {b: bench_eval(mapping_tar, encoder, support, patches, train_opt['tar_class_num'], b, device, repeats)
+                                       for b in EVAL_BATCH_SIZES if b <= samples}
+    _table('eval batch size', measurements['eval_batch_size'], 'pixels/s')
+    measurements['inference_batch_size'] = {b: bench_inference(mapping_tar, encoder, patches, b, device, repeats)
+                                            for b in INFERENCE_BATCH_SIZES if b <= samples}
+    _table('inference batch size', measurements['inference_batch_size'], 'pixels/s')
+    inference_batch_size = _best(measurements['inference_batch_size'])
+    measurements['chunk_size'] = {c: bench_chunks(mapping_tar, encoder, scene, inference_batch_size, c, device, repeats)
+                                  for c in CHUNK_SIZES if c <= side * side or c == CHUNK_SIZES[0]}
+    _table('chunk size', measurements['chunk_size'], 'pixels/s')
+    measurements['ssl_batch_size'] = {b: bench_ssl(mapping_tar, encoder, patches, b, train_opt['mask_ratio'], device, repeats)
+                                      for b in SSL_BATCH_SIZES if b <= samples}
+    _table('ssl batch size', measurements['ssl_batch_size'], 'samples/s')
+
+    settings = {name: _best(rates) for name, rates in measurements.items()}
+    settings.update(torch=torch.__version__, samples=samples, created=time.strftime('%Y-%m-%d %H:%M:%S'),
+                    measurements={name: {str(k): v for k, v in rates.items()} for name, rates in measurements.items()})
+    return settings
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune batch sizes and thread counts of this machine")
+    parser.add_argument('--config', type=str, default=os.path.join('./config', 'Indian_pines.py'), help='config of the model that is timed')
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    parser.add_argument('--samples', type=int, default=2048, help='synthetic patches of every measurement')
+    parser.add_argument('--repeats', type=int, default=2)
+    parser.add_argument('--threads', type=int, nargs='+', default=None, help='thread counts to try, by default powers of two up to the cores')
+    parser.add_argument('--output', type=str, default=None, help='profile file, by default {} or {}'.format(PROFILE_ENV, DEFAULT_PATH))
+    args = parser.parse_args()
+
+    train_opt = imp.load_source("", args.config).config['train_config']
+    settings = tune(train_opt, args.device, args.samples, args.repeats, args.threads)
+    path = args.output or profile_path() or DEFAULT_PATH
+    save_profile(settings, path, args.device)
+    print('{}: {}'.format(machine_key(args.device), {name: value for name, value in settings.items() if name != 'measurements'}))
+    print('saved to {}'.format(path))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,116 @@
+import os
+import random
+import numpy as np
+import torch
+
+
+def save(state, path):
+    """
+    write a checkpoint atomically: the file is first written next to its final location
+    and then renamed, so a preempted job never leaves a half written checkpoint behind.
+    """
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    tmp_path = path + '.tmp'
+    torch.save(state, tmp_path)
+    os.replace(tmp_path, path)
+
+def load(path, device='cpu'):
+    if not os.path.exists(path):
+        return None
+    try:
+        return torch.load(path, map_location=device, weights_only=False)
+    except TypeError:  # torch < 1.13 has no weights_only
+        return torch.load(path, map_location=device)
+
+def get_rng_state():
+    state = {'torch': torch.get_rng_state(),
+             'numpy': np.random.get_state(),
+             'random': random.getstate()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+def set_rng_state(state):
+    torch.set_rng_state(state['torch'])
+    np.random.set_state(state['numpy'])
+    random.setstate(state['random'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+class ResumableIterator(object):
+    """
+    cycles over a shuffled DataLoader forever and remembers where it is in the current
+    pass: the generator state the pass was started from and the number of batches drawn.
+    The DataLoader has to be built with `generator=generator`.
+    """
+    def __init__(self, loader, generator):
+        self.loader = loader
+        self.generator = generator
+        self.epoch_state = None
+        self.consumed = 0
+        self._iter = None
+
+    def _start(self):
+        self.epoch_state = self.generator.get_state()
+        self.consumed = 0
+        self._iter = iter(self.loader)
+
+    def next(self):
+        if self._iter is None:
+            self._start()
+        try:
+            batch = next(self._iter)
+        except StopIteration:
+            self._start()
+            batch = next(self._iter)
+        self.consumed += 1
+        return batch
+
+    def state_dict(self):
+        return {'epoch_state': self.epoch_state, 'consumed': self.consumed}
+
+    def load_state_dict(self, state):
+        if state['epoch_state'] is None:
+            return
+        # replay the current pass up to the saved position, the batches themselves are dropped
+        self.generator.set_state(state['epoch_state'])
+        self._start()
+        for _ in range(state['consumed']):
+            next(self._iter)
+        self.consumed = state['consumed']
+
+def seed_state(iDataSet, episode, modules, ssl_iter, counters):
+    """
+    :param iDataSet: index of the seed being trained
+    :param episode: first episode that still has to run
+    :param modules: name -> nn.Module or optimizer
+    :param ssl_iter: ResumableIterator over the target ssl dataloader
+    :param counters: the scalars of the training loop (best accuracy, hit counts, ...)
+    """
+    return {'iDataSet': iDataSet,
+            'episode': episode,
+            'modules': {name: module.state_dict() for name, module in modules.items()},
+            'ssl_iter': ssl_iter.state_dict(),
+            'rng': get_rng_state(),
+            'counters': counters}
+
+def restore_seed_state(state, modules, ssl_iter):
+    for name, module in modules.items():
+        module.load_state_dict(state['modules'][name])
+    ssl_iter.load_state_dict(state['ssl_iter'])
+    # restore the global streams last, replaying the ssl pass consumes numpy draws
+    set_rng_state(state['rng'])
+    return state['episode'], state['counters']
+
+def run_state(acc, A, k, finished, best_predict_all, best_map, train_time, test_time, seed=None):
+    return {'acc': acc,
+            'A': A,
+            'k': k,
+            'finished': list(finished),
+            'best_predict_all': best_predict_all,
+            'best_map': best_map,
+            'train_time': train_time,
+            'test_time': test_time,
+            'seed': seed}
@@ -1,8 +1,14 @@
+"""
+builds the source patch pickle from the raw Chikusei scene, from the repository root:
+
+    python -m utils.chikusei_imdb_128
+"""
+import os
 import numpy as np
 import pickle
 import hdf5storage
-from  sklearn import preprocessing
-import scipy.io as sio
+
+from utils import scene_reader
 
 
 def zeroPadding_3D(old_matrix, pad_length, pad_depth = 0):
@@ -38,98 +44,59 @@ def sampling(groundTruth):
     return whole_indices
 
 
-def load_data_HDF(image_file, label_file):
-    image_data = hdf5storage.loadmat(image_file)
+def load_labels_HDF(label_file):
     label_data = hdf5storage.loadmat(label_file)
-    data_all = image_data['chikusei']  # data_all:ndarray(2517,2335,128)
     label = label_data['GT'][0][0][0]  # label:(2517,2335)
+    return label.reshape(np.prod(label.shape[:2]), )
 
-    [nRow, nColumn, nBand] = data_all.shape
-    print('chikusei', nRow, nColumn, nBand)
-    gt = label.reshape(np.prod(label.shape[:2]), )
-    del image_data
-    del label_data
-    del label
-
-    data_all = data_all.reshape(np.prod(data_all.shape[:2]), np.prod(data_all.shape[2:]))  # (111104,204)
-    print(data_all.shape)
-    data_scaler = preprocessing.scale(data_all)
-    data_scaler = data_scaler.reshape(2517,2335,128)
-
-    return data_scaler, gt
-
-def load_data(image_file, label_file):
-    image_data = sio.loadmat(image_file)
-    label_data = sio.loadmat(label_file)
-    data_key = image_file.split('/')[-1].split('.')[0]
-    label_key = label_file.split('/')[-1].split('.')[0]
-    data_all = image_data[data_key]
-    label = label_data[label_key]
-    gt = label.reshape(np.prod(label.shape[:2]), )
-
-    data = data_all.reshape(np.prod(data_all.shape[:2]), np.prod(data_all.shape[2:]))  # (111104,204)
-    print(data.shape)
-    data_scaler = preprocessing.scale(data)
-    data_scaler = data_scaler.reshape(data_all.shape[0], data_all.shape[1], data_all.shape[2])
-
-    return data_scaler, gt
+def load_labels(label_file):
+    label = scene_reader.read_all(label_file)
+    return label.reshape(np.prod(label.shape[:2]), )
 
 def getDataAndLabels(trainfn1, trainfn2, patch_length):
+    """
+    patches of all labeled pixels. The image is read through utils.scene_reader in row blocks,
+    once for the per band statistics and once for the patches, instead of loading the whole cube
+    """
     if ('Chikusei' in trainfn1 and 'Chikusei' in trainfn2):
-        Data_Band_Scaler, gt = load_data_HDF(trainfn1, trainfn2)
+        reader = scene_reader.open_scene(trainfn1, 'chikusei')  # v7.3, (2517,2335,128)
+        gt = load_labels_HDF(trainfn2)
     else:
-        Data_Band_Scaler, gt = load_data(trainfn1, trainfn2)
-
-    del trainfn1, trainfn2
-    [nRow, nColumn, nBand] = Data_Band_Scaler.shape
+        reader = scene_reader.open_scene(trainfn1)
+        gt = load_labels(trainfn2)
 
-    # patch_length = 4 # neighbor 9 x 9
-    whole_data = Data_Band_Scaler
-    padded_data = zeroPadding_3D(whole_data, patch_length)
-    del Data_Band_Scaler
+    [nRow, nColumn, nBand] = reader.shape
+    print(os.path.basename(trainfn1), nRow, nColumn, nBand)
+    stats = scene_reader.band_stats(reader)
 
     np.random.seed(1334)
 
-    whole_indices = sampling(gt)
+    whole_indices = np.asarray(sampling(gt), dtype=np.int64)
     print('the whole indices', len(whole_indices))  # 520
 
     nSample = len(whole_indices)
-    x = np.zeros((nSample, 2 * patch_length + 1, 2 * patch_length + 1, nBand))
     y = gt[whole_indices] - 1  # label 1-19->0-18
 
-    whole_assign = indexToAssignment(whole_indices, whole_data.shape[0], whole_data.shape[1], patch_length)
-    print('indexToAssignment is ok')
-    for i in range(len(whole_assign)):
-        x[i] = selectNeighboringPatch(padded_data, whole_assign[i][0], whole_assign[i][1],
-                                      patch_length)
-    print('selectNeighboringPatch is ok')
-
+    # (nSample, 2 * patch_length + 1, 2 * patch_length + 1, nBand), zero outside of the image
+    x = scene_reader.cut_patches(reader, whole_indices // nColumn, whole_indices % nColumn, patch_length, stats=stats)
+    reader.close()
+    print('cut_patches is ok')
     print(x.shape)
-    del whole_assign
-    del whole_data
-    del padded_data
 
     imdb = {}
-    imdb['data'] = np.zeros([nSample, 2 * patch_length + 1, 2 * patch_length + 1, nBand], dtype=np.float32)  # <class 'tuple'>: (9, 9, 100, 77592)
-    imdb['Labels'] = np.zeros([nSample], dtype=np.int64)  # <class 'tuple'>: (77592,)
-    imdb['set'] = np.zeros([nSample], dtype=np.int64)
-
-    for iSample in range(nSample):
-        imdb['data'][iSample, :, :, :, ] = x[iSample, :, :, :]  # (9, 9, 100, 77592)
-        imdb['Labels'][iSample] = y[iSample]  # (77592, )
-        if iSample % 100 == 0:
-            print('iSample', iSample)
-
+    imdb['data'] = x  # (77592, 7, 7, 128) float32
+    imdb['Labels'] = y.astype(np.int64)  # (77592,)
     imdb['set'] = np.ones([nSample]).astype(np.int64)
     print('Data is OK.')
 
     return imdb
 
-train_data_file = '../datasets/Chikusei_raw_mat/HyperspecVNIR_Chikusei_20140729.mat'
-train_label_file = '../datasets/Chikusei_raw_mat/HyperspecVNIR_Chikusei_20140729_Ground_Truth.mat'
+datasets = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'datasets')
+train_data_file = os.path.join(datasets, 'Chikusei_raw_mat/HyperspecVNIR_Chikusei_20140729.mat')
+train_label_file = os.path.join(datasets, 'Chikusei_raw_mat/HyperspecVNIR_Chikusei_20140729_Ground_Truth.mat')
 
 imdb = getDataAndLabels(train_data_file, train_label_file, patch_length=3) # 7*7
-with open('../datasets/Chikusei_imdb_128_7_7_test.pickle', 'wb') as handle:
+with open(os.path.join(datasets, 'Chikusei_imdb_128_7_7_test.pickle'), 'wb') as handle:
     pickle.dump(imdb, handle, protocol=4)
 
 print('Images preprocessed')
\ No newline at end of file
@@ -1,5 +1,7 @@
+import os
 import numpy as np
 import random
+from collections.abc import Sequence
 import torch
 from torch.utils.data import DataLoader, Dataset
 from torch.utils.data.sampler import Sampler
@@ -25,9 +27,12 @@ class Task(object):
         self.support_real_labels = []
         self.query_real_labels = []
         for c in class_list:
-            temp = self.data[c]  # list
-            samples[c] = random.sample(temp, len(temp))
-            random.shuffle(samples[c])
+            temp = self.data[c]  # list or NoisyPatchPool
+            # sample positions rather than items so that lazily augmented pools only
+            # materialise the support/query patches (same random stream as before)
+            order = random.sample(range(len(temp)), len(temp))
+            random.shuffle(order)
+            samples[c] = [temp[i] for i in order[:shot_num + query_num]]
 
             self.support_datas += samples[c][:shot_num]
             self.query_datas += samples[c][shot_num:shot_num + query_num]
@@ -56,7 +61,7 @@ class HBKC_dataset(FewShotDataset):
         super(HBKC_dataset, self).__init__(*args, **kwargs)
 
     def __getitem__(self, idx):
-        image = self.image_datas[idx]
+        image = storage.upcast(self.image_datas[idx])
         label = self.labels[idx]
         return image, label
 
@@ -100,133 +105,203 @@ class MetaTrainLabeledDataset(Dataset):
         return len(self.image_datas)
 
     def __getitem__(self, idx):
-        image = self.image_datas[idx]
+        image = storage.upcast(self.image_datas[idx])
         label = self.image_labels[idx]
         return image, label
 
 
 
-from . import utils, data_augment
+from . import utils, data_augment, profiling, storage, autotune, scene_reader
 import math
 
-def get_train_test_loader(Data_Band_Scaler, GroundTruth, class_num, tar_lsample_num_per_class, shot_num_per_class, HalfWidth):
+class TargetScene(object):
+    """
+    seed independent part of the target preparation, done once per scene: the zero padded cube,
+    the coordinates of the labeled pixels, their per-class index lists and the patches of all of them.
+    The splits of the seeds are then only index permutations into these arrays.
+    :param padded: zero padded cube of another mask of the same image, shared instead of padded again
+    :param gather_patches: extract the patches of all labeled pixels up front, otherwise they are
+                           cut from the padded cube when read (for masks of which only a few pixels are used)
+    :param storage_dtype: dtype the padded cube and the patches are kept in (see utils.storage),
+                          get_patches always returns float32
+    """
+    def __init__(self, Data_Band_Scaler, GroundTruth, HalfWidth, padded=None, gather_patches=True, chunk_size=4096, storage_dtype='float32'):
+        self.HalfWidth = HalfWidth
+
+        # same as the center of utils.flip cropped to HalfWidth, without building the 3x3 tiled cube
+        with profiling.memory.stage('pad'):
+            if padded is None:
+                print(Data_Band_Scaler.shape)
+                padded = np.pad(storage.to_storage(Data_Band_Scaler, storage_dtype), ((HalfWidth, HalfWidth), (HalfWidth, HalfWidth), (0, 0)), 'constant')
+            self.data = padded
+            self.G = np.pad(GroundTruth, HalfWidth, 'constant')
+        self.windows = np.lib.stride_tricks.sliding_window_view(self.data, (2 * HalfWidth + 1, 2 * HalfWidth + 1), axis=(0, 1))
+
+        [self.Row, self.Column] = np.nonzero(self.G)
+        self.labels = self.G[self.Row, self.Column].astype(np.int64) - 1
+        print('number of sample', np.size(self.Row))
+
+        # indices of the labeled pixels of each class, in scan order
+        self.class_indices = [np.flatnonzero(self.labels == i).tolist() for i in range(int(np.max(self.G)))]
+
+        # (nSample, nBand, 2 * HalfWidth + 1, 2 * HalfWidth + 1)
+        self.patches = None
+        if gather_patches:
+            profiling.memory.start('scene_patches')
+            patches = np.empty([np.size(self.Row)] + list(self.windows.shape[2:]), dtype=self.data.dtype)
+            for i in range(0, np.size(self.Row), chunk_size):
+                patches[i:i + chunk_size] = self.windows[self.Row[i:i + chunk_size] - HalfWidth, self.Column[i:i + chunk_size] - HalfWidth]
+            self.patches = patches
+            profiling.memory.stop()
+
+    def __getstate__(self):
+        # the strided window view would be pickled as a dense copy (2 HalfWidth + 1)^2 times the cube
+        state = dict(self.__dict__)
+        del state['windows']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.windows = np.lib.stride_tricks.sliding_window_view(self.data, (2 * self.HalfWidth + 1, 2 * self.HalfWidth + 1), axis=(0, 1))
+
+    def get_patches(self, index):
+        """
+        float32 (nBand, H, W) patch of sample `index`, or (len(index), nBand, H, W) for an array of samples
+        """
+        if self.patches is not None:
+            return storage.upcast(self.patches[index])
+        return storage.upcast(np.array(self.windows[self.Row[index] - self.HalfWidth, self.Column[index] - self.HalfWidth]))
+
+    @property
+    def shape(self):
+        """
+        (height, width) of the image
+        """
+        return self.G.shape[0] - 2 * self.HalfWidth, self.G.shape[1] - 2 * self.HalfWidth
+
+    def cut(self, rows, columns):
+        """
+        float32 patches centered on any pixels of the image, labeled or not
+        :param rows, columns: image coordinates (without the padding)
+        """
+        return storage.upcast(np.array(self.windows[rows, columns]))
+
+class IndexedPatchDataset(Dataset):
+    """
+    samples `index` of a TargetScene, the patches are gathered when read instead of copied per split
+    """
+    def __init__(self, scene, index):
+        self.scene = scene
+        self.index = index
 
-    print(Data_Band_Scaler.shape)
-    [nRow, nColumn, nBand] = Data_Band_Scaler.shape
+    def __len__(self):
+        return len(self.index)
 
-    '''label start'''
-    num_class = int(np.max(GroundTruth))
-    data_band_scaler = utils.flip(Data_Band_Scaler)
-    groundtruth = utils.flip(GroundTruth)
+    def __getitem__(self, idx):
+        i = self.index[idx]
+        return self.scene.get_patches(i), self.scene.labels[i]
+
+def get_train_test_loader(Data_Band_Scaler, GroundTruth, class_num, tar_lsample_num_per_class, shot_num_per_class, HalfWidth, scene=None,
+                          splits=('train', 'test')):
+    """
+    per seed split of the labeled pixels in shot_num_per_class train samples per class and test samples
+    :param scene: TargetScene of the data, built from Data_Band_Scaler/GroundTruth when not given
+    :param splits: loaders to build, the loader of a split that is not asked for is None.
+                   Both splits are always drawn so that the random stream does not depend on it
+    """
+    if scene is None:
+        scene = TargetScene(Data_Band_Scaler, GroundTruth, HalfWidth)
     del Data_Band_Scaler
     del GroundTruth
 
-    G = groundtruth[nRow - HalfWidth:2 * nRow + HalfWidth, nColumn - HalfWidth:2 * nColumn + HalfWidth]
-    data = data_band_scaler[nRow - HalfWidth:2 * nRow + HalfWidth, nColumn - HalfWidth:2 * nColumn + HalfWidth, :]
-
-    [Row, Column] = np.nonzero(G)
-    del data_band_scaler
-    del groundtruth
-
-    nSample = np.size(Row)
-    print('number of sample', nSample)
-
     # Sampling samples
     train = {}
     test = {}
-    da_train = {}  # Data Augmentation
-    m = int(np.max(G))
+    m = len(scene.class_indices)
     nlabeled = tar_lsample_num_per_class
+    da_repeat = math.ceil((200 - nlabeled) / nlabeled) + 1
     print('labeled number per class:', nlabeled)
     print((200 - nlabeled) / nlabeled + 1)
-    print(math.ceil((200 - nlabeled) / nlabeled) + 1)
+    print(da_repeat)
 
     for i in range(m):
-        indices = [j for j, x in enumerate(Row.ravel().tolist()) if G[Row[j], Column[j]] == i + 1]
+        indices = list(scene.class_indices[i])
         np.random.shuffle(indices)
         nb_val = shot_num_per_class
         train[i] = indices[:nb_val]
-        da_train[i] = []
-        for j in range(math.ceil((200 - nlabeled) / nlabeled) + 1):
-            da_train[i] += indices[:nb_val]
         test[i] = indices[nb_val:]
 
     train_indices = []
     test_indices = []
-    da_train_indices = []
     for i in range(m):
         train_indices += train[i]
         test_indices += test[i]
-        da_train_indices += da_train[i]
     np.random.shuffle(test_indices)
 
     print('the number of train_indices:', len(train_indices))
     print('the number of test_indices:', len(test_indices))
-    print('the number of train_indices after data argumentation:', len(da_train_indices))  # 520
+    print('the number of train_indices after data argumentation:', len(train_indices) * da_repeat)  # 520
     print('labeled sample indices:', train_indices)
 
     nTrain = len(train_indices)
-    nTest = len(test_indices)
-    da_nTrain = len(da_train_indices)
-
-    imdb = {}
-    imdb['data'] = np.zeros([2 * HalfWidth + 1, 2 * HalfWidth + 1, nBand, nTrain + nTest],
-                            dtype=np.float32)
-    imdb['Labels'] = np.zeros([nTrain + nTest], dtype=np.int64)
-    imdb['set'] = np.zeros([nTrain + nTest], dtype=np.int64)
 
     RandPerm = train_indices + test_indices
 
     RandPerm = np.array(RandPerm)
+    print('Data is OK.')
 
-    for iSample in range(nTrain + nTest):
-        imdb['data'][:, :, :, iSample] = data[
-                                         Row[RandPerm[iSample]] - HalfWidth : Row[RandPerm[iSample]] + HalfWidth + 1,
-                                         Column[RandPerm[iSample]] - HalfWidth : Column[RandPerm[iSample]] + HalfWidth + 1,
-                                         :]
-        imdb['Labels'][iSample] = G[Row[RandPerm[iSample]], Column[RandPerm[iSample]]].astype(np.int64)
+    # Data Augmentation for target domain for training: only the labeled patches are kept,
+    # the radiation noise is drawn every time a patch is read (see NoisyPatchPool)
+    imdb_da_train = {}
+    imdb_da_train['data'] = scene.get_patches(RandPerm[:nTrain])  # (nTrain, nBand, 7, 7)
+    imdb_da_train['Labels'] = scene.labels[RandPerm[:nTrain]]
+    imdb_da_train['repeat'] = da_repeat
+
+    train_loader, test_loader = None, None
+    if 'train' in splits:
+        train_dataset = IndexedPatchDataset(scene, RandPerm[:nTrain])
+        train_loader = torch.utils.data.DataLoader(train_dataset, batch_size=class_num * shot_num_per_class, shuffle=False)
+        del train_dataset
+
+    if 'test' in splits:
+        test_dataset = IndexedPatchDataset(scene, RandPerm[nTrain:])
+        test_loader = torch.utils.data.DataLoader(test_dataset, batch_size=autotune.get('eval_batch_size', 100), shuffle=False)
+        del test_dataset
+    print('ok')
 
-    imdb['Labels'] = imdb['Labels'] - 1
-    imdb['set'] = np.hstack((np.ones([nTrain]), 3 * np.ones([nTest]))).astype(np.int64)
-    print('Data is OK.')
+    # G is copied because the classification map is drawn into it
+    return train_loader, test_loader, imdb_da_train, scene.G.copy(), RandPerm, scene.Row, scene.Column, nTrain
 
-    train_dataset = utils.matcifar(imdb, train=True, d=3, medicinal=0)
-    train_loader = torch.utils.data.DataLoader(train_dataset, batch_size=class_num * shot_num_per_class, shuffle=False)
-    del train_dataset
 
-    test_dataset = utils.matcifar(imdb, train=False, d=3, medicinal=0)
-    test_loader = torch.utils.data.DataLoader(test_dataset, batch_size=100, shuffle=False)
-    del test_dataset
-    del imdb
+def get_target_pools(imdb_da_train):
+    """
+    split the labeled target patches into per-class NoisyPatchPool for the few-shot tasks
+    and one NoisyPatchPool over all classes for the supervised contrastive branch.
+    Each class is repeated imdb_da_train['repeat'] times, as the replicated set used to be.
+    """
+    patches = imdb_da_train['data']  # (nTrain, nBand, 7, 7), class-major
+    labels = imdb_da_train['Labels']
+    repeat = imdb_da_train['repeat']
 
-    # Data Augmentation for target domain for training
-    imdb_da_train = {}
-    imdb_da_train['data'] = np.zeros([2 * HalfWidth + 1, 2 * HalfWidth + 1, nBand, da_nTrain],
-                                     dtype=np.float32)
-    imdb_da_train['Labels'] = np.zeros([da_nTrain], dtype=np.int64)
-    imdb_da_train['set'] = np.zeros([da_nTrain], dtype=np.int64)
-
-    da_RandPerm = np.array(da_train_indices)
-    for iSample in range(da_nTrain):
-        imdb_da_train['data'][:, :, :, iSample] = data_augment.radiation_noise(
-            data[Row[da_RandPerm[iSample]] - HalfWidth: Row[da_RandPerm[iSample]] + HalfWidth + 1,
-            Column[da_RandPerm[iSample]] - HalfWidth: Column[da_RandPerm[iSample]] + HalfWidth + 1, :])
-        imdb_da_train['Labels'][iSample] = G[Row[da_RandPerm[iSample]], Column[da_RandPerm[iSample]]].astype(np.int64)
-    imdb_da_train['Labels'] = imdb_da_train['Labels'] - 1
-    imdb_da_train['set'] = np.ones([da_nTrain]).astype(np.int64)
-    print('ok')
+    target_da_train_set = {}
+    for class_ in np.unique(labels):
+        index = np.flatnonzero(labels == class_)
+        target_da_train_set[class_] = NoisyPatchPool(patches[index[0]:index[-1] + 1], repeat)
 
-    return train_loader, test_loader, imdb_da_train, G, RandPerm, Row, Column, nTrain
+    target_aug_data_ssl = NoisyPatchPool(patches, repeat)
+    target_aug_label_ssl = np.tile(labels, repeat)
+    return target_da_train_set, target_aug_data_ssl, target_aug_label_ssl
 
 
-def get_target_dataset(Data_Band_Scaler, GroundTruth, class_num, tar_lsample_num_per_class, shot_num_per_class, patch_size):
+def get_target_dataset(Data_Band_Scaler, GroundTruth, class_num, tar_lsample_num_per_class, shot_num_per_class, patch_size, scene=None):
     train_loader, test_loader, imdb_da_train, G, RandPerm, Row, Column, nTrain = get_train_test_loader(
         Data_Band_Scaler=Data_Band_Scaler,
         GroundTruth=GroundTruth,
         class_num=class_num,
         tar_lsample_num_per_class=tar_lsample_num_per_class,
         shot_num_per_class=shot_num_per_class,
-        HalfWidth=patch_size // 2)
+        HalfWidth=patch_size // 2,
+        scene=scene)
     train_datas, train_labels = train_loader.__iter__().next()
     print('train labels:', train_labels)
     print('size of train datas:', train_datas.shape)
@@ -237,40 +312,33 @@ def get_target_dataset(Data_Band_Scaler, GroundTruth, class_num, tar_lsample_num
     del Data_Band_Scaler, GroundTruth
 
     # target data with data augmentation
-    target_da_datas = np.transpose(imdb_da_train['data'], (3, 2, 0, 1))  # 换坐标轴 (9,9,103, 1800)->(1800, 103, 9, 9)
-    print(target_da_datas.shape)
-    target_da_labels = imdb_da_train['Labels']
-    print('target data augmentation label:', target_da_labels)
-
-    target_da_train_set = {}
-    target_aug_data_ssl = []
-    target_aug_label_ssl = []
-
-    for class_, path in zip(target_da_labels, target_da_datas):
-        if class_ not in target_da_train_set:
-            target_da_train_set[class_] = []
-        target_da_train_set[class_].append(path)
-        target_aug_data_ssl.append(path)
-        target_aug_label_ssl.append(class_)
-    target_da_metatrain_data = target_da_train_set
+    target_da_metatrain_data, target_aug_data_ssl, target_aug_label_ssl = get_target_pools(imdb_da_train)
+    print('target data augmentation size:', len(target_aug_data_ssl))
     print(target_da_metatrain_data.keys())
 
     return train_loader, test_loader, target_da_metatrain_data, G, RandPerm, Row, Column, nTrain, target_aug_data_ssl, target_aug_label_ssl
 
-def get_target_dataset_houston(Data_Band_Scaler, GroundTruth_train, GroundTruth_test, class_num, tar_lsample_num_per_class, shot_num_per_class, patch_size):
+def get_target_dataset_houston(Data_Band_Scaler, GroundTruth_train, GroundTruth_test, class_num, tar_lsample_num_per_class, shot_num_per_class, patch_size,
+                               scene_train=None, scene_test=None):
+    if scene_train is None or scene_test is None:
+        scene_test, scene_train = get_split_mask_scenes(Data_Band_Scaler, GroundTruth_train, GroundTruth_test, patch_size // 2)
+    # only the labeled train split is used, the test samples come from the test mask
     train_loader, _, imdb_da_train, _, _, _, _, _ = get_train_test_loader(
         Data_Band_Scaler=Data_Band_Scaler,
         GroundTruth=GroundTruth_train,
         class_num=class_num,
         tar_lsample_num_per_class=tar_lsample_num_per_class,
         shot_num_per_class=shot_num_per_class,
-        HalfWidth=patch_size // 2)
+        HalfWidth=patch_size // 2,
+        scene=scene_train,
+        splits=('train',))
     test_loader, G, RandPerm, Row, Column, nTrain = get_alltest_loader(
         Data_Band_Scaler=Data_Band_Scaler,
         GroundTruth=GroundTruth_test,
         class_num=class_num,
         shot_num_per_class=0,
-        HalfWidth=patch_size // 2)
+        HalfWidth=patch_size // 2,
+        scene=scene_test)
 
 
     train_datas, train_labels = train_loader.__iter__().next()
@@ -282,58 +350,40 @@ def get_target_dataset_houston(Data_Band_Scaler, GroundTruth_train, GroundTruth_
     print(imdb_da_train['Labels'])
     del Data_Band_Scaler, GroundTruth_train, GroundTruth_test
 
-    # target data with data augmentation
-    target_da_datas = np.transpose(imdb_da_train['data'], (3, 2, 0, 1))  # 换坐标轴 (9,9,103, 1800)->(1800, 103, 9, 9)
-    print(target_da_datas.shape)
-    target_da_labels = imdb_da_train['Labels']
-    print('target data augmentation label:', target_da_labels)
-
     # metatrain data for few-shot classification 和之前的区别就是，把多维数组按类别划分为字典。
-    target_da_train_set = {}
-    target_aug_data_ssl = []
-    target_aug_label_ssl = []
-
-    for class_, path in zip(target_da_labels, target_da_datas):
-        if class_ not in target_da_train_set:
-            target_da_train_set[class_] = []
-        target_da_train_set[class_].append(path)
-        target_aug_data_ssl.append(path)
-        target_aug_label_ssl.append(class_)
-    target_da_metatrain_data = target_da_train_set
+    target_da_metatrain_data, target_aug_data_ssl, target_aug_label_ssl = get_target_pools(imdb_da_train)
+    print('target data augmentation size:', len(target_aug_data_ssl))
     print(target_da_metatrain_data.keys())
 
     return train_loader, test_loader, target_da_metatrain_data, G, RandPerm, Row, Column, nTrain, target_aug_data_ssl, target_aug_label_ssl
 
 
-def get_alltest_loader(Data_Band_Scaler, GroundTruth, class_num, shot_num_per_class, HalfWidth):
-
-    print(Data_Band_Scaler.shape)
-    [nRow, nColumn, nBand] = Data_Band_Scaler.shape
-
-    '''label start'''
-    num_class = int(np.max(GroundTruth))
-    data_band_scaler = utils.flip(Data_Band_Scaler)
-    groundtruth = utils.flip(GroundTruth)
-
-    G = groundtruth[nRow - HalfWidth:2 * nRow + HalfWidth,
-        nColumn - HalfWidth:2 * nColumn + HalfWidth]
-    data = data_band_scaler[nRow - HalfWidth:2 * nRow + HalfWidth, nColumn - HalfWidth:2 * nColumn + HalfWidth,
-           :]
-
-    [Row, Column] = np.nonzero(G)
-    del data_band_scaler
-    del groundtruth
-
-    nSample = np.size(Row)
-    max_Row = np.max(Row)
-    print('number of sample', nSample)
+def get_split_mask_scenes(Data_Band_Scaler, GroundTruth_train, GroundTruth_test, HalfWidth, storage_dtype='float32', padded=None, gather_patches=True):
+    """
+    scenes of separate train and test masks of one image, padded once. Every test pixel is read,
+    only a few train pixels per seed, so the train patches are cut when read.
+    :param padded: zero padded cube of the image (utils.scene_reader.padded_scene), instead of Data_Band_Scaler
+    :param gather_patches: gather the test patches up front (TargetScene), False for a memory-mapped cube
+    :return: scene_test, scene_train
+    """
+    scene_test = TargetScene(Data_Band_Scaler, GroundTruth_test, HalfWidth, padded=padded, gather_patches=gather_patches, storage_dtype=storage_dtype)
+    scene_train = TargetScene(None, GroundTruth_train, HalfWidth, padded=scene_test.data, gather_patches=False)
+    return scene_test, scene_train
+
+def get_alltest_loader(Data_Band_Scaler, GroundTruth, class_num, shot_num_per_class, HalfWidth, scene=None):
+    """
+    every labeled pixel as test sample, in a per seed random order
+    :param scene: TargetScene of the data, built from Data_Band_Scaler/GroundTruth when not given
+    """
+    if scene is None:
+        scene = TargetScene(Data_Band_Scaler, GroundTruth, HalfWidth)
 
     train = {}
 
-    m = int(np.max(G))
+    m = len(scene.class_indices)
 
     for i in range(m):
-        indices = [j for j, x in enumerate(Row.ravel().tolist()) if G[Row[j], Column[j]] == i + 1]
+        indices = list(scene.class_indices[i])
         np.random.shuffle(indices)
         nb_val = int(len(indices))
         train[i] = indices[:nb_val]
@@ -348,23 +398,33 @@ def get_alltest_loader(Data_Band_Scaler, GroundTruth, class_num, shot_num_per_cl
 
     nTrain = len(train_indices)
 
-    trainX = np.zeros([nTrain,  2 * HalfWidth + 1, 2 * HalfWidth + 1, nBand], dtype=np.float32)
-    trainY = np.zeros([nTrain], dtype=np.int64)
-
     RandPerm = train_indices
     RandPerm = np.array(RandPerm)
-    for i in range(nTrain):
-        trainX[i, :, :, :] = data[Row[RandPerm[i]] - HalfWidth: Row[RandPerm[i]] + HalfWidth + 1, Column[RandPerm[i]] - HalfWidth: Column[RandPerm[i]] + HalfWidth + 1, :] # 7 7 144
-        trainY[i] = G[Row[RandPerm[i]], Column[RandPerm[i]]].astype(np.int64)
-    trainX = np.transpose(trainX, (0, 3, 1, 2))
-    trainY = trainY - 1
 
-    print('all data shape', trainX.shape)
-    print('all label shape', trainY.shape)
+    test_dataset = IndexedPatchDataset(scene, RandPerm)
+    test_loader = DataLoader(test_dataset, batch_size=autotune.get('eval_batch_size', 100), shuffle=False, num_workers=0)
+    return test_loader, scene.G.copy(), RandPerm, scene.Row, scene.Column, nTrain
+
+class NoisyPatchPool(Sequence):
+    """
+    labeled target patches, each one visible `repeat` times, with a fresh radiation
+    noise sample drawn on every read. Stands in for the list of pre-replicated noisy
+    copies while only holding the original patches in memory.
+    """
+    def __init__(self, patches, repeat):
+        self.patches = patches  # (n, nBand, H, W)
+        self.repeat = repeat
+
+    def __len__(self):
+        return len(self.patches) * self.repeat
 
-    test_dataset = MetaTrainLabeledDataset(image_datas=trainX, image_labels=trainY)
-    test_loader = DataLoader(test_dataset, batch_size=100, shuffle=False, num_workers=0)
-    return test_loader, G, RandPerm, Row, Column, nTrain
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('NoisyPatchPool index out of range')
+        patch = storage.upcast(self.patches[idx % len(self.patches)])
+        return data_augment.radiation_noise(patch).astype(np.float32)
 
 class tagetSSLDataset(Dataset):
     def __init__(self, image_datas, image_labels):
@@ -377,4 +437,54 @@ class tagetSSLDataset(Dataset):
     def __getitem__(self, idx):
         image = self.image_datas[idx]
         label = self.image_labels[idx]
-        return image, label
\ No newline at end of file
+        return image, label
+
+def _padded_target(config, bands=None):
+    """
+    standardized, zero padded target cube read through utils.scene_reader, one row block at a time.
+    With config['scene_cache_dir'] it is written there once and memory-mapped, and the scenes cut
+    the patches from it when read instead of gathering the labeled ones, so neither the
+    preparation nor the patch reads hold the whole cube in memory
+    """
+    path = os.path.join(config['data_path'], config['target_data'])
+    train_opt = config['train_config']
+    HalfWidth = train_opt['patch_size'] // 2
+    reader = scene_reader.open_scene(path)
+    print(os.path.basename(path), *reader.shape)
+    cache = None
+    if config['scene_cache_dir'] is not None:
+        cache = scene_reader.cache_path(config['scene_cache_dir'], path, HalfWidth, train_opt['storage_dtype'], bands)
+    with profiling.memory.stage('read_scene'):
+        padded = scene_reader.padded_scene(reader, HalfWidth, bands, train_opt['storage_dtype'], path=cache, source=path)
+    reader.close()
+    return padded, HalfWidth
+
+def load_target_single_gt(config, bands=None):
+    """
+    target scene with one ground truth, the labeled pixels are split into train/test per seed (Indian Pines).
+    The seed independent preparation is done here, once
+    :param bands: only read these bands, for the inference of a band-selected model
+    """
+    padded, HalfWidth = _padded_target(config, bands)
+    GroundTruth = scene_reader.read_all(os.path.join(config['data_path'], config['target_data_gt']))
+    return {'Data_Band_Scaler': None, 'GroundTruth': None,
+            'scene': TargetScene(None, GroundTruth, HalfWidth, padded=padded, gather_patches=not isinstance(padded, np.memmap))}
+
+def load_target_split_mask(config, bands=None):
+    """
+    target scene with separate train and test masks (Houston)
+    :param bands: only read these bands, for the inference of a band-selected model
+    """
+    padded, HalfWidth = _padded_target(config, bands)
+    GroundTruth_train = scene_reader.read_all(os.path.join(config['data_path'], config['target_data_gt_train']))
+    GroundTruth_test = scene_reader.read_all(os.path.join(config['data_path'], config['target_data_gt_test']))
+    scene_test, scene_train = get_split_mask_scenes(None, GroundTruth_train, GroundTruth_test, HalfWidth, padded=padded,
+                                                    gather_patches=not isinstance(padded, np.memmap))
+    return {'Data_Band_Scaler': None, 'GroundTruth_train': None, 'GroundTruth_test': None,
+            'scene_train': scene_train, 'scene_test': scene_test}
+
+# config['target_type'] -> (scene loader, per seed dataset builder, whether RandPerm starts with the nTrain train samples)
+TARGET_LOADERS = {
+    'single_gt': (load_target_single_gt, get_target_dataset, True),
+    'split_mask': (load_target_split_mask, get_target_dataset_houston, False),
+}
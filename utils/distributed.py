@@ -0,0 +1,58 @@
+import os
+import torch
+import torch.distributed as dist
+
+
+def init(rank, world_size, port=29500, threads=0):
+    """
+    join the gloo process group of a single machine run
+    :param threads: torch intra-op threads of this rank, 0 splits the cores evenly between the ranks
+    """
+    os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+    os.environ.setdefault('MASTER_PORT', str(port))
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    torch.set_num_threads(threads if threads > 0 else max(1, (os.cpu_count() or 1) // world_size))
+
+def cleanup():
+    if dist.is_available() and dist.is_initialized():
+        dist.destroy_process_group()
+
+def world_size():
+    return dist.get_world_size() if dist.is_available() and dist.is_initialized() else 1
+
+def broadcast_parameters(modules, src=0):
+    """
+    copy the parameters and buffers of rank `src` to every rank, so all ranks start from the same weights
+    """
+    if world_size() == 1:
+        return
+    for module in modules:
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            dist.broadcast(tensor.data, src)
+
+def all_reduce_gradients(modules):
+    """
+    average the gradients of all ranks. The gradients are packed into one flat buffer so that
+    an episode costs a single all_reduce instead of one per parameter.
+    """
+    size = world_size()
+    if size == 1:
+        return
+    grads = [p.grad for module in modules for p in module.parameters() if p.grad is not None]
+    flat = torch.cat([g.reshape(-1) for g in grads])
+    dist.all_reduce(flat)
+    flat /= size
+    offset = 0
+    for g in grads:
+        g.copy_(flat[offset:offset + g.numel()].view_as(g))
+        offset += g.numel()
+
+def broadcast_flag(flag, src=0):
+    """
+    decision taken on rank `src` (e.g. early stopping) shared with every rank
+    """
+    if world_size() == 1:
+        return flag
+    tensor = torch.tensor([int(flag)])
+    dist.broadcast(tensor, src)
+    return bool(tensor.item())
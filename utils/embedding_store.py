@@ -0,0 +1,222 @@
+"""
+per-pixel store of the fused spatial-spectral embeddings of a trained target model, written once by
+export_embeddings.py so that evaluation, prototype classification, re-clustering or map rendering
+read the embeddings instead of running encoder(mapping_tar(...)) again. A store is a directory:
+
+    embeddings.npy  (N, emb_size) float16 or float32, opened memory-mapped
+    coords.npy      (N, 2) image row, column of every embedding
+    labels.npy      (N,) 0-based ground truth class, -1 for unlabeled pixels
+    support.npz     features and labels of the support samples (and their pixels when known)
+    meta.json       pixels, dtype, image shape, class names and map colors
+    scores_<mode>.npz  nearest support class and distance of every pixel, kept up to date by add_support
+"""
+import json
+import os
+import numpy as np
+
+from . import utils, autotune
+from .inference import SupportClassifier
+from .evaluation import ConfusionMatrix
+
+
+def export(predictor, scene, path, pixels='labeled', dtype='float16', chunk_size=None, map_colors=None):
+    """
+    :param predictor: utils.inference.Predictor
+    :param scene: TargetScene of the image
+    :param pixels: 'labeled' (the labeled pixels of the scene, in its order) or 'all' (the whole image in scan order)
+    :param chunk_size: pixels cut and written at a time, None takes the machine profile (utils.autotune)
+    """
+    chunk_size = chunk_size or autotune.get('chunk_size', 4096)
+    height, width = scene.shape
+    if pixels == 'labeled':
+        rows, columns = scene.Row - scene.HalfWidth, scene.Column - scene.HalfWidth
+    elif pixels == 'all':
+        rows, columns = [index.ravel() for index in np.mgrid[:height, :width]]
+    else:
+        raise ValueError('Unknown pixels: {}'.format(pixels))
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    coords = np.stack([rows, columns], 1).astype(np.int32)
+    labels = scene.G[rows + scene.HalfWidth, columns + scene.HalfWidth].astype(np.int64) - 1
+    embeddings = np.lib.format.open_memmap(os.path.join(path, 'embeddings.npy'), mode='w+', dtype=dtype,
+                                           shape=(len(coords), predictor.encoder.emb_size))
+    for start in range(0, len(coords), chunk_size):
+        embeddings[start:start + chunk_size] = predictor.features(scene.cut(rows[start:start + chunk_size], columns[start:start + chunk_size]))
+        print('exported {}/{} pixels'.format(min(start + chunk_size, len(coords)), len(coords)))
+    embeddings.flush()
+    del embeddings
+
+    np.save(os.path.join(path, 'coords.npy'), coords)
+    np.save(os.path.join(path, 'labels.npy'), labels)
+    support = {'features': predictor.support_features, 'labels': predictor.support_labels}
+    if predictor.support_pixels is not None:
+        support['pixels'] = np.asarray(predictor.support_pixels, dtype=np.int32)
+    np.savez(os.path.join(path, 'support.npz'), **support)
+    meta = {'pixels': pixels, 'dtype': dtype, 'num_pixels': len(coords), 'emb_size': predictor.encoder.emb_size,
+            'shape': [height, width], 'classes': predictor.class_names,
+            'map_colors': [list(color) for color in map_colors] if map_colors is not None else None}
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump(meta, f, indent=2)
+
+def load(path):
+    """
+    :return: dict with the memory-mapped 'embeddings', 'coords', 'labels', 'support' (dict) and 'meta'
+    """
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    with np.load(os.path.join(path, 'support.npz')) as support:
+        support = {name: support[name] for name in support.files}
+    return {'embeddings': np.load(os.path.join(path, 'embeddings.npy'), mmap_mode='r'),
+            'coords': np.load(os.path.join(path, 'coords.npy')),
+            'labels': np.load(os.path.join(path, 'labels.npy')),
+            'support': support,
+            'meta': meta}
+
+def classify(store, mode='knn', chunk_size=65536):
+    """
+    classify every embedding of the store against its support features, without the model
+    :param mode: 'knn' or 'prototype', see utils.inference.SupportClassifier
+    """
+    classifier = SupportClassifier(store['support']['features'], store['support']['labels'], mode)
+    embeddings = store['embeddings']
+    return np.concatenate([classifier.predict(np.asarray(embeddings[start:start + chunk_size], dtype=np.float32))
+                           for start in range(0, len(embeddings), chunk_size)])
+
+def test_mask(store):
+    """
+    labeled pixels that are not support samples, the test set of the evaluation in train.py
+    """
+    mask = store['labels'] >= 0
+    if 'pixels' in store['support']:
+        height, width = store['meta']['shape']
+        support = np.ravel_multi_index(store['support']['pixels'].T, (height, width))
+        mask &= ~np.isin(np.ravel_multi_index(store['coords'].T, (height, width)), support)
+    return mask
+
+def evaluate(store, predict):
+    """
+    OA, AA, kappa and per-class accuracy of the predictions on the test pixels of the store
+    """
+    mask = test_mask(store)
+    labels, predict = store['labels'][mask], predict[mask]
+    confusion = ConfusionMatrix(int(max(labels.max(), predict.max())) + 1)
+    confusion.update(labels, predict)
+    return dict(confusion.scores(), class_accuracy=confusion.class_accuracy(), num_test=int(mask.sum()))
+
+def label_map(store, predict):
+    """
+    (height, width) map of the 1-based predicted classes, 0 where the store has no pixel
+    """
+    height, width = store['meta']['shape']
+    G = np.zeros((height, width), dtype=np.int64)
+    G[store['coords'][:, 0], store['coords'][:, 1]] = predict + 1
+    return G
+
+def render_map(G, colors, path):
+    hsi_pic = np.zeros((G.shape[0], G.shape[1], 3))
+    for class_, color in enumerate(colors):
+        hsi_pic[G == class_ + 1] = color
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    utils.classification_map(hsi_pic, G, 24, path)
+
+def _references(support, mode):
+    """
+    support samples (knn) or class prototypes (prototype) and their classes
+    """
+    if mode == 'knn':
+        return np.asarray(support['features'], dtype=np.float32), support['labels']
+    if mode == 'prototype':
+        classes = np.unique(support['labels'])
+        return np.stack([support['features'][support['labels'] == c].mean(0) for c in classes]).astype(np.float32), classes
+    raise ValueError('Unknown classifier mode: {}'.format(mode))
+
+def _distances(features, references):
+    features = np.asarray(features, dtype=np.float32)
+    distances = (features ** 2).sum(1)[:, None] - 2 * features.dot(references.T) + (references ** 2).sum(1)[None]
+    return np.maximum(distances, 0)
+
+def score(store, mode='knn', chunk_size=65536):
+    """
+    class of and squared distance to the nearest reference (support sample or class prototype) of every pixel.
+    The min/max scaling of SupportClassifier is one affine map for all dimensions and changes no nearest
+    reference, so the distances are taken between the raw embeddings
+    """
+    references, reference_labels = _references(store['support'], mode)
+    embeddings = store['embeddings']
+    predict = np.empty(len(embeddings), dtype=np.int64)
+    distance = np.empty(len(embeddings), dtype=np.float32)
+    for start in range(0, len(embeddings), chunk_size):
+        distances = _distances(embeddings[start:start + chunk_size], references)
+        predict[start:start + chunk_size] = reference_labels[distances.argmin(1)]
+        distance[start:start + chunk_size] = distances.min(1)
+    return predict, distance
+
+def load_scores(path, store, mode='knn'):
+    """
+    scores saved by add_support, computed (and saved) when missing or out of date
+    """
+    scores_path = os.path.join(path, 'scores_{}.npz'.format(mode))
+    if os.path.exists(scores_path):
+        with np.load(scores_path) as scores:
+            if int(scores['num_support']) == len(store['support']['labels']):
+                return scores['predict'], scores['distance']
+    predict, distance = score(store, mode)
+    np.savez(scores_path, predict=predict, distance=distance, num_support=len(store['support']['labels']))
+    return predict, distance
+
+def add_support(path, features, labels, pixels=None, mode='knn', chunk_size=65536):
+    """
+    merge new labeled samples into the support set of a store and re-score only the pixels they can change:
+    with knn, a pixel changes when a new sample is closer than its current nearest one; with prototypes,
+    the pixels of the classes whose prototype moved are re-scored against all prototypes and the others
+    are only compared with the moved prototypes
+    :param features: embeddings of the new samples from the model of the store
+    :param pixels: image row/column of the new samples, they are then left out of the evaluation
+    :return: predict of every pixel, mask of the re-scored pixels
+    """
+    store = load(path)
+    predict, distance = load_scores(path, store, mode)
+    predict, distance = predict.copy(), distance.copy()
+    features = np.asarray(features, dtype=np.float32)
+    labels = np.asarray(labels, dtype=np.int64)
+
+    support = dict(store['support'])
+    if pixels is not None:
+        support['pixels'] = np.concatenate([support.get('pixels', np.zeros((0, 2), dtype=np.int32)), np.asarray(pixels, dtype=np.int32)])
+    support['features'] = np.concatenate([support['features'], features])
+    support['labels'] = np.concatenate([support['labels'], labels])
+    store['support'] = support
+
+    embeddings = store['embeddings']
+    rescored = np.zeros(len(embeddings), dtype=bool)
+    if mode == 'knn':
+        references, reference_labels = features, labels
+    else:
+        references, reference_labels = _references(support, mode)
+        moved = np.isin(reference_labels, np.unique(labels))
+    for start in range(0, len(embeddings), chunk_size):
+        end = min(start + chunk_size, len(embeddings))
+        if mode == 'knn':
+            distances = _distances(embeddings[start:end], references)
+            closer = distances.min(1) < distance[start:end]
+        else:
+            # pixels of a moved class may now be farther from it, they are scored against every prototype
+            own = np.isin(predict[start:end], reference_labels[moved])
+            distances = _distances(embeddings[start:end], references)
+            distances[~own] = np.where(moved[None], distances[~own], np.inf)
+            closer = own | (distances.min(1) < distance[start:end])
+        index = np.flatnonzero(closer)
+        predict[start + index] = reference_labels[distances[index].argmin(1)]
+        distance[start + index] = distances[index].min(1)
+        rescored[start:end] = closer
+
+    np.savez(os.path.join(path, 'support.npz'), **support)
+    np.savez(os.path.join(path, 'scores_{}.npz'.format(mode)), predict=predict, distance=distance, num_support=len(support['labels']))
+    # the scores of the other mode no longer match the support set
+    other = os.path.join(path, 'scores_{}.npz'.format('prototype' if mode == 'knn' else 'knn'))
+    if os.path.exists(other):
+        os.remove(other)
+    return predict, rescored
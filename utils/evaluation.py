@@ -0,0 +1,218 @@
+"""
+test evaluation of train.py: 1-NN of the test patches on the min/max scaled support features. With
+async_eval the evaluation runs in a worker process on its own threads: train.py submits a copy of
+the target mapping and encoder weights and keeps training, the results come back through a queue
+and are recorded when they arrive. The metrics are accumulated in a ConfusionMatrix batch by batch.
+"""
+import queue
+import numpy as np
+from sklearn.neighbors import KNeighborsClassifier
+
+import torch
+import torch.multiprocessing as mp
+from torch.autograd import Variable
+
+from . import autotune, storage
+from .dataloader import IndexedPatchDataset, MetaTrainLabeledDataset
+
+
+class ConfusionMatrix(object):
+    """
+    confusion matrix accumulated batch by batch (rows are the true classes, columns the predicted ones),
+    the counts stay on the device of the predictions. OA, AA, per-class accuracy and kappa are computed
+    from the C x C matrix, as sklearn.metrics computes them from the full label arrays
+    """
+    def __init__(self, num_classes, device='cpu'):
+        self.num_classes = num_classes
+        self.counts = torch.zeros(num_classes * num_classes, dtype=torch.int64, device=device)
+
+    def update(self, labels, predict):
+        """
+        :param labels: true classes of a batch, tensor or array
+        :param predict: predicted classes of the batch
+        """
+        labels = torch.as_tensor(labels, device=self.counts.device).reshape(-1).long()
+        predict = torch.as_tensor(predict, device=self.counts.device).reshape(-1).long()
+        self.counts += torch.bincount(labels * self.num_classes + predict, minlength=self.num_classes * self.num_classes)
+
+    @property
+    def matrix(self):
+        return self.counts.reshape(self.num_classes, self.num_classes).cpu().numpy()
+
+    def total(self):
+        return int(self.counts.sum())
+
+    def correct(self):
+        return int(self.counts[::self.num_classes + 1].sum())
+
+    def overall_accuracy(self):
+        return self.correct() / float(self.total())
+
+    def class_accuracy(self):
+        """
+        recall of every class, nan for the classes without a true sample
+        """
+        C = self.matrix
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.diag(C) / np.sum(C, 1, dtype=float)
+
+    def average_accuracy(self):
+        # over the classes with true samples
+        return float(np.nanmean(self.class_accuracy()))
+
+    def kappa(self):
+        C = self.matrix.astype(float)
+        total = C.sum()
+        expected = np.dot(C.sum(0), C.sum(1)) / total ** 2
+        return (np.trace(C) / total - expected) / (1 - expected)
+
+    def scores(self):
+        """
+        OA, AA and kappa in %
+        """
+        return {'OA': 100. * self.overall_accuracy(), 'AA': 100. * self.average_accuracy(), 'kappa': 100. * self.kappa()}
+
+def evaluate(mapping_tar, encoder, train_loader, test_loader, device, num_classes):
+    """
+    :return: dict of the test accuracy (%), the number of correct test samples, the predicted class of
+             every test sample (for the classification map) and the ConfusionMatrix
+    """
+    mapping_tar.eval()
+    encoder.eval()
+    confusion = ConfusionMatrix(num_classes)
+    counter = 0
+    predict = np.zeros(len(test_loader.dataset), dtype=np.int64)
+    with torch.no_grad():
+        train_datas, train_labels = train_loader.__iter__().next()
+        train_features = encoder(mapping_tar(Variable(train_datas).to(device)))
+
+        max_value = train_features.max()
+        min_value = train_features.min()
+        print(max_value.item())
+        print(min_value.item())
+        train_features = (train_features - min_value) * 1.0 / (max_value - min_value)
+
+        KNN_classifier = KNeighborsClassifier(n_neighbors=1)
+        KNN_classifier.fit(train_features.cpu().detach().numpy(), train_labels)
+        for test_datas, test_labels in test_loader:
+            batch_size = test_labels.shape[0]
+
+            test_features = encoder(mapping_tar((Variable(test_datas).to(device))))
+            test_features = (test_features - min_value) * 1.0 / (max_value - min_value)
+            predict_labels = KNN_classifier.predict(test_features.cpu().detach().numpy())
+            confusion.update(test_labels, predict_labels)
+
+            predict[counter:counter + batch_size] = predict_labels
+            counter += batch_size
+    mapping_tar.train()
+    encoder.train()
+    return {'accuracy': 100. * confusion.correct() / len(test_loader.dataset), 'total_rewards': confusion.correct(),
+            'predict': predict, 'confusion': confusion}
+
+def snapshot(module):
+    """
+    cpu copy of the weights of a module, unaffected by the next optimizer steps
+    """
+    return {key: value.detach().cpu().clone() for key, value in module.state_dict().items()}
+
+def split_arrays(dataset, chunk_size=4096):
+    """
+    patches (in their storage dtype) and labels of a split as plain arrays. The worker gets these
+    instead of the datasets, an IndexedPatchDataset holds the whole TargetScene
+    """
+    if isinstance(dataset, IndexedPatchDataset):
+        scene, index = dataset.scene, np.asarray(dataset.index)
+        storage_dtype = storage.storage_dtype_of(scene.data)
+        data = np.concatenate([storage.to_storage(scene.get_patches(index[start:start + chunk_size]), storage_dtype)
+                               for start in range(0, len(index), chunk_size)])
+        return data, scene.labels[index]
+    return dataset.image_datas, np.asarray(dataset.image_labels)
+
+def _worker(train_opt, threads, requests, results):
+    # imported here, the worker is a spawned process
+    from .inference import build_models
+
+    torch.set_num_threads(threads)
+    train_loader, test_loader = None, None
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        if message[0] == 'split':
+            _, train_data, train_labels, test_data, test_labels = message
+            train_dataset = MetaTrainLabeledDataset(train_data, train_labels)
+            test_dataset = MetaTrainLabeledDataset(test_data, test_labels)
+            train_loader = torch.utils.data.DataLoader(train_dataset, batch_size=len(train_dataset), shuffle=False)
+            test_loader = torch.utils.data.DataLoader(test_dataset, batch_size=autotune.get('eval_batch_size', 100), shuffle=False)
+            continue
+        _, episode, mapping_tar_state, encoder_state, bands = message
+        # the bands of the target mapping can change during training (band_topk)
+        mapping_tar, encoder = build_models(train_opt, bands)
+        mapping_tar.load_state_dict(mapping_tar_state)
+        encoder.load_state_dict(encoder_state)
+        result = evaluate(mapping_tar, encoder, train_loader, test_loader, 'cpu', train_opt['tar_class_num'])
+        result['episode'] = episode
+        results.put(result)
+
+class AsyncEvaluator(object):
+    """
+    evaluation worker process of train.py
+    :param threads: torch threads of the worker, the cores it takes from training
+    """
+    def __init__(self, train_opt, threads=1):
+        context = mp.get_context('spawn')
+        self.requests = context.Queue()
+        self.results = context.Queue()
+        self.pending = 0
+        self.process = context.Process(target=_worker, args=(dict(train_opt), threads, self.requests, self.results), daemon=True)
+        self.process.start()
+
+    def set_split(self, train_dataset, test_dataset):
+        """
+        support and test samples of the following evaluations
+        """
+        self.requests.put(('split',) + split_arrays(train_dataset) + split_arrays(test_dataset))
+
+    def submit(self, episode, mapping_tar_state, encoder_state, bands=None):
+        """
+        :param mapping_tar_state: snapshot of the weights, they must not change while they are queued
+        """
+        self.requests.put(('evaluate', episode, mapping_tar_state, encoder_state, bands))
+        self.pending += 1
+
+    def _get(self, block):
+        while True:
+            try:
+                return self.results.get(block, timeout=1 if block else None)
+            except queue.Empty:
+                if not block:
+                    return None
+                if not self.process.is_alive():
+                    raise RuntimeError('the evaluation worker exited with code {}'.format(self.process.exitcode))
+
+    def poll(self):
+        """
+        results that arrived since the last call, without waiting
+        """
+        results = []
+        while self.pending > 0:
+            result = self._get(False)
+            if result is None:
+                break
+            self.pending -= 1
+            results.append(result)
+        return results
+
+    def wait(self):
+        """
+        results of every submitted evaluation
+        """
+        results = []
+        while self.pending > 0:
+            results.append(self._get(True))
+            self.pending -= 1
+        return results
+
+    def close(self):
+        self.requests.put(None)
+        self.process.join()
@@ -0,0 +1,98 @@
+"""
+memory bank of the target ssl term: the normalized features of the past ssl batches and their labels
+are kept in a FIFO queue, and SupConLoss contrasts the current batch against them as extra positives
+and negatives. The encoder cost of a step does not change while the contrastive set grows to the
+size of the queue. The queued features are either the detached features of the batch or, MoCo style,
+the features of a momentum copy of the target mapping and the encoder (one more forward without
+gradient per step), which change more slowly than the online model.
+"""
+import copy
+
+import torch
+
+
+class FeatureQueue(object):
+    """
+    :param size: features kept, the oldest are overwritten first
+    :param dtype: 'float32' or 'float16' storage of the features, size * dim * 2 or 4 bytes
+    """
+    def __init__(self, size, dim, dtype='float32', device='cpu'):
+        self.size = size
+        self.features = torch.zeros(size, dim, dtype=getattr(torch, dtype), device=device)
+        self.labels = torch.zeros(size, dtype=torch.int64, device=device)
+        self.ptr = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def nbytes(self):
+        return self.features.element_size() * self.features.nelement() + self.labels.element_size() * self.labels.nelement()
+
+    def get(self):
+        """
+        :return: (features, labels) of the queue, (None, None) while it is empty
+        """
+        if self.count == 0:
+            return None, None
+        return self.features[:self.count], self.labels[:self.count]
+
+    def enqueue(self, features, labels):
+        """
+        :param features: (N, dim) normalized features, stored detached
+        """
+        features = features.detach()[-self.size:]
+        labels = torch.as_tensor(labels).reshape(-1)[-self.size:].to(self.labels.device)
+        index = (self.ptr + torch.arange(len(features), device=self.labels.device)) % self.size
+        self.features[index] = features.to(self.features.dtype)
+        self.labels[index] = labels
+        self.ptr = (self.ptr + len(features)) % self.size
+        self.count = min(self.count + len(features), self.size)
+
+    def state_dict(self):
+        return {'features': self.features, 'labels': self.labels, 'ptr': self.ptr, 'count': self.count}
+
+    def load_state_dict(self, state):
+        self.features.copy_(state['features'])
+        self.labels.copy_(state['labels'])
+        self.ptr, self.count = state['ptr'], state['count']
+
+class MomentumModel(object):
+    """
+    exponential moving average copy of a module, without gradients
+    :param momentum: weight of the copy in every update, the online module gets 1 - momentum
+    """
+    def __init__(self, module, momentum=0.99):
+        self.online = module
+        self.momentum = momentum
+        self.module = self._copy()
+
+    def _copy(self):
+        module = copy.deepcopy(self.online)
+        module.requires_grad_(False)
+        return module
+
+    def __call__(self, x):
+        return self.module(x)
+
+    def update(self):
+        online = self.online.state_dict()
+        target = self.module.state_dict()
+        if any(online[key].shape != value.shape for key, value in target.items()):
+            # band selection replaced the input weights of the target mapping, the copy starts over from it
+            self.module = self._copy()
+            return
+        with torch.no_grad():
+            for param, online_param in zip(self.module.parameters(), self.online.parameters()):
+                param.mul_(self.momentum).add_(online_param.detach(), alpha=1 - self.momentum)
+            for buffer, online_buffer in zip(self.module.buffers(), self.online.buffers()):
+                buffer.copy_(online_buffer)
+
+    def state_dict(self):
+        return self.module.state_dict()
+
+    def load_state_dict(self, state):
+        # the online module is restored first, with the bands it was saved with
+        self.module = self._copy()
+        self.module.load_state_dict(state)
@@ -0,0 +1,128 @@
+"""
+classification of target pixels outside of the training script. The best weights of a seed
+(checkpoint_dir/seed<i>_best.pth) hold the target mapping, the encoder and the support samples of
+the evaluation, so the support features are computed once and new patches are classified the way
+train.py evaluates them: 1-NN on min/max scaled features, or the nearest class prototype.
+"""
+import numpy as np
+import torch
+from sklearn.neighbors import KNeighborsClassifier
+
+from model.mapping import Mapping
+from model.encoder import Encoder
+from . import checkpoint, storage, autotune
+from .dataloader import TARGET_LOADERS
+
+
+def build_models(train_opt, bands=None):
+    """
+    :param bands: target bands of a band-selected model
+    """
+    mapping_tar = Mapping(train_opt['tar_input_dim'], train_opt['n_dim'])
+    if bands is not None:
+        mapping_tar.select_bands(bands)
+    # weights saved before the encoder options existed have the default encoder
+    encoder = Encoder(n_dimension=train_opt['n_dim'], patch_size=train_opt['patch_size'],
+                      emb_size=train_opt['d_emb'], dropout=train_opt['dropout'],
+                      inter_size=train_opt.get('inter_size', 24), spectral_residual=train_opt.get('spectral_residual', True),
+                      branches=train_opt.get('branches', 'spectral_spatial'), channels=train_opt.get('encoder_channels'))
+    return mapping_tar, encoder
+
+def extract_features(mapping_tar, encoder, patches, batch_size=None, device='cpu'):
+    """
+    fused spatial-spectral features of the patches, in batches of batch_size
+    :param batch_size: None takes the inference batch of the machine profile (utils.autotune)
+    :param patches: (N, nBand, H, W) float32 or compact (utils.storage) array
+    :return: (N, emb_size) float32 array
+    """
+    batch_size = batch_size or autotune.get('inference_batch_size', 1024)
+    features = [np.zeros((0, encoder.emb_size), dtype=np.float32)]
+    with torch.no_grad():
+        for start in range(0, len(patches), batch_size):
+            batch = np.ascontiguousarray(storage.upcast(patches[start:start + batch_size]), dtype=np.float32)
+            features.append(encoder(mapping_tar(torch.from_numpy(batch).to(device))).cpu().numpy())
+    return np.concatenate(features)
+
+class SupportClassifier(object):
+    """
+    :param mode: 'knn' (1-NN on the support features, as in train.py) or 'prototype' (nearest class mean)
+    """
+    def __init__(self, support_features, support_labels, mode='knn'):
+        self.mode = mode
+        self.min_value = support_features.min()
+        self.max_value = support_features.max()
+        features = self.normalize(support_features)
+        self.classes = np.unique(support_labels)
+        if mode == 'knn':
+            self.knn = KNeighborsClassifier(n_neighbors=1)
+            self.knn.fit(features, support_labels)
+        elif mode == 'prototype':
+            self.prototypes = np.stack([features[support_labels == c].mean(0) for c in self.classes])
+        else:
+            raise ValueError('Unknown classifier mode: {}'.format(mode))
+
+    def normalize(self, features):
+        return (features - self.min_value) * 1.0 / (self.max_value - self.min_value)
+
+    def predict(self, features):
+        features = self.normalize(features)
+        if self.mode == 'knn':
+            return self.knn.predict(features)
+        distances = ((features[:, None, :] - self.prototypes[None]) ** 2).sum(-1)
+        return self.classes[distances.argmin(1)]
+
+class Predictor(object):
+    """
+    trained target model with its cached support features
+    :param path: best weights of a seed saved by train.py
+    """
+    def __init__(self, path, mode='knn', device='cpu', batch_size=None):
+        state = checkpoint.load(path, device)
+        if state is None:
+            raise FileNotFoundError(path)
+        if 'support_data' not in state:
+            raise ValueError('{} has no support samples, it was saved by an older train.py'.format(path))
+        self.train_opt = state['train_config']
+        self.class_names = state.get('labels_tar')
+        self.device = device
+        self.batch_size = batch_size
+        # bands read by a band-selected model, None for all of them
+        self.bands = state.get('target_bands')
+        self.mapping_tar, self.encoder = build_models(self.train_opt, self.bands)
+        self.mapping_tar.load_state_dict(state['mapping_tar'])
+        self.encoder.load_state_dict(state['encoder'])
+        self.mapping_tar.to(device).eval()
+        self.encoder.to(device).eval()
+        self.support_features = self.features(state['support_data'])
+        self.support_labels = np.asarray(state['support_labels'])
+        # image row/column of the support samples, None when they are not pixels of the target scene
+        self.support_pixels = state.get('support_pixels')
+        self.classifier = SupportClassifier(self.support_features, self.support_labels, mode)
+
+    def features(self, patches):
+        return extract_features(self.mapping_tar, self.encoder, patches, self.batch_size, self.device)
+
+    def predict(self, patches):
+        """
+        :return: 0-based class of every patch
+        """
+        return self.classifier.predict(self.features(patches))
+
+def load_scene(config, bands=None):
+    """
+    TargetScene covering the whole target image, to cut the patches of any pixel from. With
+    config['scene_cache_dir'] its cube is memory-mapped and only the cut windows are read
+    :param bands: only read these bands (Predictor.bands)
+    """
+    kwargs = TARGET_LOADERS[config['target_type']][0](config, bands)
+    return kwargs['scene'] if 'scene' in kwargs else kwargs['scene_test']
+
+def test_index(scene, support_pixels=None):
+    """
+    labeled pixels of the scene that are not support samples, the test set of the evaluation in train.py
+    """
+    index = np.arange(len(scene.labels))
+    if support_pixels is None:
+        return index
+    labeled = np.ravel_multi_index((scene.Row - scene.HalfWidth, scene.Column - scene.HalfWidth), scene.shape)
+    return index[~np.isin(labeled, np.ravel_multi_index(np.asarray(support_pixels).T, scene.shape))]
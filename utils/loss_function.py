@@ -44,7 +44,11 @@ class SupConLoss(nn.Module):
 
         self.base_temperature = temperature
 
-    def forward(self, features, labels=None, mask=None, device=0):
+    def forward(self, features, labels=None, mask=None, device=0, queue_features=None, queue_labels=None):
+        """
+        :param queue_features: (Q, dim) normalized features of a memory bank (utils.feature_queue) contrasted
+                               with the anchors as well, positives by `queue_labels` and never anchors themselves
+        """
         if len(features.shape) < 3:
             raise ValueError('`features` needs to be [bsz, n_views, ...],'
                              'at least 3 dimensions are required')
@@ -75,6 +79,11 @@ class SupConLoss(nn.Module):
         else:
             raise ValueError('Unknown mode: {}'.format(self.contrast_mode))
 
+        if queue_features is not None:
+            if labels is None:
+                raise ValueError('`queue_features` need `labels`')
+            contrast_feature = torch.cat([contrast_feature, queue_features.to(features.device, contrast_feature.dtype)], dim=0)
+
         # compute logits
         anchor_dot_contrast = torch.div(
             torch.matmul(anchor_feature, contrast_feature.T),
@@ -93,6 +102,11 @@ class SupConLoss(nn.Module):
             0
         )
         mask = mask * logits_mask
+        if queue_features is not None:
+            # on the device of the features, whatever `device` says
+            queue_mask = torch.eq(labels.repeat(anchor_count, 1).to(features.device), queue_labels.view(1, -1).to(features.device)).float()
+            mask = torch.cat([mask.to(features.device), queue_mask], dim=1)
+            logits_mask = torch.cat([logits_mask.to(features.device), torch.ones_like(queue_mask)], dim=1)
 
         # compute log_prob
         exp_logits = torch.exp(logits) * logits_mask
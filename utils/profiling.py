@@ -0,0 +1,205 @@
+import contextlib
+import json
+import os
+import resource
+import time
+import tracemalloc
+from collections import OrderedDict
+
+import torch
+
+
+class PhaseTimer(object):
+    """
+    lap timer for the phases of a training episode. `lap(name)` charges the time since the
+    previous lap to `name`, so the loop body does not need to be restructured:
+
+        timer.start()
+        ...sample the task...
+        timer.lap('task_sampling')
+        ...forward...
+        timer.lap('forward_src')
+
+    With sync=True the cuda stream is synchronized at every lap so that asynchronous kernels
+    are charged to the phase that launched them.
+    """
+    def __init__(self, sync=False):
+        self.sync = sync and torch.cuda.is_available()
+        self.totals = OrderedDict()
+        self.window = OrderedDict()
+        self.window_episodes = 0
+        self.episodes = 0
+        self._last = None
+
+    def start(self):
+        if self.sync:
+            torch.cuda.synchronize()
+        self._last = time.perf_counter()
+
+    def lap(self, name):
+        if self.sync:
+            torch.cuda.synchronize()
+        now = time.perf_counter()
+        elapsed = now - self._last
+        self._last = now
+        self.totals[name] = self.totals.get(name, 0.0) + elapsed
+        self.window[name] = self.window.get(name, 0.0) + elapsed
+
+    def end_episode(self):
+        self.episodes += 1
+        self.window_episodes += 1
+
+    def get(self, name):
+        return self.totals.get(name, 0.0)
+
+    def flush(self, writer, step):
+        """
+        write the mean time per episode (ms) of every phase since the last flush as scalars
+        """
+        if self.window_episodes == 0:
+            return {}
+        means = OrderedDict((name, 1000. * total / self.window_episodes) for name, total in self.window.items())
+        for name, value in means.items():
+            writer.add_scalar('Time/{}'.format(name), value, step)
+        writer.add_scalar('Time/episode', sum(means.values()), step)
+        self.window = OrderedDict()
+        self.window_episodes = 0
+        return means
+
+    def summary(self):
+        total = sum(self.totals.values())
+        return {'episodes': self.episodes,
+                'total_s': total,
+                'phases': OrderedDict((name, {'total_s': value,
+                                              'ms_per_episode': 1000. * value / max(1, self.episodes),
+                                              'share': value / total if total > 0 else 0.0})
+                                      for name, value in self.totals.items())}
+
+    def state_dict(self):
+        return {'totals': dict(self.totals), 'episodes': self.episodes}
+
+    def load_state_dict(self, state):
+        self.totals = OrderedDict(state['totals'])
+        self.episodes = state['episodes']
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.summary(), f, indent=2)
+
+
+def reset_peak_rss():
+    # writing 5 to clear_refs resets VmHWM on linux, elsewhere the peak stays process wide
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+def peak_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024. / 1024.
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+class MemoryProfiler(object):
+    """
+    opt-in memory profile of named stages: resident set size before/after and its peak,
+    the tracemalloc peak (numpy and python allocations) and the cuda allocator peak.
+    Disabled profilers cost nothing, so stages can stay in the data preparation code:
+
+        with profiling.memory.stage('flip'):
+            data_band_scaler = utils.flip(Data_Band_Scaler)
+    """
+    def __init__(self):
+        self.enabled = False
+        self.records = []
+        self._stack = []
+
+    def enable(self):
+        self.enabled = True
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def _peaks(self):
+        device_peak = torch.cuda.max_memory_allocated() / 1024. / 1024. if torch.cuda.is_available() else 0.0
+        return [peak_rss_mb(), tracemalloc.get_traced_memory()[1] / 1024. / 1024., device_peak]
+
+    def _fold(self, frame, peaks):
+        frame['peaks'] = [max(a, b) for a, b in zip(frame['peaks'], peaks)]
+
+    def start(self, name):
+        if not self.enabled:
+            return
+        # stages may nest, the peaks reached so far are handed to the enclosing stage before resetting
+        if self._stack:
+            self._fold(self._stack[-1], self._peaks())
+        reset_peak_rss()
+        tracemalloc.reset_peak()
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+        self._stack.append({'name': name, 'rss_before': rss_mb(), 'start': time.perf_counter(), 'peaks': [0.0, 0.0, 0.0]})
+
+    def stop(self):
+        if not self.enabled:
+            return
+        frame = self._stack.pop()
+        self._fold(frame, self._peaks())
+        if self._stack:
+            self._fold(self._stack[-1], frame['peaks'])
+        self.records.append(OrderedDict([('stage', frame['name']),
+                                         ('seconds', time.perf_counter() - frame['start']),
+                                         ('rss_before_mb', frame['rss_before']),
+                                         ('rss_after_mb', rss_mb()),
+                                         ('rss_peak_mb', frame['peaks'][0]),
+                                         ('traced_peak_mb', frame['peaks'][1]),
+                                         ('device_peak_mb', frame['peaks'][2])]))
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.stop()
+
+    def table(self):
+        """
+        one row per stage name, peaks are the maximum over all calls of the stage
+        """
+        rows = OrderedDict()
+        for record in self.records:
+            row = rows.setdefault(record['stage'], OrderedDict([('stage', record['stage']), ('calls', 0), ('seconds', 0.0),
+                                                                ('rss_delta_mb', 0.0), ('rss_peak_mb', 0.0),
+                                                                ('traced_peak_mb', 0.0), ('device_peak_mb', 0.0)]))
+            row['calls'] += 1
+            row['seconds'] += record['seconds']
+            row['rss_delta_mb'] = max(row['rss_delta_mb'], record['rss_after_mb'] - record['rss_before_mb'])
+            for key in ['rss_peak_mb', 'traced_peak_mb', 'device_peak_mb']:
+                row[key] = max(row[key], record[key])
+        return list(rows.values())
+
+    def log(self, logger):
+        for row in self.table():
+            logger.info('memory [{}] calls: {}, time: {:.2f}s, rss peak: {:.1f}MB, rss delta: {:.1f}MB, traced peak: {:.1f}MB, device peak: {:.1f}MB'.format(
+                row['stage'], row['calls'], row['seconds'], row['rss_peak_mb'], row['rss_delta_mb'], row['traced_peak_mb'], row['device_peak_mb']))
+
+    def save(self, path):
+        rows = self.table()
+        with open(path, 'w') as f:
+            f.write('\t'.join(['stage', 'calls', 'seconds', 'rss_delta_mb', 'rss_peak_mb', 'traced_peak_mb', 'device_peak_mb']) + '\n')
+            for row in rows:
+                f.write('\t'.join([row['stage'], str(row['calls'])] + ['{:.3f}'.format(row[key]) for key in list(row)[2:]]) + '\n')
+
+# process wide profiler used by the data preparation code, enabled by --profile_memory
+memory = MemoryProfiler()
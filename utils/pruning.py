@@ -0,0 +1,116 @@
+"""
+structured channel pruning of the encoder. The output channels of a convolution are removed together
+with the batch norms over them and the input channels of every layer reading them, so a pruned
+encoder is a smaller dense Encoder (its `channels` option) and not a masked one. Channels are ranked
+by the scale of their batch norms or by a first-order Taylor estimate of the loss change, see prune.py.
+"""
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from model.encoder import Encoder
+from . import storage
+
+
+def channel_groups(encoder):
+    """
+    channels that have to be pruned together, by the name of the convolution producing them; the
+    residual additions tie conv3 to conv1 and conv8 to conv7
+    :return: {name: {'out': modules producing the channels, 'bn': batch norms over them, 'in': modules reading them}}
+    """
+    groups = {}
+    if encoder.branches != 'spatial':
+        residual = encoder.spectral_encoder.residual
+        groups['conv1'] = {'out': ['spectral_encoder.conv1'] + (['spectral_encoder.conv3'] if residual else []),
+                           'bn': ['spectral_encoder.bn1'] + (['spectral_encoder.bn3'] if residual else []),
+                           'in': ['spectral_encoder.conv4'] + (['spectral_encoder.conv2'] if residual else [])}
+        if residual:
+            groups['conv2'] = {'out': ['spectral_encoder.conv2'], 'bn': ['spectral_encoder.bn2'], 'in': ['spectral_encoder.conv3']}
+    if encoder.branches != 'spectral':
+        groups['conv5'] = {'out': ['spatial_encoder.conv5'], 'bn': ['spatial_encoder.bn5'],
+                           'in': ['spatial_encoder.conv6', 'spatial_encoder.conv8']}
+        groups['conv6'] = {'out': ['spatial_encoder.conv6'], 'bn': ['spatial_encoder.bn6'], 'in': ['spatial_encoder.conv7']}
+        groups['conv7'] = {'out': ['spatial_encoder.conv7', 'spatial_encoder.conv8'], 'bn': ['spatial_encoder.bn7'],
+                           'in': ['spatial_encoder.fc.1']}
+    return groups
+
+def channels(encoder):
+    """
+    output channels of every group, the `channels` option of the encoder
+    """
+    modules = dict(encoder.named_modules())
+    return {name: modules[group['out'][0]].out_channels for name, group in channel_groups(encoder).items()}
+
+def bn_saliency(encoder):
+    """
+    |gamma| of the batch norms over the channels of every group
+    """
+    modules = dict(encoder.named_modules())
+    return {name: sum(modules[bn].weight.detach().abs().cpu().numpy() for bn in group['bn'])
+            for name, group in channel_groups(encoder).items()}
+
+def taylor_saliency(mapping_tar, encoder, patches, labels, batch_size=256, device='cpu'):
+    """
+    first-order Taylor estimate of the loss change when a channel is removed, (gamma dL/dgamma + beta dL/dbeta)^2
+    of its batch norms summed over the batches. The loss is the prototype loss of the labeled patches:
+    every patch is classified by its distance to the class means of its batch
+    :param patches: (N, nBand, H, W) labeled patches, e.g. the support samples of the best weights
+    """
+    modules = dict(encoder.named_modules())
+    groups = channel_groups(encoder)
+    saliency = {name: 0. for name in groups}
+    mapping_tar.eval()
+    encoder.eval()
+    order = np.random.permutation(len(labels))
+    for start in range(0, len(order), batch_size):
+        batch = order[start:start + batch_size]
+        classes, targets = np.unique(labels[batch], return_inverse=True)
+        if len(classes) < 2:
+            continue
+        x = torch.from_numpy(np.ascontiguousarray(storage.upcast(patches[batch]), dtype=np.float32)).to(device)
+        targets = torch.from_numpy(targets).to(device)
+        encoder.zero_grad()
+        features = encoder(mapping_tar(x))
+        prototypes = torch.stack([features[targets == c].mean(0) for c in range(len(classes))])
+        loss = F.cross_entropy(-torch.cdist(features, prototypes) ** 2, targets)
+        loss.backward()
+        for name, group in groups.items():
+            saliency[name] = saliency[name] + sum(
+                ((modules[bn].weight * modules[bn].weight.grad + modules[bn].bias * modules[bn].bias.grad) ** 2).detach().cpu().numpy()
+                for bn in group['bn'])
+    encoder.zero_grad()
+    mapping_tar.zero_grad()
+    return saliency
+
+def select_channels(saliency, ratio):
+    """
+    the most salient channels of every group, a fraction `ratio` of each group is pruned (at least one channel is kept)
+    :return: {name: sorted indices of the kept channels}
+    """
+    keep = {}
+    for name, scores in saliency.items():
+        size = max(1, int(round(len(scores) * (1 - ratio))))
+        keep[name] = np.sort(np.argsort(-scores, kind='stable')[:size])
+    return keep
+
+def prune_encoder(encoder, keep):
+    """
+    :param keep: {group name: indices of the kept channels}, select_channels
+    :return: new Encoder with only the kept channels and the weights of the original one
+    """
+    groups = channel_groups(encoder)
+    sizes = channels(encoder)
+    sizes.update({name: len(index) for name, index in keep.items()})
+    pruned = Encoder(n_dimension=encoder.n_dimension, patch_size=encoder.patch_size, emb_size=encoder.emb_size, dropout=encoder.dropout,
+                     inter_size=encoder.inter_size, spectral_residual=encoder.spectral_residual, branches=encoder.branches, channels=sizes)
+    state = encoder.state_dict()
+    for name, index in keep.items():
+        index = torch.as_tensor(np.asarray(index), dtype=torch.long, device=next(encoder.parameters()).device)
+        for module in groups[name]['out'] + groups[name]['bn']:
+            for key in ['weight', 'bias', 'running_mean', 'running_var']:
+                if module + '.' + key in state:
+                    state[module + '.' + key] = state[module + '.' + key].index_select(0, index)
+        for module in groups[name]['in']:
+            state[module + '.weight'] = state[module + '.weight'].index_select(1, index)
+    pruned.load_state_dict(state)
+    return pruned.to(next(encoder.parameters()).device)
@@ -0,0 +1,286 @@
+"""
+windowed access to hyperspectral scenes on disk, so that spatial windows and band subsets are read
+on demand instead of the whole cube. A reader exposes the (rows, columns, bands) shape and the dtype
+of the variable and serves read(rows, columns, bands):
+
+    .npy                    memory-mapped
+    .h5/.hdf5, v7.3 .mat    HDF5 datasets read chunk by chunk with h5py (MATLAB stores them transposed)
+    classic .mat (v4-v7)    scipy can only load the whole variable, it is loaded once on the first read
+
+A classic .mat scene can be converted once into a .npy file that is then memory-mapped:
+
+    python -m utils.scene_reader --input datasets/IP/indian_pines_corrected.mat --output datasets/IP/indian_pines_corrected.npy
+"""
+import argparse
+import hashlib
+import os
+import numpy as np
+import scipy.io as sio
+
+from . import storage
+
+HDF5_SIGNATURE = b'\x89HDF\r\n\x1a\n'
+
+
+def _slice(index, size):
+    if index is None:
+        return slice(0, size)
+    start, stop, step = index.indices(size)
+    if step != 1:
+        raise ValueError('windows are contiguous, got step {}'.format(step))
+    return slice(start, stop)
+
+def _find_key(path, names, key=None):
+    """
+    variable of the file: `key`, else the one named like the file (the convention of the datasets),
+    else the only variable of the file
+    """
+    if key is not None:
+        if key not in names:
+            raise KeyError('{} has no variable {}, it has {}'.format(path, key, names))
+        return key
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if stem in names:
+        return stem
+    if len(names) == 1:
+        return names[0]
+    raise KeyError('cannot tell the scene variable of {} among {}, give its key'.format(path, names))
+
+class SceneReader(object):
+    """
+    (rows, columns, bands) image or (rows, columns) mask of a file
+    """
+    shape = None
+    dtype = None
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    def read(self, rows=None, columns=None, bands=None):
+        """
+        :param rows, columns: slices of the window, None for the whole axis
+        :param bands: band indices to read (in any order), None for all of them. Ignored for masks
+        :return: (len(rows), len(columns), len(bands)) or (len(rows), len(columns)) array
+        """
+        rows, columns = _slice(rows, self.shape[0]), _slice(columns, self.shape[1])
+        if self.ndim == 2 or bands is None:
+            return self._read(rows, columns, None)
+        bands = np.asarray(bands, dtype=np.int64)
+        # the backends want increasing band indices
+        unique, inverse = np.unique(bands, return_inverse=True)
+        window = self._read(rows, columns, unique)
+        return window if len(unique) == len(bands) and np.all(unique == bands) else window[:, :, inverse]
+
+    def _read(self, rows, columns, bands):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class NpyReader(SceneReader):
+    def __init__(self, path):
+        self.array = np.load(path, mmap_mode='r')
+        self.shape, self.dtype = self.array.shape, self.array.dtype
+
+    def _read(self, rows, columns, bands):
+        window = self.array[rows, columns]
+        return np.array(window if bands is None else window[:, :, bands])
+
+class MatReader(SceneReader):
+    """
+    classic .mat file, the variable is only loaded by the first read
+    """
+    def __init__(self, path, key=None):
+        variables = {name: shape for name, shape, _ in sio.whosmat(path)}
+        self.path = path
+        self.key = _find_key(path, sorted(variables), key)
+        self.shape = tuple(variables[self.key])
+        self.array = None
+
+    @property
+    def dtype(self):
+        return self._load().dtype
+
+    def _load(self):
+        if self.array is None:
+            self.array = sio.loadmat(self.path, variable_names=[self.key])[self.key]
+        return self.array
+
+    def _read(self, rows, columns, bands):
+        window = self._load()[rows, columns]
+        return np.array(window if bands is None else window[:, :, bands])
+
+    def close(self):
+        self.array = None
+
+class HDF5Reader(SceneReader):
+    """
+    HDF5 dataset, only the chunks of a window are read. v7.3 .mat files hold the MATLAB
+    arrays transposed, (bands, columns, rows), they are turned back to (rows, columns, bands)
+    """
+    def __init__(self, path, key=None, transposed=None):
+        try:
+            import h5py
+        except ImportError:
+            raise ImportError('reading {} needs h5py (pip install h5py)'.format(path))
+        self.file = h5py.File(path, 'r')
+        names = sorted(name for name, value in self.file.items() if isinstance(value, h5py.Dataset) and not name.startswith('#'))
+        self.key = _find_key(path, names, key)
+        self.dataset = self.file[self.key]
+        if transposed is None:
+            transposed = path.endswith('.mat') or 'MATLAB_class' in self.dataset.attrs
+        self.transposed = transposed
+        self.shape = tuple(reversed(self.dataset.shape)) if transposed else tuple(self.dataset.shape)
+        self.dtype = self.dataset.dtype
+
+    def _read(self, rows, columns, bands):
+        if not self.transposed:
+            return self.dataset[rows, columns] if bands is None else self.dataset[rows, columns, bands]
+        if self.ndim == 2:
+            return self.dataset[columns, rows].T
+        window = self.dataset[:, columns, rows] if bands is None else self.dataset[bands, columns, rows]
+        return window.transpose(2, 1, 0)
+
+    def close(self):
+        self.file.close()
+
+def is_hdf5(path):
+    with open(path, 'rb') as f:
+        # MATLAB v7.3 files have a 512 byte header before the HDF5 superblock
+        head = f.read(8)
+        f.seek(512)
+        return head == HDF5_SIGNATURE or f.read(8) == HDF5_SIGNATURE
+
+def open_scene(path, key=None):
+    """
+    :param key: variable of a .mat or HDF5 file, by default the one named like the file or the only one
+    """
+    if path.endswith('.npy'):
+        return NpyReader(path)
+    if path.endswith(('.h5', '.hdf5')) or is_hdf5(path):
+        return HDF5Reader(path, key)
+    return MatReader(path, key)
+
+def read_all(path, key=None):
+    """
+    whole variable of a file, for the ground truth masks
+    """
+    reader = open_scene(path, key)
+    data = reader.read()
+    reader.close()
+    return data
+
+def row_blocks(reader, block_rows=64):
+    for start in range(0, reader.shape[0], block_rows):
+        yield slice(start, min(start + block_rows, reader.shape[0]))
+
+def band_stats(reader, bands=None, block_rows=64):
+    """
+    per band mean and standard deviation of the scene, accumulated over row blocks
+    (Chan et al. pairwise update). As in sklearn.preprocessing.scale, a constant band gets std 1
+    :return: float64 mean, std
+    """
+    count, mean, m2 = 0, 0., 0.
+    for rows in row_blocks(reader, block_rows):
+        block = reader.read(rows, None, bands).astype(np.float64)
+        block = block.reshape(-1, block.shape[-1])
+        block_mean = block.mean(0)
+        block_m2 = ((block - block_mean) ** 2).sum(0)
+        delta = block_mean - mean
+        total = count + len(block)
+        mean = mean + delta * len(block) / total
+        m2 = m2 + block_m2 + delta ** 2 * count * len(block) / total
+        count = total
+    std = np.sqrt(m2 / count)
+    std[std < 10 * np.finfo(np.float64).eps] = 1.
+    return mean, std
+
+def cache_path(cache_dir, path, HalfWidth, storage_dtype, bands=None):
+    """
+    file of the padded scene of `path` in cache_dir, per padding, storage dtype and band subset
+    """
+    name = '{}_hw{}_{}'.format(os.path.splitext(os.path.basename(path))[0], HalfWidth, storage_dtype)
+    if bands is not None:
+        name += '_' + hashlib.md5(np.asarray(bands, dtype=np.int64).tobytes()).hexdigest()[:8]
+    return os.path.join(cache_dir, name + '.npy')
+
+def padded_scene(reader, HalfWidth, bands=None, storage_dtype='float32', block_rows=64, path=None, source=None):
+    """
+    per band standardized scene, zero padded by HalfWidth, in its storage dtype (utils.storage),
+    written row block by row block. Only one block of the source is in memory at a time.
+    :param path: write the cube to this .npy file and return it memory-mapped, for scenes that do
+                 not fit in memory. An existing file newer than `source` is reused as it is
+    :return: (rows + 2 HalfWidth, columns + 2 HalfWidth, bands) array
+    """
+    if path is not None and os.path.exists(path) and (source is None or os.path.getmtime(path) >= os.path.getmtime(source)):
+        return np.load(path, mmap_mode='r')
+    mean, std = band_stats(reader, bands, block_rows)
+    nRow, nColumn = reader.shape[:2]
+    shape = (nRow + 2 * HalfWidth, nColumn + 2 * HalfWidth, len(mean))
+    dtype = storage.to_storage(np.zeros(1, dtype=np.float32), storage_dtype).dtype
+    if path is not None:
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_path = path + '.tmp.npy'
+        padded = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=shape)
+        padded[:HalfWidth] = 0
+        padded[nRow + HalfWidth:] = 0
+        padded[:, :HalfWidth] = 0
+        padded[:, nColumn + HalfWidth:] = 0
+    else:
+        padded = np.zeros(shape, dtype=dtype)
+    for rows in row_blocks(reader, block_rows):
+        block = (reader.read(rows, None, bands) - mean) / std
+        padded[rows.start + HalfWidth:rows.stop + HalfWidth, HalfWidth:HalfWidth + nColumn] = storage.to_storage(block, storage_dtype)
+    if path is not None:
+        padded.flush()
+        del padded
+        os.replace(tmp_path, path)
+        return np.load(path, mmap_mode='r')
+    return padded
+
+def cut_patches(reader, rows, columns, HalfWidth, bands=None, stats=None, block_rows=64):
+    """
+    standardized patches centered on pixels of the scene, zero outside of it. The scene is read
+    in row blocks (plus the HalfWidth rows around them) and only the blocks holding a pixel are read
+    :param stats: (mean, std) of band_stats, computed when not given
+    :return: (len(rows), 2 HalfWidth + 1, 2 HalfWidth + 1, bands) float32 array
+    """
+    mean, std = stats if stats is not None else band_stats(reader, bands, block_rows)
+    rows, columns = np.asarray(rows), np.asarray(columns)
+    nRow, nColumn = reader.shape[:2]
+    size = 2 * HalfWidth + 1
+    patches = np.zeros((len(rows), size, size, len(mean)), dtype=np.float32)
+    for block in row_blocks(reader, block_rows):
+        index = np.flatnonzero((rows >= block.start) & (rows < block.stop))
+        if len(index) == 0:
+            continue
+        start, stop = max(block.start - HalfWidth, 0), min(block.stop + HalfWidth, nRow)
+        window = np.zeros((block.stop - block.start + 2 * HalfWidth, nColumn + 2 * HalfWidth, len(mean)), dtype=np.float32)
+        offset = start - (block.start - HalfWidth)
+        window[offset:offset + stop - start, HalfWidth:HalfWidth + nColumn] = (reader.read(slice(start, stop), None, bands) - mean) / std
+        windows = np.lib.stride_tricks.sliding_window_view(window, (size, size), axis=(0, 1))
+        patches[index] = windows[rows[index] - block.start, columns[index]].transpose(0, 2, 3, 1)
+    return patches
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a scene (.mat, v7.3 .mat, HDF5) into a memory-mapped .npy file")
+    parser.add_argument('--input', type=str, required=True)
+    parser.add_argument('--output', type=str, required=True)
+    parser.add_argument('--key', type=str, default=None, help='variable of the scene, by default the one named like the file or the only one')
+    parser.add_argument('--block_rows', type=int, default=64)
+    args = parser.parse_args()
+
+    reader = open_scene(args.input, args.key)
+    print('{}: {} {}'.format(args.input, reader.shape, reader.dtype))
+    output = np.lib.format.open_memmap(args.output, mode='w+', dtype=reader.dtype, shape=reader.shape)
+    for rows in row_blocks(reader, args.block_rows):
+        output[rows] = reader.read(rows)
+    output.flush()
+    reader.close()
+    print('{}: {:.1f}MB'.format(args.output, os.path.getsize(args.output) / 1024. / 1024.))
+
+if __name__ == '__main__':
+    main()
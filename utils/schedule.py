@@ -0,0 +1,36 @@
+import math
+import torch
+
+
+def lr_factor(episode, lr_schedule, warmup_episode, total_episode):
+    """
+    multiplicative learning rate factor of an episode
+    :param lr_schedule: 'constant' or 'cosine'
+    :param warmup_episode: number of episodes of linear warmup, 0 for no warmup
+    :param total_episode: episode budget the cosine decays over
+    """
+    if episode < warmup_episode:
+        return (episode + 1) / warmup_episode
+    if lr_schedule == 'cosine':
+        progress = (episode - warmup_episode) / max(1, total_episode - warmup_episode)
+        return 0.5 * (1.0 + math.cos(math.pi * min(1.0, progress)))
+    if lr_schedule == 'constant':
+        return 1.0
+    raise ValueError('Unknown lr_schedule: {}'.format(lr_schedule))
+
+def get_lr_schedulers(optimizers, lr_schedule, warmup_episode, total_episode):
+    """
+    one LambdaLR per optimizer, stepped once per episode
+    """
+    def factor(episode):
+        return lr_factor(episode, lr_schedule, warmup_episode, total_episode)
+    return [torch.optim.lr_scheduler.LambdaLR(optimizer, lr_lambda=factor) for optimizer in optimizers]
+
+def early_stop(episode, best_episode, patience, min_episode):
+    """
+    True when the evaluation metric has not improved for `patience` episodes,
+    never before `min_episode` episodes have been run. patience 0 disables early stopping.
+    """
+    if patience <= 0 or episode + 1 < min_episode:
+        return False
+    return episode - best_episode >= patience
@@ -0,0 +1,98 @@
+"""
+compact storage of patch data: float16, or bfloat16 kept as the upper 16 bits of float32 in uint16
+arrays (numpy has no bfloat16). Compact arrays are only upcast to float32 when a batch is gathered.
+Patch stores can be written to disk as .npz files compressed chunk by chunk:
+
+    python -m utils.storage --input datasets/Chikusei_imdb_128_7_7.pickle --output datasets/Chikusei_imdb_128_7_7_bf16.npz --dtype bfloat16
+"""
+import argparse
+import json
+import os
+import pickle
+import numpy as np
+
+STORAGE_DTYPES = ['float32', 'float16', 'bfloat16']
+
+
+def to_storage(array, storage_dtype='float32'):
+    """
+    :param storage_dtype: 'float32', 'float16' or 'bfloat16'
+    """
+    if storage_dtype == 'float32':
+        return np.asarray(array, dtype=np.float32)
+    if storage_dtype == 'float16':
+        return np.asarray(array, dtype=np.float16)
+    if storage_dtype == 'bfloat16':
+        bits = np.ascontiguousarray(array, dtype=np.float32).view(np.uint32)
+        # round to nearest even on the 16 dropped bits
+        bits = bits + np.uint32(0x7FFF) + ((bits >> np.uint32(16)) & np.uint32(1))
+        return (bits >> np.uint32(16)).astype(np.uint16)
+    raise ValueError('Unknown storage dtype: {}'.format(storage_dtype))
+
+def upcast(array):
+    """
+    float32 version of a compact array, float32 arrays are returned as they are
+    """
+    if array.dtype == np.uint16:
+        return (array.astype(np.uint32) << np.uint32(16)).view(np.float32)
+    if array.dtype == np.float16:
+        return array.astype(np.float32)
+    return array
+
+def storage_dtype_of(array):
+    return {np.dtype(np.uint16): 'bfloat16', np.dtype(np.float16): 'float16'}.get(array.dtype, 'float32')
+
+def save(path, data, others=None, storage_dtype='float32', chunk_size=4096, compress=True):
+    """
+    write a patch array in chunks of chunk_size samples, each chunk is a separately compressed member
+    :param others: small arrays stored as they are (labels, ...)
+    """
+    data = to_storage(data, storage_dtype)
+    arrays = {'data_{:05d}'.format(i): data[start:start + chunk_size]
+              for i, start in enumerate(range(0, len(data), chunk_size))}
+    for name, value in (others or {}).items():
+        arrays[name] = np.asarray(value)
+    meta = {'shape': list(data.shape), 'storage_dtype': storage_dtype, 'chunk_size': chunk_size,
+            'num_chunks': len(range(0, len(data), chunk_size)), 'others': sorted(others or {})}
+    arrays['__meta__'] = np.array(json.dumps(meta))
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    (np.savez_compressed if compress else np.savez)(path, **arrays)
+
+def load(path):
+    """
+    :return: dict with 'data' (kept in its storage dtype) and the other arrays of the store
+    """
+    with np.load(path) as store:
+        meta = json.loads(str(store['__meta__']))
+        data = None
+        start = 0
+        for i in range(meta['num_chunks']):
+            chunk = store['data_{:05d}'.format(i)]
+            if data is None:
+                data = np.empty(meta['shape'], dtype=chunk.dtype)
+            data[start:start + len(chunk)] = chunk
+            start += len(chunk)
+        result = {name: store[name] for name in meta['others']}
+    result['data'] = data
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a patch pickle into a compact chunked store")
+    parser.add_argument('--input', type=str, required=True, help="pickle with 'data' and 'Labels'")
+    parser.add_argument('--output', type=str, required=True)
+    parser.add_argument('--dtype', type=str, default='bfloat16', choices=STORAGE_DTYPES)
+    parser.add_argument('--chunk_size', type=int, default=4096)
+    parser.add_argument('--no_compress', action='store_true')
+    args = parser.parse_args()
+
+    with open(args.input, 'rb') as handle:
+        imdb = pickle.load(handle)
+    others = {name: value for name, value in imdb.items() if name != 'data'}
+    save(args.output, imdb['data'], others, args.dtype, args.chunk_size, not args.no_compress)
+    print('{}: {:.1f}MB -> {}: {:.1f}MB'.format(args.input, os.path.getsize(args.input) / 1024. / 1024.,
+                                               args.output, os.path.getsize(args.output) / 1024. / 1024.))
+
+if __name__ == '__main__':
+    main()
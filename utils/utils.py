@@ -1,7 +1,5 @@
 import numpy as np
 import random
-import scipy.io as sio
-from sklearn import preprocessing
 import matplotlib.pyplot as plt
 import os
 import logging
@@ -10,6 +8,8 @@ import datetime
 import torch
 import torch.nn as nn
 
+from . import scene_reader
+
 def same_seeds(seed):
     torch.manual_seed(seed)
     if torch.cuda.is_available():
@@ -112,44 +112,32 @@ def flip(data):
     Data = np.concatenate((first, second, third), axis=0)
     return Data
 
-def load_data(image_file, label_file):
-    image_data = sio.loadmat(image_file)
-    label_data = sio.loadmat(label_file)
-
-    data_key = image_file.split('/')[-1].split('.')[0]
-    label_key = label_file.split('/')[-1].split('.')[0]
-    data_all = image_data[data_key]
-    GroundTruth = label_data[label_key]
+def load_data(image_file, label_file, bands=None):
+    """
+    per band standardized image and its ground truth, read through utils.scene_reader
+    :param bands: only read these bands (of a band-selected model), the scaling is per band so it is unchanged
+    """
+    reader = scene_reader.open_scene(image_file)
+    GroundTruth = scene_reader.read_all(label_file)
 
-    [nRow, nColumn, nBand] = data_all.shape
-    print(data_key, nRow, nColumn, nBand)
+    [nRow, nColumn, nBand] = reader.shape
+    print(os.path.basename(image_file), nRow, nColumn, nBand)
 
-    data = data_all.reshape(np.prod(data_all.shape[:2]), np.prod(data_all.shape[2:]))
-    data_scaler = preprocessing.scale(data.astype(float))  # (X-X_mean)/X_std
-    Data_Band_Scaler = data_scaler.reshape(data_all.shape[0], data_all.shape[1],data_all.shape[2])
+    Data_Band_Scaler = scene_reader.padded_scene(reader, 0, bands)  # (X-X_mean)/X_std
+    reader.close()
 
     return Data_Band_Scaler, GroundTruth
 
-def load_data_houston(image_file, label_file,label_file1):
-    image_data = sio.loadmat(image_file)
-    label_data = sio.loadmat(label_file)
-    label_data1 = sio.loadmat(label_file1)
-
-    data_key = image_file.split('/')[-1].split('.')[0]
-    label_key = label_file.split('/')[-1].split('.')[0]
-    label_key1 = label_file1.split('/')[-1].split('.')[0]
-
-    data_all = image_data[data_key]  # dic-> narray , KSC:ndarray(512,217,204)
-    GroundTruth_train = label_data[label_key]
-    GroundTruth_test = label_data1[label_key1]
-
+def load_data_houston(image_file, label_file,label_file1, bands=None):
+    reader = scene_reader.open_scene(image_file)
+    GroundTruth_train = scene_reader.read_all(label_file)
+    GroundTruth_test = scene_reader.read_all(label_file1)
 
-    [nRow, nColumn, nBand] = data_all.shape
-    print(data_key, nRow, nColumn, nBand)
+    [nRow, nColumn, nBand] = reader.shape
+    print(os.path.basename(image_file), nRow, nColumn, nBand)
 
-    data = data_all.reshape(np.prod(data_all.shape[:2]), np.prod(data_all.shape[2:]))  # (111104,204)
-    data_scaler = preprocessing.scale(data)  #标准化 (X-X_mean)/X_std,
-    Data_Band_Scaler = data_scaler.reshape(data_all.shape[0], data_all.shape[1],data_all.shape[2])
+    Data_Band_Scaler = scene_reader.padded_scene(reader, 0, bands)  # 标准化 (X-X_mean)/X_std
+    reader.close()
 
     return Data_Band_Scaler, GroundTruth_train, GroundTruth_test  # image:(512,217,3),label:(512,217)
 
@@ -199,7 +187,8 @@ def set_logging_config(logdir, num_seeds):
     logging.basicConfig(format="[%(asctime)s] [%(levelname)s] %(message)s",
                         level=logging.INFO,
                         handlers=[logging.FileHandler(os.path.join(logdir, str(num_seeds) +'seeds_'+nowTime+'.log')),
-                                  logging.StreamHandler(os.sys.stdout)])
+                                  logging.StreamHandler(os.sys.stdout)],
+                        force=True)  # several targets trained in one process each get their own log file
 
 def euclidean_metric(a, b):
     n = a.shape[0]